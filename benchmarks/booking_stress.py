@@ -0,0 +1,151 @@
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import Counter
+from datetime import date, timedelta
+import logging
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+# Allows the script to be run from a checkout without installing the app
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src"))
+
+from reserv import create_app
+from reserv.bench.dataset import build_dataset, users_for_bookers
+
+
+def worker(user_id: str, db_path: str, dates: list, barrier, results):
+    """
+    Waits for every other worker then tries to book each of the dates for the
+    user in a random order through the Flask test client
+
+    Params
+    ------
+    user_id         The id of the user making the bookings
+    db_path         The path of the database file
+    dates           The dates to try to book
+    barrier         The barrier that releases every worker at once
+    results         The queue to put each (date, status code) result on
+    """
+    logging.disable(logging.INFO)
+
+    app = create_app()
+    app.config.update(DATABASE=db_path)
+    client = app.test_client()
+
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+
+    dates = random.sample(dates, len(dates))
+    barrier.wait()
+
+    for d in dates:
+        res = client.get("/handlers/set_booker", query_string={"date": d})
+        results.put((user_id, d, res.status_code))
+
+    results.put(None)
+
+
+def check_quota(db_path: str, window: int, limit: int) -> list:
+    """
+    Returns every (user, window start, count) where a user holds more than the
+    limit of bookings within the window
+
+    Params
+    ------
+    db_path         The path of the database file
+    window          The number of days in each quota period
+    limit           The maximum number of bookings in any quota period
+    """
+    db = sqlite3.connect(db_path)
+    rows = db.execute("SELECT user_id, date FROM schedule WHERE status = 'booked' "
+                      "AND date >= ?", (str(date.today()),)).fetchall()
+    db.close()
+
+    booked = {}
+
+    for user_id, d in rows:
+        booked.setdefault(user_id, []).append(date.fromisoformat(d))
+
+    violations = []
+
+    for user_id, dates in booked.items():
+        for start in dates:
+            end = start + timedelta(days=window - 1)
+            count = sum(start <= d <= end for d in dates)
+
+            if count > limit:
+                violations.append((user_id, str(start), count))
+
+    return violations
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Fire simultaneous bookings at the same dates from many "
+                    "processes and check for double bookings and quota "
+                    "violations",
+        formatter_class=ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("--workers", type=int, default=16, help="Number of worker processes, one user each")
+    parser.add_argument("--days", type=int, default=21, help="Number of dates every worker tries to book")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = vars(parser.parse_args())
+
+    random.seed(args["seed"])
+
+    with tempfile.TemporaryDirectory() as temp_path:
+        # Keeps the app log out of the current directory
+        os.chdir(temp_path)
+
+        db_path = os.path.join(temp_path, "schedule.db")
+        dataset = build_dataset(db_path,
+                                users=users_for_bookers(args["workers"]),
+                                years=0, future_days=0, seed=args["seed"])
+        bookers = dataset["bookers"][:args["workers"]]
+
+        dates = [str(date.today() + timedelta(days=i + 1))
+                 for i in range(args["days"])]
+
+        barrier = multiprocessing.Barrier(args["workers"])
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(
+            target=worker,
+            args=(user_id, db_path, dates, barrier, results)
+        ) for user_id in bookers]
+
+        for proc in procs:
+            proc.start()
+
+        responses = []
+        finished = 0
+
+        while finished < len(procs):
+            res = results.get()
+
+            if res is None:
+                finished += 1
+            else:
+                responses.append(res)
+
+        for proc in procs:
+            proc.join()
+
+        app = create_app()
+        window = app.config["QUOTA_WINDOW_DAYS"]
+        limit = app.config["QUOTA_MAX_BOOKINGS"]
+
+        wins = Counter(d for _, d, code in responses if code == 200)
+        double_booked = [d for d, count in wins.items() if count > 1]
+        violations = check_quota(db_path, window, limit)
+
+        print(f"{len(responses)} booking attempts, status codes: "
+              f"{dict(Counter(code for _, _, code in responses))}")
+        print(f"Double booked dates: {double_booked or 'none'}")
+        print(f"Quota violations: {violations or 'none'}")
+
+        sys.exit(1 if double_booked or violations else 0)
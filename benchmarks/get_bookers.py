@@ -0,0 +1,96 @@
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from datetime import date, timedelta
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Allows the script to be run from a checkout without installing the app
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src"))
+
+from flask import Flask
+
+from reserv.bench.dataset import build_dataset
+from reserv.data.db import get_db
+from reserv.data.query import get_booking_by_date, get_name_by_id
+from reserv.data.query import get_bookings_by_dates
+
+
+def legacy_lookup(dates: list):
+    """
+    Looks up the bookers one date at a time as get_bookers used to
+    """
+    for d in dates:
+        booking = get_booking_by_date(d)
+
+        if booking and booking["status"] == "booked":
+            get_name_by_id(booking["user_id"])
+
+
+def batched_lookup(dates: list):
+    """
+    Looks up the bookers for every date in a single query
+    """
+    get_bookings_by_dates(dates)
+
+
+def run(app: Flask, lookup, dates: list, iterations: int) -> dict:
+    """
+    Times the supplied lookup and counts the statements it runs per call
+
+    Params
+    ------
+    app             The Flask app providing the database config
+    lookup          The lookup function to time
+    dates           The list of dates to pass to the lookup
+    iterations      The number of times to run the lookup
+    """
+    timings = []
+    statements = []
+
+    with app.app_context():
+        db = get_db()
+        db.set_trace_callback(statements.append)
+
+        for _ in range(iterations):
+            start = time.perf_counter()
+            lookup(dates)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        db.set_trace_callback(None)
+
+    return {
+        "queries": len(statements) / iterations,
+        "p50": statistics.median(timings),
+        "p95": statistics.quantiles(timings, n=20)[-1]
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Compare the per-date and batched booker lookups",
+        formatter_class=ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("--users", type=int, default=50, help="Number of users")
+    parser.add_argument("--years", type=int, default=5, help="Years of booking history")
+    parser.add_argument("--days", type=int, default=14, help="Number of dates requested per poll")
+    parser.add_argument("--iterations", type=int, default=2000, help="Number of polls to time")
+    args = vars(parser.parse_args())
+
+    with tempfile.TemporaryDirectory() as temp_path:
+        app = Flask(__name__)
+        app.config["DATABASE"] = os.path.join(temp_path, "schedule.db")
+
+        build_dataset(app.config["DATABASE"], users=args["users"],
+                      years=args["years"], future_days=14)
+
+        week_start = date.today() - timedelta(days=date.today().weekday())
+        dates = [str(week_start + timedelta(days=i)) for i in range(args["days"])]
+
+        for name, lookup in (("before", legacy_lookup), ("after", batched_lookup)):
+            res = run(app, lookup, dates, args["iterations"])
+            print(f"{name:<8} queries/poll: {res['queries']:>5.1f}    "
+                  f"p50: {res['p50']:.3f} ms    p95: {res['p95']:.3f} ms")
@@ -0,0 +1,146 @@
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from datetime import date, timedelta
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+# Allows the script to be run from a checkout without installing the app
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src"))
+
+from reserv import create_app
+from reserv.bench.dataset import build_dataset, users_for_bookers
+
+# The connection settings compared by the benchmark
+MODES = {
+    "before": {
+        "DB_PERSISTENT": False,
+        "DB_PRAGMAS": {}
+    },
+    "after": {
+        "DB_PERSISTENT": True,
+        "DB_PRAGMAS": {
+            "journal_mode": "wal",
+            "synchronous": "normal",
+            "cache_size": -8000,
+            "mmap_size": 134217728,
+            "busy_timeout": 5000
+        }
+    }
+}
+
+
+def worker(worker_id: int, user_id: str, db_path: str, mode: dict,
+           duration: float, write_every: int, results):
+    """
+    Polls get_bookers through the Flask test client for the supplied duration,
+    booking and cancelling a date of its own every few requests
+
+    Params
+    ------
+    worker_id       The number of the worker, used to pick its date
+    user_id         The id of the user the worker is logged in as
+    db_path         The path of the database file
+    mode            The app config to apply for the run
+    duration        The number of seconds to run for
+    write_every     The number of polls between each write
+    results         The queue to put the request and error counts on
+    """
+    logging.disable(logging.INFO)
+
+    app = create_app()
+    app.config.update(DATABASE=db_path, **mode)
+    client = app.test_client()
+
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+
+    week_start = date.today() - timedelta(days=date.today().weekday())
+    dates = [str(week_start + timedelta(days=i)) for i in range(14)]
+    own_date = str(date.today() + timedelta(days=30 + worker_id * 7))
+
+    requests = 0
+    errors = 0
+    booked = False
+    end = time.perf_counter() + duration
+
+    while time.perf_counter() < end:
+        if requests % write_every == write_every - 1:
+            url = "/handlers/cancel_booking" if booked else "/handlers/set_booker"
+            res = client.get(url, query_string={"date": own_date})
+            booked = not booked if res.status_code == 200 else booked
+        else:
+            res = client.get("/handlers/get_bookers",
+                             query_string={"date_list[]": dates})
+
+        requests += 1
+        errors += res.status_code >= 500
+
+    results.put((requests, errors))
+
+
+def run(db_path: str, mode: dict, bookers: list, duration: float,
+        write_every: int) -> dict:
+    """
+    Runs a worker process for each of the bookers against the database and
+    returns the combined throughput and error count
+
+    Params
+    ------
+    db_path         The path of the database file
+    mode            The app config to apply for the run
+    bookers         The ids of the users the workers are logged in as
+    duration        The number of seconds to run for
+    write_every     The number of polls between each write
+    """
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(
+        target=worker,
+        args=(i, user_id, db_path, mode, duration, write_every, results)
+    ) for i, user_id in enumerate(bookers)]
+
+    for proc in procs:
+        proc.start()
+
+    counts = [results.get() for _ in procs]
+
+    for proc in procs:
+        proc.join()
+
+    return {
+        "rps": sum(c[0] for c in counts) / duration,
+        "errors": sum(c[1] for c in counts)
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Compare get_bookers throughput with per-request and "
+                    "persistent WAL connections across worker processes",
+        formatter_class=ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("--workers", type=int, default=8, help="Number of worker processes")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run each mode")
+    parser.add_argument("--write-every", type=int, default=20, help="Polls between each write per worker")
+    parser.add_argument("--years", type=int, default=5, help="Years of booking history")
+    args = vars(parser.parse_args())
+
+    with tempfile.TemporaryDirectory() as temp_path:
+        # Keeps the app log out of the current directory
+        os.chdir(temp_path)
+
+        for name, mode in MODES.items():
+            db_path = os.path.join(temp_path, f"{name}.db")
+            # Bookings stop before the dates the workers book themselves
+            dataset = build_dataset(db_path,
+                                    users=users_for_bookers(args["workers"]),
+                                    years=args["years"], future_days=14)
+
+            res = run(db_path, mode, dataset["bookers"][:args["workers"]],
+                      args["duration"], args["write_every"])
+            print(f"{name:<8} workers: {args['workers']}    "
+                  f"requests/sec: {res['rps']:>8.1f}    errors: {res['errors']}")
@@ -0,0 +1,101 @@
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from datetime import date, timedelta
+import copy
+import logging
+import logging.config
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import yaml
+
+# Allows the script to be run from a checkout without installing the app
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src"))
+
+from reserv import create_app
+from reserv.bench.dataset import build_dataset
+from reserv.tools.log_queue import start_log_queue, stop_log_queue
+
+
+def configure_logging(base: dict, log_path: str, level: str, use_queue: bool):
+    """
+    Applies the default logging config with the root level and log file
+    replaced, optionally moving the handlers onto the log queue
+
+    Params
+    ------
+    base            The logging section of the default config
+    log_path        The path of the log file to write to
+    level           The level of the root logger
+    use_queue       Whether to write the log from a background thread
+    """
+    config = copy.deepcopy(base)
+    config["handlers"]["file"]["filename"] = log_path
+    config["root"]["level"] = level
+
+    stop_log_queue()
+    logging.config.dictConfig(config)
+
+    if use_queue:
+        start_log_queue()
+
+
+def time_requests(client, dates: list, iterations: int) -> list:
+    """
+    Returns the latency in milliseconds of each get_bookers request
+    """
+    timings = []
+
+    for _ in range(iterations):
+        start = time.perf_counter()
+        client.get("/handlers/get_bookers", query_string={"date_list[]": dates})
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return timings
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Compare get_bookers latency with DEBUG logging on and off, "
+                    "writing the log directly and through the log queue",
+        formatter_class=ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("--iterations", type=int, default=2000, help="Number of requests per run")
+    args = vars(parser.parse_args())
+
+    config_path = os.path.join(current_dir, "../src/reserv/config-default.yaml")
+
+    with open(config_path) as f:
+        base = yaml.safe_load(f.read())["logging"]
+
+    with tempfile.TemporaryDirectory() as temp_path:
+        # Keeps the app log out of the current directory
+        os.chdir(temp_path)
+
+        app = create_app()
+        app.config["DATABASE"] = os.path.join(temp_path, "schedule.db")
+        dataset = build_dataset(app.config["DATABASE"], users=10, years=2)
+
+        client = app.test_client()
+
+        with client.session_transaction() as session:
+            session["user_id"] = dataset["bookers"][0]
+
+        week_start = date.today() - timedelta(days=date.today().weekday())
+        dates = [str(week_start + timedelta(days=i)) for i in range(14)]
+        log_path = os.path.join(temp_path, "app.log")
+
+        for level in ("DEBUG", "INFO"):
+            for use_queue in (False, True):
+                configure_logging(base, log_path, level, use_queue)
+                timings = time_requests(client, dates, args["iterations"])
+
+                mode = "queue" if use_queue else "direct"
+                print(f"{level:<6} {mode:<7} p50: {statistics.median(timings):.3f} ms    "
+                      f"p95: {statistics.quantiles(timings, n=20)[-1]:.3f} ms")
+
+        stop_log_queue()
@@ -0,0 +1,204 @@
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import Counter
+from datetime import date, timedelta
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# Allows the script to be run from a checkout without installing the app
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src"))
+
+from reserv import create_app
+from reserv.bench.dataset import build_dataset
+from reserv.tools.passwords import build_method, create_password_hasher
+
+PASSWORD = "correct horse battery staple"
+
+
+def percentile(samples: list, q: float) -> float:
+    """
+    Returns the q quantile of the samples rounded to a tenth
+
+    Params
+    ------
+    samples         The latencies in milliseconds
+    q               The quantile between 0 and 1
+    """
+    if not samples:
+        return 0.0
+
+    samples = sorted(samples)
+    return round(samples[max(int(len(samples) * q) - 1, 0)], 1)
+
+
+def login_burst(app, user_ids: list, logins: list):
+    """
+    Logs in as each of the users in turn through the Flask test client
+
+    Params
+    ------
+    app             The Flask app to drive
+    user_ids        The ids of the users to log in as
+    logins          The list to append each (latency ms, status code) to
+    """
+    client = app.test_client()
+
+    for user_id in user_ids:
+        t = time.perf_counter()
+        res = client.post("/auth/login", data={"user_id": user_id,
+                                               "password": PASSWORD})
+        logins.append(((time.perf_counter() - t) * 1000, res.status_code))
+
+
+def poller(app, user_id: str, stop, samples: list):
+    """
+    Polls get_bookers for the current fortnight until stopped, standing in
+    for the booking handlers the logins compete with
+
+    Params
+    ------
+    app             The Flask app to drive
+    user_id         The id of the logged in user
+    stop            The event that ends the polling
+    samples         The list to append each latency in milliseconds to
+    """
+    client = app.test_client()
+    today = date.today()
+    dates = [str(today + timedelta(days=i)) for i in range(14)]
+
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+
+    while not stop.is_set():
+        t = time.perf_counter()
+        client.get("/handlers/get_bookers", query_string={"date_list[]": dates})
+        samples.append((time.perf_counter() - t) * 1000)
+
+
+def run(setting: str, args: dict) -> dict:
+    """
+    Logs every user in from concurrent threads with passwords hashed by the
+    method and cost, while one thread polls get_bookers, and returns the
+    login throughput and latency and the get_bookers latency
+
+    Params
+    ------
+    setting         The hash method and cost as method:cost, e.g. scrypt:16384
+    args            The parsed command line arguments
+    """
+    method, _, cost = setting.rpartition(":")
+    users = args["threads"] * args["logins"]
+
+    with tempfile.TemporaryDirectory() as temp_path:
+        db_path = os.path.join(temp_path, "schedule.db")
+        dataset = build_dataset(db_path, users=users, years=1,
+                                seed=args["seed"])
+
+        app = create_app()
+        app.config.update(
+            DATABASE=db_path,
+            PASSWORD_METHOD=method,
+            PASSWORD_COST=int(cost),
+            PASSWORD_WORKERS=args["workers"],
+            PASSWORD_MAX_PENDING=args["max_pending"]
+        )
+        app.extensions["reserv_passwords"] = create_password_hasher(app)
+
+        # Every user shares one hash, which is as slow to check as their own
+        with app.app_context():
+            pwhash = app.extensions["reserv_passwords"].hash(PASSWORD)
+
+        db = sqlite3.connect(db_path)
+        db.execute("UPDATE user SET password = ?", (pwhash,))
+        db.commit()
+        user_ids = [row[0] for row in db.execute("SELECT user_id FROM user")]
+        db.close()
+
+        random.shuffle(user_ids)
+
+        logins = []
+        polls = []
+        stop = threading.Event()
+        watcher = threading.Thread(target=poller,
+                                   args=(app, dataset["bookers"][0], stop,
+                                         polls))
+        pool = [threading.Thread(
+            target=login_burst,
+            args=(app, user_ids[i::args["threads"]], logins)
+        ) for i in range(args["threads"])]
+
+        watcher.start()
+
+        # The get_bookers latency before the burst, for comparison
+        time.sleep(0.5)
+        baseline = list(polls)
+        start = time.perf_counter()
+
+        for thread in pool:
+            thread.start()
+
+        for thread in pool:
+            thread.join()
+
+        elapsed = time.perf_counter() - start
+        stop.set()
+        watcher.join()
+
+    statuses = Counter(code for _, code in logins)
+    during = polls[len(baseline):]
+
+    return {
+        "method": build_method(method, int(cost)),
+        "statuses": dict(statuses),
+        "logins_per_sec": round(statuses[302] / elapsed, 1),
+        "login_p50_ms": percentile([l for l, _ in logins], 0.5),
+        "login_p99_ms": percentile([l for l, _ in logins], 0.99),
+        "poll_p99_idle_ms": percentile(baseline, 0.99),
+        "poll_p99_burst_ms": percentile(during, 0.99)
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Log in from many concurrent threads with passwords "
+                    "hashed at different costs and compare the login "
+                    "throughput and the latency of get_bookers meanwhile",
+        formatter_class=ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("--setting", action="append", default=None,
+                        help="Hash method and cost as method:cost, can be "
+                             "repeated (default: scrypt:16384, scrypt:32768, "
+                             "pbkdf2:sha256:100000, pbkdf2:sha256:600000)")
+    parser.add_argument("--threads", type=int, default=16, help="Number of concurrent login threads")
+    parser.add_argument("--logins", type=int, default=8, help="Number of logins made by each thread")
+    parser.add_argument("--workers", type=int, default=2, help="Password hashing threads")
+    parser.add_argument("--max-pending", type=int, default=32, help="Hashes that can wait for a hashing thread")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = vars(parser.parse_args())
+
+    random.seed(args["seed"])
+    logging.disable(logging.CRITICAL)
+
+    # Keeps the app log out of the current directory
+    os.chdir(tempfile.mkdtemp())
+
+    settings = args["setting"] or ["scrypt:16384", "scrypt:32768",
+                                   "pbkdf2:sha256:100000",
+                                   "pbkdf2:sha256:600000"]
+
+    for setting in settings:
+        res = run(setting, args)
+
+        print(f"{res['method']}: {res['logins_per_sec']} logins/s, "
+              f"login p50 {res['login_p50_ms']} ms, "
+              f"p99 {res['login_p99_ms']} ms, "
+              f"get_bookers p99 {res['poll_p99_idle_ms']} ms idle and "
+              f"{res['poll_p99_burst_ms']} ms during the burst, "
+              f"status codes {res['statuses']}")
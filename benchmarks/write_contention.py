@@ -0,0 +1,176 @@
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import Counter
+from datetime import date, timedelta
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+# Allows the script to be run from a checkout without installing the app
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src"))
+
+from reserv import create_app
+from reserv.bench.dataset import build_dataset, users_for_bookers
+
+
+def booker(app, user_id: str, dates: list, results: list):
+    """
+    Books each of the dates for the user through the Flask test client
+
+    Params
+    ------
+    app             The Flask app to drive
+    user_id         The id of the user making the bookings
+    dates           The dates to book
+    results         The list to append each (latency ms, status code) to
+    """
+    client = app.test_client()
+
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+
+    for d in dates:
+        t = time.perf_counter()
+        res = client.get("/handlers/set_booker", query_string={"date": d})
+        results.append(((time.perf_counter() - t) * 1000, res.status_code))
+
+
+def worker(index: int, db_path: str, write_queue: bool, busy_timeout: int,
+           threads: int, user_ids: list, dates: list, barrier, results):
+    """
+    Waits for every other worker then books the dates from the supplied
+    number of threads, one user each
+
+    Params
+    ------
+    index           The index of the worker
+    db_path         The path of the database file
+    write_queue     Whether writes go through the write queue
+    busy_timeout    The number of milliseconds to wait for a locked database
+    threads         The number of booking threads
+    user_ids        The ids of every booker
+    dates           The dates of every booker, each thread books its own
+    barrier         The barrier that releases every worker at once
+    results         The queue to put the list of results on
+    """
+    logging.disable(logging.CRITICAL)
+
+    app = create_app()
+    app.config.update(
+        DATABASE=db_path,
+        DB_WRITE_QUEUE=write_queue,
+        QUOTA_MAX_BOOKINGS=len(dates[0]),
+        DB_PRAGMAS=dict(app.config["DB_PRAGMAS"], busy_timeout=busy_timeout)
+    )
+
+    samples = []
+    pool = [threading.Thread(
+        target=booker,
+        args=(app, user_ids[index * threads + i], dates[index * threads + i],
+              samples)
+    ) for i in range(threads)]
+
+    barrier.wait()
+
+    for thread in pool:
+        thread.start()
+
+    for thread in pool:
+        thread.join()
+
+    results.put(samples)
+
+
+def run(mode: str, args: dict) -> dict:
+    """
+    Runs every booker against a fresh database and returns the number of
+    bookings, the error rate and the write throughput
+
+    Params
+    ------
+    mode            Either "direct" or "queue"
+    args            The parsed command line arguments
+    """
+    bookers = args["processes"] * args["threads"]
+
+    with tempfile.TemporaryDirectory() as temp_path:
+        db_path = os.path.join(temp_path, "schedule.db")
+        dataset = build_dataset(db_path, users=users_for_bookers(bookers),
+                                years=0, future_days=0, seed=args["seed"])
+        user_ids = dataset["bookers"][:bookers]
+
+        # Every booker books its own dates so each request is a write
+        days = list(range(1, bookers * args["days"] + 1))
+        random.shuffle(days)
+        dates = [[str(date.today() + timedelta(days=d))
+                  for d in days[i::bookers]] for i in range(bookers)]
+
+        barrier = multiprocessing.Barrier(args["processes"] + 1)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(
+            target=worker,
+            args=(i, db_path, mode == "queue", args["busy_timeout"],
+                  args["threads"], user_ids, dates, barrier, results)
+        ) for i in range(args["processes"])]
+
+        for proc in procs:
+            proc.start()
+
+        barrier.wait()
+        start = time.perf_counter()
+        samples = []
+
+        for _ in procs:
+            samples += results.get()
+
+        elapsed = time.perf_counter() - start
+
+        for proc in procs:
+            proc.join()
+
+    statuses = Counter(code for _, code in samples)
+    errors = sum(count for code, count in statuses.items() if code >= 500)
+    latencies = sorted(latency for latency, _ in samples)
+
+    return {
+        "requests": len(samples),
+        "statuses": dict(statuses),
+        "error_rate": round(errors / len(samples), 4),
+        "bookings_per_sec": round(statuses[200] / elapsed, 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 1)
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Fire bookings from many concurrent bookers with and "
+                    "without the write queue and compare the error rate and "
+                    "write throughput",
+        formatter_class=ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("--processes", type=int, default=4, help="Number of worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="Number of bookers in each process")
+    parser.add_argument("--days", type=int, default=60, help="Number of dates every booker books")
+    parser.add_argument("--busy-timeout", type=int, default=100, help="Milliseconds SQLite waits on a locked database")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = vars(parser.parse_args())
+
+    random.seed(args["seed"])
+
+    # Keeps the app log out of the current directory
+    os.chdir(tempfile.mkdtemp())
+
+    for mode in ("direct", "queue"):
+        res = run(mode, args)
+
+        print(f"{mode}: {res['requests']} requests from "
+              f"{args['processes'] * args['threads']} bookers, "
+              f"error rate {res['error_rate']:.2%}, "
+              f"{res['bookings_per_sec']} bookings/s, "
+              f"p99 {res['p99_ms']} ms, status codes {res['statuses']}")
@@ -1,57 +1,377 @@
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from datetime import datetime
+import importlib.util
+import zipfile
+import hashlib
+import marshal
 import shutil
+import gzip
+import json
 import os
+import re
 import logging
 import sys
 
+# The minifiers and brotli are optional, the build falls back to the simple
+# minifiers below and skips the .br files without them
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # Define constants
 APP_NAME = "reserv"
 
+# The file listing the fingerprinted name of each static asset, read by the app
+MANIFEST_NAME = "manifest.json"
+
+# The asset types worth precompressing
+COMPRESS_EXTENSIONS = (".js", ".css", ".svg", ".json", ".txt", ".html")
+
+# The file in the app archive listing the SHA-256 of every other file in it
+BUILD_MANIFEST_NAME = "build_manifest.json"
 
-def create_build(dest_path: str, src_path: str, temp_path: str):
+# Every archive entry gets the same timestamp and permissions so building the
+# same source twice gives the same bytes
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ZIP_FILE_MODE = 0o644 << 16
+
+# Recorded in the release comment, a release whose comment matches the source
+# isn't built again
+HASH_COMMENT_PREFIX = "source-sha256:"
+
+
+def read_source(src_path: str) -> dict:
     """
-    Create a copy of the current app, excluding the ignore patterns and archive into a zip file
+    Read every file of the app that goes into the build, skipping the ignore
+    patterns, keyed by its path inside the app archive
 
     Params
     ------
-    dest_path       The path where the release will be saved
     src_path        The path of the src folder
-    temp_path       The path of the temporary working directory
+    """
+    app_path = os.path.join(src_path, APP_NAME)
+    ignore = generate_ignore_patterns()
+    files = {}
+
+    for root, dirs, names in os.walk(app_path):
+        ignored = ignore(root, dirs + names)
+        dirs[:] = sorted(d for d in dirs if d not in ignored)
+
+        for name in sorted(names):
+            if name in ignored:
+                continue
+
+            path = os.path.join(root, name)
+            arcname = os.path.relpath(path, app_path).replace(os.sep, "/")
+
+            with open(path, "rb") as f:
+                files[arcname] = f.read()
+
+    return files
+
+
+def hash_source(files: dict, script: bytes) -> str:
+    """
+    Hash the app files, the deploy script, this build script and the Python
+    version the bytecode is compiled for, which together decide the release
+
+    Params
+    ------
+    files           The app files keyed by their path inside the archive
+    script          The contents of deploy.py
+    """
+    with open(os.path.realpath(__file__), "rb") as f:
+        builder = f.read()
+
+    digest = hashlib.sha256()
+    digest.update(sys.implementation.cache_tag.encode("utf-8"))
+
+    for name, data in [("build.py", builder), ("deploy.py", script)] + sorted(files.items()):
+        digest.update(f"{name}\0{len(data)}\0".encode("utf-8"))
+        digest.update(data)
+
+    return digest.hexdigest()
+
+
+def get_release_hash(release_path: str) -> str:
+    """
+    Get the source hash recorded in an existing release, None if there is no
+    release or it has no hash
+
+    Params
+    ------
+    release_path    The path of the release zip file
     """
     try:
-        shutil.copytree(src_path, dest_path, ignore=generate_ignore_patterns())
-        shutil.make_archive(base_name=os.path.join(temp_path, APP_NAME), format="zip", root_dir=os.path.join(dest_path, APP_NAME))
-        logging.info(f"Created build for version {version}")
+        with zipfile.ZipFile(release_path) as release:
+            comment = release.comment.decode("utf-8")
 
-        shutil.rmtree(os.path.join(dest_path, APP_NAME))
-        logging.info(f"Deleted temporary copy of app in {dest_path}")
+    except Exception:
+        return None
+
+    if comment.startswith(HASH_COMMENT_PREFIX):
+        return comment[len(HASH_COMMENT_PREFIX):]
+
+    return None
 
-    except Exception as err:
-        logging.error(f"Could not create a zipped archive of the app, {err}")
-        sys.exit()
 
-def create_release(dest_path: str, temp_path: str, script_path: str, version: str):
+def compile_module(arcname: str, source: bytes) -> tuple:
     """
-    Copy deploy script to temp folder and archive into a zip file with the build
+    Compile a module into a hash checked .pyc, which stays valid whatever
+    modification time the deployed source ends up with. Returns the path of
+    the .pyc inside the archive and its contents
+
+    Params
+    ------
+    arcname         The path of the module inside the app archive
+    source          The source of the module
+    """
+    folder, name = os.path.split(arcname)
+    code = compile(source, f"{APP_NAME}/{arcname}", "exec", dont_inherit=True)
+
+    # Flags 0b11 mark the .pyc as hash based and checked against the source
+    data = (importlib.util.MAGIC_NUMBER + (0b11).to_bytes(4, "little") +
+            importlib.util.source_hash(source) + marshal.dumps(code))
+    cached = f"__pycache__/{name[:-3]}.{sys.implementation.cache_tag}.pyc"
+
+    return (f"{folder}/{cached}" if folder else cached), data
+
+
+def write_entry(archive: zipfile.ZipFile, arcname: str, data: bytes, compress: bool = True):
+    """
+    Write a file into the archive with a fixed timestamp and permissions
+
+    Params
+    ------
+    archive         The zip file to write to
+    arcname         The path of the file inside the archive
+    data            The contents of the file
+    compress        Whether to deflate the file
+    """
+    info = zipfile.ZipInfo(arcname, date_time=ZIP_DATE_TIME)
+    info.external_attr = ZIP_FILE_MODE
+    info.create_system = 3
+    info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+
+    archive.writestr(info, data, compresslevel=9 if compress else None)
+
+
+def create_build(release: zipfile.ZipFile, files: dict, source_hash: str, version: str):
+    """
+    Stream the app archive into the release, along with the built assets, the
+    compiled bytecode and a manifest of every file in the archive
+
+    Params
+    ------
+    release         The release zip file being written
+    files           The app files keyed by their path inside the archive
+    source_hash     The hash of the source the build is made from
+    version         The version of the build
+    """
+    static = {name[len("static/"):]: data for name, data in files.items() if name.startswith("static/")}
+
+    entries = dict(files)
+    entries.update({f"static/{name}": data for name, data in build_assets(static).items()})
+
+    for arcname, source in files.items():
+        if arcname.endswith(".py"):
+            try:
+                entries.update([compile_module(arcname, source)])
+            except SyntaxError as err:
+                logging.warning(f"Could not compile {arcname}, {err}")
+
+    manifest = {
+        "version": version.strip(),
+        "source_hash": source_hash,
+        "python": sys.implementation.cache_tag,
+        "files": {name: hashlib.sha256(data).hexdigest() for name, data in sorted(entries.items())}
+    }
+    entries[BUILD_MANIFEST_NAME] = json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+
+    info = zipfile.ZipInfo(f"{APP_NAME}.zip", date_time=ZIP_DATE_TIME)
+    info.external_attr = ZIP_FILE_MODE
+    info.create_system = 3
+
+    # The app archive is already compressed so it's stored as it is
+    with release.open(info, "w", force_zip64=True) as raw, zipfile.ZipFile(raw, "w") as archive:
+        for arcname in sorted(entries):
+            # Precompressed assets gain nothing from being deflated again
+            write_entry(archive, arcname, entries[arcname], compress=not arcname.endswith((".gz", ".br")))
+
+    logging.info(f"Created build of {len(entries)} files for version {version}")
+
+
+def create_release(dest_path: str, src_path: str, script_path: str, version: str, force: bool = False) -> bool:
+    """
+    Write the release zip file containing the app archive and the deploy script
+    in a single pass, unless the release already there was built from the same
+    source. Returns True if a new release was written
 
     Params
     ------
     dest_path       The path where the release will be saved
-    temp_path       The path of the temporary working directory
+    src_path        The path of the src folder
     script_path     The path of the deploy.py script
     version         The version of the build
+    force           Whether to build even if the source hasn't changed
     """
+    release_path = os.path.join(dest_path, f"{APP_NAME}-release-{version}.zip")
+    partial_path = f"{release_path}.partial"
+
     try:
-        shutil.copy(script_path, temp_path)
-        shutil.make_archive(base_name=os.path.join(dest_path, f"{APP_NAME}-release-{version}"), format="zip", root_dir=temp_path)
-        logging.info(f"Created app release for version {version}")
+        files = read_source(src_path)
+
+        with open(script_path, "rb") as f:
+            script = f.read()
+
+        source_hash = hash_source(files, script)
 
-        shutil.rmtree(temp_path)
-        logging.info(f"Deleted temp folder at {temp_path}")
+        if not force and get_release_hash(release_path) == source_hash:
+            logging.info(f"Source unchanged since the release at {release_path}, skipping the build")
+            return False
+
+        os.makedirs(dest_path, exist_ok=True)
+
+        # Written next to the release and renamed, so a failed build never
+        # leaves a broken release with a matching hash
+        with zipfile.ZipFile(partial_path, "w") as release:
+            release.comment = f"{HASH_COMMENT_PREFIX}{source_hash}".encode("utf-8")
+            create_build(release=release, files=files, source_hash=source_hash, version=version)
+            write_entry(release, "deploy.py", script)
+
+        os.replace(partial_path, release_path)
+        logging.info(f"Created app release for version {version} at {release_path}")
+        return True
 
     except Exception as err:
-        logging.warning(f"Error creating zipped archive for release, {err}")
+        logging.error(f"Error creating zipped archive for release, {err}")
+
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+
+        sys.exit()
+
+
+def minify_js(text: str) -> str:
+    """
+    Minify a script with rjsmin, or without it remove indentation, blank lines
+    and whole line comments, which keeps every statement on its own line
+
+    Params
+    ------
+    text            The script to minify
+    """
+    if rjsmin is not None:
+        return rjsmin.jsmin(text)
+
+    lines = []
+    in_comment = False
+    in_template = False
+
+    for line in text.splitlines():
+        stripped = line.strip()
+
+        # Lines inside a multi-line template literal are kept as they are
+        if in_template:
+            lines.append(line)
+        elif in_comment:
+            in_comment = "*/" not in stripped
+            continue
+        elif stripped.startswith("//") or not stripped:
+            continue
+        elif stripped.startswith("/*"):
+            in_comment = "*/" not in stripped
+            continue
+        else:
+            lines.append(stripped)
+
+        if (line.count("`") - line.count("\\`")) % 2:
+            in_template = not in_template
+
+    return "\n".join(lines) + "\n"
+
+
+def minify_css(text: str) -> str:
+    """
+    Minify a stylesheet with rcssmin, or without it remove comments and the
+    whitespace around braces, semicolons and commas
+
+    Params
+    ------
+    text            The stylesheet to minify
+    """
+    if rcssmin is not None:
+        return rcssmin.cssmin(text)
+
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\s*([{};,])\s*", r"\1", text)
+
+    # A space before a colon can be a descendant selector, only the one after
+    # it is safe to drop
+    text = re.sub(r":\s+", ":", text)
+
+    return text.replace(";}", "}").strip() + "\n"
+
+
+def build_assets(static: dict) -> dict:
+    """
+    Minify the scripts and stylesheets of the static folder and make a copy of
+    every asset named after a hash of its content along with .gz and .br
+    versions. Returns the new files, including the manifest used by the app,
+    keyed by their path in the static folder
+
+    Params
+    ------
+    static          The files of the static folder keyed by their path in it
+    """
+    minifiers = {".js": minify_js, ".css": minify_css}
+    manifest = {}
+    built = {}
+
+    for filename, data in sorted(static.items()):
+        base, ext = os.path.splitext(filename)
+
+        if filename == MANIFEST_NAME or filename.endswith((".gz", ".br")):
+            continue
+
+        if ext in minifiers:
+            data = minifiers[ext](data.decode("utf-8")).encode("utf-8")
+
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        hashed = f"{base}.{digest}{ext}"
+        built[hashed] = data
+
+        if ext in COMPRESS_EXTENSIONS:
+            # mtime=0 keeps the .gz the same for the same content
+            built[f"{hashed}.gz"] = gzip.compress(data, compresslevel=9, mtime=0)
+
+            if brotli is not None:
+                built[f"{hashed}.br"] = brotli.compress(data, quality=11)
+
+        manifest[filename] = hashed
+        logging.info(f"Built asset {hashed} from {filename}, {len(data)} bytes")
+
+    built[MANIFEST_NAME] = json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+
+    if brotli is None:
+        logging.info("Brotli is not installed, skipped the .br assets")
+
+    logging.info(f"Built the manifest of {len(manifest)} assets")
+    return built
 
 
 def get_version(src_path: str) -> str:
@@ -103,31 +423,6 @@ def generate_readme(dest_path: str):
         logging.warning(f"Could not create readme file, {err}")
 
 
-def clear_working_folders(paths: list):
-    """
-    Deletes each folder in the supplied list if it exists and create a new temp folder
-
-    Params
-    ------
-    paths       A list of paths to remove
-    """
-    # Delete the folders
-    for path in paths:
-        try:
-            shutil.rmtree(path)
-            logging.info(f"Removing folder at path {path}")
-        except:
-            pass
-
-    # Create the temp folder for zipping files
-    try:
-        os.makedirs(temp_path)
-        logging.info(f"New temp folder created at {temp_path}")
-    except Exception as err:
-        logging.error(f"Unable to create temp folder, {err}")
-        sys.exit()
-
-
 def generate_ignore_patterns():
     """
     Define files and folders to ignore when copying
@@ -177,10 +472,10 @@ if __name__ == "__main__":
     parser.add_argument("src", help="Location of the app to build (Note: This is the folder containing the app, i.e '.../src' not '.../src/app')")
     parser.add_argument("dest", help="Location to store the build")
     parser.add_argument("--log", nargs="?", default=log_default_path, help="Location to save deployment logs")
+    parser.add_argument("--force", action="store_true", help="Build even if the source hasn't changed since the last release")
     args = vars(parser.parse_args())
 
     # Define paths to directories
-    temp_path = os.path.join(current_dir, "temp")
     script_path = os.path.join(current_dir, "deploy.py")
     src_path = args["src"]
     log_path = args["log"]
@@ -193,7 +488,5 @@ if __name__ == "__main__":
         # Add the app version to the destination path
         dest_path = os.path.join(args["dest"], version)
 
-        clear_working_folders([dest_path, temp_path])
-        create_build(dest_path=dest_path, src_path=src_path, temp_path=temp_path)
-        create_release(dest_path=dest_path, script_path=script_path, temp_path=temp_path, version=version)
-        generate_readme(dest_path)
\ No newline at end of file
+        if create_release(dest_path=dest_path, src_path=src_path, script_path=script_path, version=version, force=args["force"]):
+            generate_readme(dest_path)
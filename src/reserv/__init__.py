@@ -1,93 +1,107 @@
 from flask import Flask
-import yaml
 import logging
-import logging.config
 import os
 
 from reserv.tools.log_filters import ConsoleFilter, WebRequestFilter
-
-def create_app():
-    app = Flask(__name__, instance_relative_config=True)
+from reserv.tools.startup import StartupProfile, make_dirs, load_config
+from reserv.tools.startup import configure_logging, read_key
+
+def create_app(instance_path: str = None):
+    """
+    Creates the Flask app
+
+    Params
+    ------
+    instance_path   The folder holding the config, key and data, the instance
+                    folder next to the package by default
+    """
+    app = Flask(__name__, instance_path=instance_path,
+                instance_relative_config=True)
+    profile = StartupProfile()
 
     # Create instance folder if it doesn't exist
-    try:
-        os.makedirs(app.instance_path)
+    with profile.phase("instance folder"):
+        make_dirs(app.instance_path)
 
-    except OSError:
-        pass
+    # Parsed and validated once, then reused until the file changes
+    with profile.phase("config"):
+        snapshot = load_config(app.instance_path)
 
-    config_path = os.path.join(app.instance_path, "config.yaml")
+    with profile.phase("logging"):
+        configure_logging(snapshot)
 
-    # Use the default config if there is no config in the instance folder
-    if not os.path.isfile(config_path):
-        current_dir = os.path.dirname(os.path.realpath(__file__))
-        config_path = os.path.join(current_dir, "config-default.yaml")
+    key_path = os.path.join(app.instance_path, snapshot.config["key_path"])
 
-    with open(config_path, "r") as f:
-        config = yaml.safe_load(f.read())
+    with profile.phase("key"):
+        try:
+            key = read_key(key_path)
 
-    # Create log folder if doesn't exist and configured to log to a file
-    try:
-        log_folder = os.path.dirname(
-            config["logging"]["handlers"]["file"]["filename"])
+        except:
+            logging.error("App key invalid or not found")
+            return
 
-        if not os.path.exists(log_folder):
-            os.makedirs(log_folder)
-    except:
-        pass
+    # Configures the app based on config params
+    app.config.from_mapping(snapshot.settings, SECRET_KEY = key)
 
-    # Configure logging
-    logging.config.dictConfig(config["logging"])
+    logging.info("Started app")
 
-    key_path = os.path.join(app.instance_path, config["key_path"])
+    with profile.phase("storage"):
+        from .data.storage import create_storage
+        app.extensions["reserv_storage"] = create_storage(app)
+        logging.info("Using %s storage", app.config["STORAGE_BACKEND"])
 
-    # Generate a new key if there is no key in the instance folder
-    if not os.path.isfile(key_path):
-        from .tools.generate_key import generate_key
-        generate_key(key_path)
+        from .tools.passwords import create_password_hasher
+        app.extensions["reserv_passwords"] = create_password_hasher(app)
 
-    try:
-        with open(key_path, "r") as f:
-            key = f.read()
+    # Registered before the blueprints so the request timer starts first
+    if app.config["METRICS_ENABLED"]:
+        with profile.phase("metrics"):
+            from .tools.metrics import init_metrics
+            init_metrics(app)
 
-    except:
-        logging.error("App key invalid or not found")
-        return
-    
-    # Configures the app based on config params
-    app.config.from_mapping(
-        SECRET_KEY = key,
-        DATABASE = os.path.join(app.instance_path, config["db_path"])
-    )
+            from .views.metrics import metrics_bp
+            app.register_blueprint(metrics_bp)
+            logging.info("Registered metrics view blueprint")
 
-    logging.info("Started app")
+    # Uses the fingerprinted and precompressed static files of a build
+    with profile.phase("assets"):
+        from .tools.assets import init_assets
+        init_assets(app)
 
     # Registers the blueprints for each view
-    from .views.schedule import schedule_bp
-    app.register_blueprint(schedule_bp)
-    logging.info("Registered schedule view blueprint")
-
-    from .views.auth import auth_bp
-    app.register_blueprint(auth_bp)
-    logging.info("Registered auth view blueprint")
-
-    from .views.account import account_bp
-    app.register_blueprint(account_bp)
-    logging.info("Registered account view blueprint")
-
-    from .views.admin import admin_bp
-    app.register_blueprint(admin_bp)
-    logging.info("Registered admin view blueprint")
+    with profile.phase("schedule view"):
+        from .views.schedule import schedule_bp
+        app.register_blueprint(schedule_bp)
+        logging.info("Registered schedule view blueprint")
+
+    with profile.phase("auth view"):
+        from .views.auth import auth_bp
+        app.register_blueprint(auth_bp)
+        logging.info("Registered auth view blueprint")
+
+    with profile.phase("account view"):
+        from .views.account import account_bp
+        app.register_blueprint(account_bp)
+        logging.info("Registered account view blueprint")
+
+    with profile.phase("admin view"):
+        from .views.admin import admin_bp
+        app.register_blueprint(admin_bp)
+        logging.info("Registered admin view blueprint")
 
     # Registers the schedule handler for asynchronous requests
-    from .handlers.schedule_handler import schedule_handler_bp
-    app.register_blueprint(schedule_handler_bp)
-    logging.info("Registered schedule handler blueprint")
+    with profile.phase("schedule handler"):
+        from .handlers.schedule_handler import schedule_handler_bp
+        app.register_blueprint(schedule_handler_bp)
+        logging.info("Registered schedule handler blueprint")
 
     app.add_url_rule("/", endpoint="index")
 
     # Registers the click commands
-    from .data.db import init_app
-    init_app(app)
-    
+    with profile.phase("commands"):
+        from .data.db import init_app
+        init_app(app)
+
+    app.extensions["reserv_startup"] = profile.phases
+
     return app
\ No newline at end of file
@@ -0,0 +1,123 @@
+from flask import current_app
+from flask.cli import with_appcontext
+from datetime import datetime
+
+import shutil
+import tempfile
+import platform
+import sqlite3
+import random
+import click
+import json
+import os
+
+from ..data.storage import create_storage
+from .dataset import build_dataset
+
+# The handlers driven by the benchmark
+SCENARIOS = ("get_bookers", "set_booker", "cancel_booking", "check_perm", "index")
+
+
+@click.command("bench")
+@click.option("--users", default=200, help="Number of users in the dataset")
+@click.option("--years", default=3, help="Years of booking history")
+@click.option("--requests", "num_requests", default=500,
+              help="Number of requests per scenario")
+@click.option("--warmup", default=20, help="Untimed requests per scenario")
+@click.option("--scenario", "scenarios", multiple=True,
+              type=click.Choice(SCENARIOS), default=SCENARIOS,
+              help="Scenario to run, can be repeated")
+@click.option("--server", type=click.Choice(["test-client", "wsgi", "both"]),
+              default="both", help="How to drive the app")
+@click.option("--workers", default=4, help="WSGI worker processes")
+@click.option("--concurrency", default=8, help="Concurrent WSGI requests")
+@click.option("--db", "db_path", default=None,
+              help="Where to build the dataset, a temporary file by default")
+@click.option("--output", default=None, help="File to write the JSON report to")
+@click.option("--seed", default=0, help="Random seed")
+@click.option("--storage", type=click.Choice(["sqlite", "memory"]),
+              default="sqlite", help="Storage backend to serve the data from")
+@with_appcontext
+def bench_command(users, years, num_requests, warmup, scenarios, server,
+                  workers, concurrency, db_path, output, seed, storage):
+    """
+    Defines a click command that benchmarks the booking handlers against a
+    synthetic database and reports the results as JSON
+    """
+    # The runner and the server, client and process modules it uses are only
+    # imported when the benchmark runs, not by every app that registers it
+    from .runner import (make_requests, install_statement_counter,
+                         make_cookies, run_test_client, run_wsgi_server,
+                         summarise)
+
+    app = current_app._get_current_object()
+    temp_dir = tempfile.TemporaryDirectory()
+
+    if db_path is None:
+        db_path = os.path.join(temp_dir.name, "bench.db")
+
+    dataset = build_dataset(db_path, users=users, years=years, seed=seed)
+    install_statement_counter(app)
+
+    cookies = make_cookies(app, dataset["bookers"] + [dataset["admin"]])
+    modes = ["test-client", "wsgi"] if server == "both" else [server]
+    results = {}
+
+    for scenario in scenarios:
+        for mode in modes:
+            # Every run starts from a fresh copy of the dataset so writes made
+            # by earlier runs don't change the results
+            run_path = os.path.join(temp_dir.name, f"{scenario}-{mode}.db")
+            shutil.copyfile(db_path, run_path)
+            app.config["DATABASE"] = run_path
+
+            # WSGI workers each get their own copy of in-memory data, so
+            # writes made by one worker aren't seen by the others
+            if storage == "memory":
+                app.config.update(STORAGE_BACKEND="memory",
+                                  STORAGE_SEED=run_path)
+                app.extensions["reserv_storage"] = create_storage(app)
+
+            rng = random.Random(seed)
+            requests = make_requests(scenario, dataset, warmup + num_requests,
+                                     rng)
+
+            if mode == "test-client":
+                run_test_client(app, requests[:warmup], cookies)
+                samples, elapsed = run_test_client(app, requests[warmup:],
+                                                   cookies)
+            else:
+                samples, elapsed = run_wsgi_server(app, requests, cookies,
+                                                   workers, concurrency, warmup)
+
+            results.setdefault(scenario, {})[mode] = summarise(samples, elapsed)
+            click.echo(f"{scenario} ({mode}): "
+                       f"{results[scenario][mode]['throughput']} req/s", err=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "users": users,
+            "years": years,
+            "bookings": dataset["bookings"],
+            "requests": num_requests,
+            "workers": workers,
+            "concurrency": concurrency,
+            "seed": seed,
+            "storage": storage
+        },
+        "results": results
+    }
+
+    temp_dir.cleanup()
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+        click.echo(f"Wrote benchmark report to {output}", err=True)
+
+    else:
+        click.echo(json.dumps(report, indent=2))
@@ -0,0 +1,115 @@
+from datetime import date, timedelta
+from werkzeug.security import generate_password_hash
+
+import random
+import sqlite3
+import logging
+import os
+
+from ..data.db import get_release_db_version
+
+# Role ids seeded by the schema
+ADMIN_ROLE = 1
+USER_ROLE = 2
+GUEST_ROLE = 3
+
+
+def users_for_bookers(bookers: int) -> int:
+    """
+    Returns the number of users build_dataset needs to create for the summary
+    to list at least the supplied number of bookers
+
+    Params
+    ------
+    bookers         The number of users with the user role needed
+    """
+    users = bookers + 1
+
+    # The first user is an admin and every tenth after it a guest
+    while (users - 1) - (users - 1) // 10 < bookers:
+        users += 1
+
+    return users
+
+
+def build_dataset(db_path: str, users: int, years: int, future_days: int = 60,
+                  seed: int = 0) -> dict:
+    """
+    Creates a synthetic schedule database from the release schema with the
+    supplied number of users and years of booking history, returns a summary
+    of the users and upcoming bookings for the benchmark scenarios
+
+    Params
+    ------
+    db_path         The path of the database file to create
+    users           The number of users to create, the first is an admin and
+                    every tenth a guest
+    years           The number of years of booking history up to today
+    future_days     The number of days from today to fill with bookings
+    seed            The random seed used to generate the bookings
+    """
+    rng = random.Random(seed)
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    schema_path = os.path.join(
+        current_dir, f"../data/schema_v{get_release_db_version()}.sql")
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    db = sqlite3.connect(db_path)
+
+    with open(schema_path) as f:
+        db.executescript(f.read())
+
+    # Every user shares one hash as hashing thousands of passwords is slow
+    password = generate_password_hash("password")
+    user_ids = [f"user{i}" for i in range(users)]
+    roles = {}
+
+    for i, user_id in enumerate(user_ids):
+        if i == 0:
+            roles[user_id] = ADMIN_ROLE
+        elif i % 10 == 0:
+            roles[user_id] = GUEST_ROLE
+        else:
+            roles[user_id] = USER_ROLE
+
+    db.executemany(
+        "INSERT INTO user (user_id, display_name, password) VALUES (?,?,?)",
+        [(user_id, f"User {i}", password) for i, user_id in enumerate(user_ids)]
+    )
+    db.executemany(
+        "INSERT INTO user_role (user_id, role_id) VALUES (?,?)",
+        list(roles.items())
+    )
+
+    bookers = [u for u, role in roles.items() if role == USER_ROLE] or user_ids
+    start = date.today() - timedelta(days=365 * years)
+    bookings = []
+    upcoming = []
+
+    for i in range((date.today() - start).days + future_days):
+        booking_date = start + timedelta(days=i)
+
+        if rng.random() < 0.8:
+            booker = rng.choice(bookers)
+            status = "booked" if rng.random() < 0.9 else "cancelled"
+            bookings.append((str(booking_date), booker, status))
+
+            if booking_date >= date.today() and status == "booked":
+                upcoming.append((str(booking_date), booker))
+
+    db.executemany(
+        "INSERT INTO schedule (date, user_id, status) VALUES (?,?,?)", bookings)
+    db.commit()
+    db.close()
+
+    logging.info("Built benchmark dataset with %s users and %s bookings",
+                 users, len(bookings))
+
+    return {
+        "admin": user_ids[0],
+        "bookers": bookers,
+        "upcoming": upcoming,
+        "bookings": len(bookings)
+    }
@@ -0,0 +1,266 @@
+from flask import g, has_app_context
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.parse import urlencode
+from werkzeug.serving import make_server
+
+import http.client
+import multiprocessing
+import statistics
+import logging
+import random
+import socket
+import time
+
+from ..data.db import get_db
+
+# The response header carrying the number of statements run by a request
+STATEMENTS_HEADER = "X-Bench-Statements"
+
+
+def make_requests(scenario: str, dataset: dict, count: int,
+                  rng: random.Random) -> list:
+    """
+    Returns a list of (user id, path, params) requests for the scenario
+
+    Params
+    ------
+    scenario        The name of the scenario
+    dataset         The summary returned by build_dataset
+    count           The number of requests to generate
+    rng             The random generator used to pick users and dates
+    """
+    today = date.today()
+    week_start = today - timedelta(days=today.weekday())
+    week = [str(week_start + timedelta(days=i)) for i in range(14)]
+    users = dataset["bookers"] + [dataset["admin"]]
+    requests = []
+
+    for _ in range(count):
+        if scenario == "get_bookers":
+            requests.append((rng.choice(users), "/handlers/get_bookers",
+                             {"date_list[]": week}))
+
+        elif scenario == "set_booker":
+            booking_date = today + timedelta(days=rng.randrange(1, 730))
+            requests.append((rng.choice(dataset["bookers"]),
+                             "/handlers/set_booker",
+                             {"date": str(booking_date)}))
+
+        elif scenario == "cancel_booking":
+            # Owners can cancel their own booking again once it's cancelled
+            booking_date, owner = rng.choice(dataset["upcoming"])
+            requests.append((owner, "/handlers/cancel_booking",
+                             {"date": booking_date}))
+
+        elif scenario == "check_perm":
+            requests.append((rng.choice(users), "/handlers/check_perm",
+                             {"perm": rng.choice(["manage", "book", "view"])}))
+
+        else:
+            requests.append((rng.choice(users), "/", {}))
+
+    return requests
+
+
+def install_statement_counter(app):
+    """
+    Counts the SQL statements run by each request and returns the count in a
+    response header, the hook runs before the logged in user is loaded
+
+    Params
+    ------
+    app             The Flask app to instrument
+    """
+    def count_statement(statement):
+        # Statements run by triggers are reported with a leading comment
+        if has_app_context() and not statement.startswith("--"):
+            g.bench_statements = g.get("bench_statements", 0) + 1
+
+    def start_count():
+        g.bench_statements = 0
+        get_db().set_trace_callback(count_statement)
+
+    def finish_count(response):
+        response.headers[STATEMENTS_HEADER] = str(g.get("bench_statements", 0))
+        return response
+
+    app.before_request_funcs.setdefault(None, []).insert(0, start_count)
+    app.after_request(finish_count)
+
+
+def make_cookies(app, user_ids: list) -> dict:
+    """
+    Returns the Cookie header value that logs in each of the supplied users
+
+    Params
+    ------
+    app             The Flask app whose secret key signs the sessions
+    user_ids        The ids of the users to log in
+    """
+    serializer = app.session_interface.get_signing_serializer(app)
+    name = app.config["SESSION_COOKIE_NAME"]
+
+    return {u: f"{name}={serializer.dumps({'user_id': u})}" for u in user_ids}
+
+
+def send_test_requests(app, requests: list, cookies: dict) -> tuple:
+    """
+    Sends the requests one at a time through the Flask test client, returns
+    the (latency ms, status, statements) samples and the elapsed seconds
+
+    Params
+    ------
+    app             The Flask app to drive
+    requests        The (user id, path, params) requests to send
+    cookies         The Cookie header value of each user
+    """
+    client = app.test_client(use_cookies=False)
+    samples = []
+    start = time.perf_counter()
+
+    for user_id, path, params in requests:
+        t = time.perf_counter()
+        res = client.get(path, query_string=params,
+                         headers={"Cookie": cookies[user_id]})
+        latency = (time.perf_counter() - t) * 1000
+
+        samples.append((latency, res.status_code,
+                        int(res.headers.get(STATEMENTS_HEADER, 0))))
+
+    return samples, time.perf_counter() - start
+
+
+def run_test_client(app, requests: list, cookies: dict) -> tuple:
+    """
+    Sends the requests through the Flask test client from a thread with no
+    app context, so each request pushes its own and its connection is closed
+    when it ends as in a server, instead of every request reusing the app
+    context of the bench command
+
+    Params
+    ------
+    app             The Flask app to drive
+    requests        The (user id, path, params) requests to send
+    cookies         The Cookie header value of each user
+    """
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(send_test_requests, app, requests, cookies).result()
+
+
+def serve(app, fd: int, port: int):
+    """
+    Serves the app from a forked worker on the socket shared by every worker
+
+    Params
+    ------
+    app             The Flask app to serve
+    fd              The file descriptor of the listening socket
+    port            The port the socket is bound to
+    """
+    server = make_server("127.0.0.1", port, app, threaded=True, fd=fd)
+    server.serve_forever()
+
+
+def send_request(port: int, user_id: str, path: str, params: dict,
+                 cookies: dict) -> tuple:
+    """
+    Sends a single request to the WSGI server and returns the (latency ms,
+    status, statements) sample, status is 0 if the request failed
+    """
+    url = f"{path}?{urlencode(params, doseq=True)}" if params else path
+    t = time.perf_counter()
+
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        conn.request("GET", url, headers={"Cookie": cookies[user_id]})
+        res = conn.getresponse()
+        res.read()
+        conn.close()
+
+    except Exception as err:
+        logging.warning("Benchmark request to %s failed, %s", path, err)
+        return (time.perf_counter() - t) * 1000, 0, 0
+
+    return ((time.perf_counter() - t) * 1000, res.status,
+            int(res.getheader(STATEMENTS_HEADER, 0)))
+
+
+def run_wsgi_server(app, requests: list, cookies: dict, workers: int,
+                    concurrency: int, warmup: int) -> tuple:
+    """
+    Forks the supplied number of worker processes sharing one listening socket
+    and sends the requests from concurrent client threads, returns the
+    samples and the elapsed seconds of the timed requests
+
+    Params
+    ------
+    app             The Flask app to serve
+    requests        The (user id, path, params) requests to send
+    cookies         The Cookie header value of each user
+    workers         The number of worker processes
+    concurrency     The number of requests in flight at once
+    warmup          The number of requests to send before timing
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(1024)
+    port = sock.getsockname()[1]
+
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=serve, args=(app, sock.fileno(), port),
+                         daemon=True) for _ in range(workers)]
+
+    for proc in procs:
+        proc.start()
+
+    def send(request):
+        return send_request(port, request[0], request[1], request[2], cookies)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(send, requests[:warmup]))
+
+            start = time.perf_counter()
+            samples = list(pool.map(send, requests[warmup:]))
+            elapsed = time.perf_counter() - start
+
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.join()
+
+        sock.close()
+
+    return samples, elapsed
+
+
+def summarise(samples: list, elapsed: float) -> dict:
+    """
+    Returns the throughput, latency percentiles and statements per request
+    of the samples
+
+    Params
+    ------
+    samples         The (latency ms, status, statements) samples
+    elapsed         The number of seconds taken to send every request
+    """
+    latencies = sorted(s[0] for s in samples)
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    statuses = {}
+
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if s[1] == 0 or s[1] >= 500),
+        "statuses": statuses,
+        "throughput": round(len(samples) / elapsed, 2),
+        "p50_ms": round(percentiles[49], 3),
+        "p95_ms": round(percentiles[94], 3),
+        "p99_ms": round(percentiles[98], 3),
+        "statements_per_request": round(
+            sum(s[2] for s in samples) / len(samples), 2)
+    }
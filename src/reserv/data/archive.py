@@ -0,0 +1,156 @@
+from flask.cli import with_appcontext
+from datetime import date, datetime
+
+import logging
+import click
+import time
+
+from .db import get_db
+
+# Copies the chunk of bookings with the supplied dates to the archive
+ARCHIVE_COPY = """
+    INSERT INTO schedule_archive
+        (date, created_on, updated_on, user_id, status)
+    SELECT date, created_on, updated_on, user_id, status
+    FROM schedule
+    WHERE date IN ({placeholders})
+"""
+
+ARCHIVE_DELETE = "DELETE FROM schedule WHERE date IN ({placeholders})"
+
+
+def set_archived_before(before: str):
+    """
+    Moves the archive horizon forward to the supplied date, the horizon never
+    moves back so bookings archived earlier stay visible
+
+    Params
+    ------
+    before      The date bookings are archived up to as YYYY-MM-DD
+    """
+    query = """
+        UPDATE schedule_archive_state
+        SET archived_before = max(archived_before, ?)
+        WHERE id = 1
+    """
+    db = get_db()
+    db.execute(query, (before,))
+    db.commit()
+
+
+def archive_chunk(condition: str, params: tuple, chunk_size: int) -> int:
+    """
+    Moves up to chunk_size bookings matching the condition from schedule to
+    the archive in one short immediate transaction, returns the number moved
+
+    Params
+    ------
+    condition   The WHERE clause selecting the bookings to move
+    params      The parameters of the condition
+    chunk_size  The maximum number of bookings to move
+    """
+    select = f"SELECT date FROM schedule WHERE {condition} ORDER BY date LIMIT ?"
+
+    db = get_db()
+    db.execute("BEGIN IMMEDIATE")
+
+    try:
+        dates = [row[0] for row in
+                 db.execute(select, params + (chunk_size,)).fetchall()]
+
+        if dates:
+            placeholders = ",".join("?" * len(dates))
+            db.execute(ARCHIVE_COPY.format(placeholders=placeholders), dates)
+            db.execute(ARCHIVE_DELETE.format(placeholders=placeholders), dates)
+
+        db.commit()
+
+    except Exception:
+        db.rollback()
+        raise
+
+    return len(dates)
+
+
+def archive_bookings(before: str, cancelled: bool, chunk_size: int,
+                     pause: float) -> int:
+    """
+    Moves every booking dated before the supplied date, and every cancelled
+    booking if requested, to the archive. Returns the number of bookings moved
+
+    Params
+    ------
+    before      Bookings dated before this date are archived, YYYY-MM-DD
+    cancelled   Whether to also archive cancelled bookings of later dates
+    chunk_size  The maximum number of bookings moved per transaction
+    pause       The number of seconds to wait between transactions so
+                bookings are never held up for long
+    """
+    # The horizon moves first so reads consult the archive as soon as the
+    # first chunk lands in it
+    set_archived_before(before)
+
+    steps = [("date < ?", (before,))]
+
+    if cancelled:
+        steps.append(("status = 'cancelled'", ()))
+
+    total = 0
+
+    for condition, params in steps:
+        while True:
+            moved = archive_chunk(condition, params, chunk_size)
+            total += moved
+
+            if moved < chunk_size:
+                break
+
+            time.sleep(pause)
+
+    return total
+
+
+@click.command("archive-bookings")
+@click.option("--before", required=True,
+              help="Archive bookings dated before this date (YYYY-MM-DD)")
+@click.option("--cancelled/--no-cancelled", default=True,
+              help="Also archive cancelled bookings of later dates")
+@click.option("--chunk-size", default=500,
+              help="Bookings moved per transaction")
+@click.option("--pause", default=0.05,
+              help="Seconds to wait between transactions")
+@with_appcontext
+def archive_bookings_command(before, cancelled, chunk_size, pause):
+    """
+    Defines a click command that moves old and cancelled bookings out of the
+    schedule table into the archive
+
+    Params
+    ------
+    before          Bookings dated before this date are archived
+    cancelled       Whether to also archive cancelled bookings of later dates
+    chunk_size      The maximum number of bookings moved per transaction
+    pause           The number of seconds to wait between transactions
+    """
+    try:
+        before_date = datetime.strptime(before, "%Y-%m-%d").date()
+
+    except ValueError:
+        click.echo("The before date must be in the format YYYY-MM-DD")
+        return
+
+    # Bookings can still be made from today so they must stay in the schedule
+    if before_date > date.today():
+        click.echo("Only bookings dated before today can be archived")
+        return
+
+    try:
+        total = archive_bookings(before=before, cancelled=cancelled,
+                                 chunk_size=chunk_size, pause=pause)
+
+        click.echo(f"Archived {total} bookings")
+        logging.info("Archived %s bookings dated before %s", total, before)
+
+    except Exception as err:
+        click.echo(f"An error occurred when archiving bookings, {err}")
+        logging.error("Error archiving bookings, %s", err)
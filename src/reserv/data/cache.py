@@ -0,0 +1,179 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class PermissionCache:
+    """
+    Process-wide TTL cache of the role to permission matrix and a small
+    TTL/LRU cache of the roles held by each user, both keyed by database so
+    apps pointing at different databases never share entries. Changes made
+    by another process are picked up once the entries expire
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._matrices = {}
+        self._user_roles = OrderedDict()
+        self._hits = {"matrix": 0, "user_roles": 0}
+        self._misses = {"matrix": 0, "user_roles": 0}
+
+    def get_matrix(self, database: str, load, ttl: float) -> dict:
+        """
+        Returns the mapping of role id to the set of permission names for the
+        supplied database, calling load if the cached matrix is missing or
+        older than the ttl
+
+        Params
+        ------
+        database        The path of the database the matrix belongs to
+        load            A function returning the matrix from the database
+        ttl             The number of seconds the matrix stays valid
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._matrices.get(database)
+
+            if entry is not None and entry[0] > now:
+                self._hits["matrix"] += 1
+                return entry[1]
+
+            self._misses["matrix"] += 1
+
+        matrix = load()
+
+        with self._lock:
+            self._matrices[database] = (now + ttl, matrix)
+
+        return matrix
+
+    def get_user_roles(self, database: str, user_id: str, load, ttl: float,
+                       max_users: int) -> frozenset:
+        """
+        Returns the set of role ids held by the user, calling load if the
+        cached entry is missing or older than the ttl
+
+        Params
+        ------
+        database        The path of the database the user belongs to
+        user_id         The id of the user
+        load            A function returning the user's role ids
+        ttl             The number of seconds an entry stays valid
+        max_users       The maximum number of users to keep cached
+        """
+        key = (database, user_id)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._user_roles.get(key)
+
+            if entry is not None and entry[0] > now:
+                self._hits["user_roles"] += 1
+                self._user_roles.move_to_end(key)
+                return entry[1]
+
+            self._misses["user_roles"] += 1
+
+        roles = frozenset(load())
+
+        with self._lock:
+            self._user_roles[key] = (now + ttl, roles)
+            self._user_roles.move_to_end(key)
+
+            while len(self._user_roles) > max_users:
+                self._user_roles.popitem(last=False)
+
+        return roles
+
+    def invalidate_user(self, database: str, user_id: str):
+        """
+        Drops the cached roles of a user after their roles have changed
+        """
+        with self._lock:
+            self._user_roles.pop((database, user_id), None)
+
+    def stats(self) -> dict:
+        """
+        Returns the number of hits and misses of each cache since the process
+        started as {name: (hits, misses)}
+        """
+        with self._lock:
+            return {name: (self._hits[name], self._misses[name])
+                    for name in self._hits}
+
+    def clear(self):
+        """
+        Drops every cached entry, used after the schema has changed
+        """
+        with self._lock:
+            self._matrices.clear()
+            self._user_roles.clear()
+
+
+permission_cache = PermissionCache()
+
+
+class FragmentCache:
+    """
+    Process-wide LRU cache of rendered page fragments, keyed by database and
+    whatever else the fragment depends on. Entries are never stale as long
+    as the key includes the version of the data they were rendered from
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, database: str, key: tuple, render, max_entries: int):
+        """
+        Returns the cached value for the key, calling render to build it if
+        it isn't cached
+
+        Params
+        ------
+        database        The path of the database the fragment was built from
+        key             The other values the fragment depends on
+        render          A function returning the fragment
+        max_entries     The maximum number of fragments to keep cached
+        """
+        key = (database,) + tuple(key)
+
+        with self._lock:
+            value = self._entries.get(key)
+
+            if value is not None:
+                self._hits += 1
+                self._entries.move_to_end(key)
+                return value
+
+            self._misses += 1
+
+        value = render()
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+        return value
+
+    def stats(self) -> dict:
+        """
+        Returns the number of hits and misses since the process started as
+        {name: (hits, misses)}
+        """
+        with self._lock:
+            return {"fragment": (self._hits, self._misses)}
+
+    def clear(self):
+        """
+        Drops every cached fragment
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+fragment_cache = FragmentCache()
@@ -1,32 +1,284 @@
-from flask import g, current_app
+from flask import g, current_app, request, has_request_context
+from flask import request_started
 from flask.cli import with_appcontext
-from werkzeug.security import generate_password_hash
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from urllib.parse import quote
 
 import sqlite3
+import threading
+import time
 import logging
 import click
 import os
 
+from .cache import permission_cache
+from .tracing import TracedConnection, init_tracing
+from .writer import WriteQueue
+from ..tools.metrics import metrics
+from ..tools.passwords import get_password_hasher
+
+# The pragmas that can be set from the database section of the config
+DB_PRAGMAS = (
+    "journal_mode",
+    "synchronous",
+    "cache_size",
+    "mmap_size",
+    "busy_timeout"
+)
+
+# Holds the persistent connections opened by each thread of this process
+_local = threading.local()
+
+# The write queues of this process by database and the pid they started in
+_write_queues = {"pid": None, "queues": {}}
+_write_queues_lock = threading.Lock()
+
+
+def read_only_db(view):
+    """
+    View decorator marking a route that only reads, every query made while
+    handling it, including by the request hooks, goes through a read-only
+    connection so it never queues behind writers and can't write
+    """
+    view.read_only_db = True
+    return view
+
+
+def mark_dispatched(sender, **extra):
+    """
+    Records that the request is being dispatched to its view, connected to
+    the request_started signal so it runs before the request hooks
+    """
+    g.db_dispatched = True
+
+
+def is_read_only_request() -> bool:
+    """
+    Checks if the current request is being dispatched to a route marked
+    read-only. Request contexts pushed by scripts and commands, which never
+    dispatch, always get a writable connection
+    """
+    if not (has_request_context() and g.get("db_dispatched", False) and
+            current_app.config.get("DB_READ_ONLY_ROUTES", False)):
+        return False
+
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, "read_only_db", False)
+
+
 def get_db():
     """
-    Establishes a connection to the database and attaches it to g
+    Establishes a connection to the database and attaches it to g, reusing
+    the connection kept by this thread when persistent connections are enabled
     """
     if "db" not in g:
-        logging.debug("Opening connection to schedule database...")
-        g.db = sqlite3.connect(current_app.config["DATABASE"])
-        g.db.row_factory = sqlite3.Row
+        database = current_app.config["DATABASE"]
+        g.db_read_only = is_read_only_request()
+
+        if current_app.config.get("DB_PERSISTENT", False):
+            g.db = get_persistent_db(database, g.db_read_only)
+        else:
+            g.db = open_db(database, g.db_read_only)
 
     return g.db
 
 
+def open_db(database: str, read_only: bool = False) -> sqlite3.Connection:
+    """
+    Opens a new connection to the database and applies the configured pragmas
+
+    Params
+    ------
+    database        The path of the database file
+    read_only       Whether to open the database read-only
+    """
+    logging.debug("Opening connection to schedule database...")
+
+    # Only traced connections pay for timing their statements
+    factory = (TracedConnection if current_app.config.get("SQL_TRACE", False)
+               else sqlite3.Connection)
+
+    if read_only:
+        uri = f"file:{quote(os.path.abspath(database))}?mode=ro"
+        db = sqlite3.connect(uri, uri=True, factory=factory)
+    else:
+        db = sqlite3.connect(database, factory=factory)
+
+    metrics.inc("reserv_db_connections_opened_total")
+    db.row_factory = sqlite3.Row
+
+    pragmas = current_app.config.get("DB_PRAGMAS", {})
+
+    for name in DB_PRAGMAS:
+        # The journal mode is a property of the file only writers can change
+        if read_only and name == "journal_mode":
+            continue
+
+        if pragmas.get(name) is not None:
+            db.execute(f"PRAGMA {name} = {pragmas[name]}")
+
+    if read_only:
+        db.execute("PRAGMA query_only = ON")
+
+    return db
+
+
+def get_persistent_db(database: str,
+                      read_only: bool = False) -> sqlite3.Connection:
+    """
+    Returns the connection kept by the current thread for the database, opening
+    a new one if there is none yet or the process has forked since it was opened
+
+    Params
+    ------
+    database        The path of the database file
+    read_only       Whether to return the thread's read-only connection
+    """
+    # Connections must not be shared with a forked child so they're dropped
+    # without being closed, which would release locks held by the parent
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+
+    db = _local.connections.get((database, read_only))
+
+    if db is None:
+        db = open_db(database, read_only)
+        db.execute("SELECT 1").fetchone()
+        _local.connections[(database, read_only)] = db
+
+    return db
+
+
+def discard_persistent_db(database: str, read_only: bool = False):
+    """
+    Closes and forgets the connection kept by the current thread for the
+    database so the next request opens a fresh one
+
+    Params
+    ------
+    database        The path of the database file
+    read_only       Whether to discard the thread's read-only connection
+    """
+    db = getattr(_local, "connections", {}).pop((database, read_only), None)
+
+    if db is not None:
+        db.close()
+        metrics.inc("reserv_db_connections_closed_total")
+        logging.warning("Discarded persistent connection to schedule database")
+
+
+def get_write_queue() -> WriteQueue:
+    """
+    Returns the write queue of this process for the database, starting its
+    writer thread on first use and again in a forked child, which doesn't
+    inherit the thread
+    """
+    database = current_app.config["DATABASE"]
+
+    with _write_queues_lock:
+        if _write_queues["pid"] != os.getpid():
+            _write_queues["pid"] = os.getpid()
+            _write_queues["queues"] = {}
+
+        write_queue = _write_queues["queues"].get(database)
+
+        if write_queue is None:
+            write_queue = WriteQueue(
+                app=current_app._get_current_object(),
+                connect=lambda: open_db(database),
+                lock_path=f"{database}.write-lock",
+                batch_size=current_app.config["DB_WRITE_BATCH_SIZE"],
+                batch_wait=current_app.config["DB_WRITE_BATCH_WAIT_MS"] / 1000
+            )
+            _write_queues["queues"][database] = write_queue
+
+        return write_queue
+
+
+def submit_write(write) -> Future:
+    """
+    Runs a write in its own immediate transaction, or queues it for the
+    writer thread when the write queue is enabled. Returns a future resolved
+    with the return value of the write once it has been committed
+
+    Params
+    ------
+    write       A function making the write through get_db, it must not commit
+                or roll back itself
+    """
+    if current_app.config.get("DB_WRITE_QUEUE", False):
+        return get_write_queue().submit(write)
+
+    future = Future()
+    db = get_db()
+    db.execute("BEGIN IMMEDIATE")
+
+    try:
+        result = write()
+        db.commit()
+
+    except Exception as err:
+        db.rollback()
+        future.set_exception(err)
+        return future
+
+    future.set_result(result)
+    return future
+
+
+def run_write(write):
+    """
+    Makes a write through submit_write and waits for it to be committed,
+    returning its return value. A write still queued after the configured
+    timeout is cancelled and raises an OperationalError like a busy database
+    would, a write the writer has already started is waited for instead so
+    a write is never reported as failed and then committed
+
+    Params
+    ------
+    write       A function making the write through get_db
+    """
+    future = submit_write(write)
+
+    try:
+        return future.result(
+            timeout=current_app.config.get("DB_WRITE_TIMEOUT", 30))
+
+    except FutureTimeoutError:
+        if future.cancel():
+            raise sqlite3.OperationalError(
+                "Timed out waiting for the write queue")
+
+    logging.warning("Write started after the write queue timeout, waiting "
+                    "for it to finish")
+
+    return future.result()
+
+
 def close_db(e=None):
     """
-    Closes the connection to the database and removes it from g
+    Closes the connection to the database and removes it from g, persistent
+    connections are kept open with any unfinished transaction rolled back
+    unless the request failed with a database error
     """
     db = g.pop("db", None)
+    read_only = g.pop("db_read_only", False)
 
-    if db is not None:
+    if db is None:
+        return
+
+    if current_app.config.get("DB_PERSISTENT", False):
+        if isinstance(e, sqlite3.Error):
+            discard_persistent_db(current_app.config["DATABASE"], read_only)
+
+        elif db.in_transaction:
+            db.rollback()
+            logging.warning("Rolled back unfinished database transaction")
+
+    else:
         db.close()
+        metrics.inc("reserv_db_connections_closed_total")
         logging.debug("Closed connection to schedule database")
 
 
@@ -50,6 +302,8 @@ def init_db():
         with current_app.open_resource(f"data/schema_v{version}.sql") as f:
             db.executescript(f.read().decode("utf8"))
 
+        permission_cache.clear()
+
         click.echo("Initialised the database")
         logging.info("Successfully initialised the database")
     
@@ -59,54 +313,67 @@ def init_db():
 
 
 @click.command("upgrade-db")
+@click.option("--dry-run", is_flag=True,
+              help="Show the steps that would run without changing anything")
+@click.option("--batch-size", default=1000,
+              help="Rows copied per transaction by Python steps")
+@click.option("--pause", default=0.05,
+              help="Seconds to wait between copied batches")
 @with_appcontext
-def upgrade_db():
+def upgrade_db(dry_run, batch_size, pause):
     """
-    Defines a click command that upgrades the database to the latest version
+    Defines a click command that upgrades the database to the latest version,
+    each step runs in a transaction together with its version bump so a
+    failed step leaves the database at the version before it
+
+    Params
+    ------
+    dry_run         Whether to only show the plan
+    batch_size      The number of rows copied per transaction
+    pause           The number of seconds to wait between batches
     """
-    current_dir = os.path.dirname(os.path.realpath(__file__))
-    upgrades_dir = os.path.join(current_dir, "./upgrades")
-    
+    from .migrations import upgrade_database
+
     try:
         release_ver = get_release_db_version()
     except Exception as err:
         logging.error(f"Could read the app database version, {err}")
         click.echo("Error reading the app database version")
         return
-    
-    instance_ver = get_db_version()
-    
-    while instance_ver < release_ver:
-        upgrade_ver = instance_ver + 1
-        upgrade_path = os.path.join(upgrades_dir, f"upgrade_v{upgrade_ver}.sql")
-
-        try:
-            db = get_db()
-            
-            with open(os.path.join(upgrade_path)) as f:
-                db.executescript(f.read())
-
-            update_db_version(upgrade_ver)
-
-            logging.info(f"Successfully upgraded database version from "
-                         f"{instance_ver} to {upgrade_ver}")
-            click.echo(f"Successfully upgraded database version from "
-                       f"{instance_ver} to {upgrade_ver}")
-
-            instance_ver = get_db_version()
-
-        except Exception as err:
-            logging.error(f"Failed to upgrade from {instance_ver} to "
-                          f"{upgrade_ver}, {err}")
-            click.echo(f"Error upgrading database version from {instance_ver} "
-                       f"to {upgrade_ver}")
-            return
-            
-    instance_ver = get_db_version()
-    
-    logging.info(f"Database schema upgrade finished, current: {instance_ver}")
-    click.echo(f"Database schema upgrade finished, current: {instance_ver}")
-    
+
+    def report(message: str):
+        click.echo(message)
+        logging.info(message)
+
+    start = time.perf_counter()
+
+    try:
+        instance_ver = upgrade_database(target=release_ver, dry_run=dry_run,
+                                        batch_size=batch_size, pause=pause,
+                                        report=report)
+
+    except Exception as err:
+        instance_ver = get_db_version()
+
+        logging.error(f"Failed to upgrade from {instance_ver} to "
+                      f"{instance_ver + 1}, {err}")
+        click.echo(f"Error upgrading database version from {instance_ver} "
+                   f"to {instance_ver + 1}, {err}")
+        return
+
+    finally:
+        permission_cache.clear()
+
+    if dry_run:
+        click.echo(f"Dry run finished, the database would be at version "
+                   f"{instance_ver}")
+        return
+
+    logging.info(f"Database schema upgrade finished in "
+                 f"{time.perf_counter() - start:.2f} s, current: {instance_ver}")
+    click.echo(f"Database schema upgrade finished in "
+               f"{time.perf_counter() - start:.2f} s, current: {instance_ver}")
+
 
 def get_release_db_version():
     """
@@ -153,11 +420,25 @@ def init_app(app):
     app         The Flask app to register to
     """
     app.teardown_appcontext(close_db)
+    request_started.connect(mark_dispatched, app)
+    init_tracing(app)
     app.cli.add_command(init_db)
     app.cli.add_command(upgrade_db)
     app.cli.add_command(create_user)
     app.cli.add_command(assign_role)
 
+    from .archive import archive_bookings_command
+    app.cli.add_command(archive_bookings_command)
+
+    from .user_import import import_users_command
+    app.cli.add_command(import_users_command)
+
+    from ..bench.cli import bench_command
+    app.cli.add_command(bench_command)
+
+    from ..tools.startup import startup_profile_command
+    app.cli.add_command(startup_profile_command)
+
 
 @click.command("create-user")
 @click.argument("id")
@@ -176,7 +457,7 @@ def create_user(id, name, password, status):
     password        The password of the user
     status          The status of the user (active, inactive or terminated)
     """
-    hash_password = generate_password_hash(password)
+    hash_password = get_password_hasher().hash(password)
 
     try:
         add_user(id=id, name=name, hash_password=hash_password, status=status)
@@ -190,13 +471,11 @@ def create_user(id, name, password, status):
 
 
 def add_user(id: str, name: str, hash_password: str, status: str):
-    query = """
-    INSERT INTO user (user_id, display_name, password, status)
-    VALUES (?,?,?,?)
-    """
-    db = get_db()
-    db.execute(query, (id, name, hash_password, status,))
-    db.commit()
+    from .storage import get_storage
+
+    storage = get_storage()
+    storage.transaction(
+        lambda: storage.add_user(id, name, hash_password, status))
 
 
 @click.command("assign-role")
@@ -225,21 +504,30 @@ def assign_role(id, role):
 
 
 def grant_role(id: str, role_name: str,):
+    from .storage import get_storage
+
+    storage = get_storage()
     role_id = get_role_by_name(role_name)
 
-    query = """
-    INSERT INTO user_role (user_id, role_id)
-    VALUES (?,?)
-    """
-    db = get_db()
-    db.execute(query, (id, role_id,))
-    db.commit()
+    storage.transaction(lambda: storage.add_user_role(id, role_id))
+
+    permission_cache.invalidate_user(current_app.config["DATABASE"], id)
 
 
 def get_role_by_name(name: str) -> int:
-    query = "SELECT id FROM role WHERE name = ?"
+    """
+    Returns the id of the role with the name, raises ValueError if there is
+    no such role
 
-    db = get_db()
-    res = db.execute(query, (name,)).fetchone()[0]
+    Params
+    ------
+    name            The name of the role
+    """
+    from .storage import get_storage
+
+    role_id = get_storage().get_role_id(name)
+
+    if role_id is None:
+        raise ValueError(f"there is no role named {name}")
 
-    return res
\ No newline at end of file
+    return role_id
\ No newline at end of file
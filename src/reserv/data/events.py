@@ -0,0 +1,76 @@
+import threading
+
+
+class ScheduleEvents:
+    """
+    Wakes the schedule streams held by this process when a booking is written.
+    Publishing only notifies waiting streams so a slow client can never block
+    the writer
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._version = 0
+        self._clients = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def clients(self) -> int:
+        return self._clients
+
+    def publish(self):
+        """
+        Bumps the local version and wakes every waiting stream
+        """
+        with self._cond:
+            self._version += 1
+            self._cond.notify_all()
+
+    def wait(self, version: int, timeout: float) -> int:
+        """
+        Blocks until the local version differs from the supplied version or the
+        timeout expires and returns the current local version
+
+        Params
+        ------
+        version         The local version last seen by the caller
+        timeout         The maximum number of seconds to wait
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+    def connect(self, max_clients: int) -> bool:
+        """
+        Registers a new stream, returns False if the process is already holding
+        the maximum number of streams
+
+        Params
+        ------
+        max_clients     The maximum number of streams allowed in this process
+        """
+        with self._cond:
+            if self._clients >= max_clients:
+                return False
+
+            self._clients += 1
+            return True
+
+    def disconnect(self):
+        """
+        Unregisters a stream once its connection has closed
+        """
+        with self._cond:
+            self._clients -= 1
+
+
+schedule_events = ScheduleEvents()
+
+
+def publish_schedule_change():
+    """
+    Notifies the schedule streams in this process that a booking has changed
+    """
+    schedule_events.publish()
@@ -0,0 +1,350 @@
+from datetime import datetime
+
+import threading
+import sqlite3
+import bisect
+import os
+
+from .storage import Storage
+
+
+def now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class MemoryStorage(Storage):
+    """
+    Keeps every row in dicts in this process, with the active bookings of each
+    user in a sorted list so booking limit lookups are a bisect. Nothing is
+    shared between processes or saved, so it's only meant for tests and
+    benchmarks. Writes aren't rolled back if they fail part way, which the
+    booking helpers allow for by checking everything before they write
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._users = {}
+        self._roles = {}
+        self._permissions = {}
+        self._role_permissions = {}
+        self._user_roles = {}
+        self._schedule = {}
+        self._booked = {}
+        self._version = 0
+
+    @classmethod
+    def from_sqlite(cls, db: sqlite3.Connection) -> "MemoryStorage":
+        """
+        Returns a storage holding a copy of every row of the SQLite database
+
+        Params
+        ------
+        db          A connection to the database to copy
+        """
+        storage = cls()
+        db.row_factory = sqlite3.Row
+
+        for row in db.execute("SELECT * FROM user"):
+            storage._users[row["user_id"]] = dict(row)
+
+        for row in db.execute("SELECT id, name FROM role"):
+            storage._roles[row["id"]] = row["name"]
+
+        for row in db.execute("SELECT id, name FROM permission"):
+            storage._permissions[row["id"]] = row["name"]
+
+        for row in db.execute("SELECT role_id, permission_id FROM role_permission"):
+            storage._role_permissions.setdefault(
+                row["role_id"], set()).add(row["permission_id"])
+
+        for row in db.execute("SELECT user_id, role_id FROM user_role"):
+            storage._user_roles.setdefault(
+                row["user_id"], []).append(row["role_id"])
+
+        for row in db.execute("SELECT * FROM schedule"):
+            storage._put_booking(dict(row))
+
+        # Archived bookings are only kept if the date has not been rebooked
+        archived = db.execute("SELECT date, created_on, updated_on, user_id, "
+                              "status FROM schedule_archive "
+                              "WHERE status = 'booked'")
+
+        for row in archived:
+            if row["date"] not in storage._schedule:
+                storage._put_booking(dict(row))
+
+        return storage
+
+    @classmethod
+    def from_config(cls, app) -> "MemoryStorage":
+        """
+        Returns a storage loaded from the SQLite database at STORAGE_SEED, or
+        holding only the roles and permissions of the release schema
+
+        Params
+        ------
+        app         The Flask app whose config to read
+        """
+        seed = app.config.get("STORAGE_SEED")
+
+        if seed:
+            db = sqlite3.connect(f"file:{seed}?mode=ro", uri=True)
+        else:
+            from .db import get_release_db_version
+
+            current_dir = os.path.dirname(os.path.realpath(__file__))
+            schema_path = os.path.join(
+                current_dir, f"schema_v{get_release_db_version()}.sql")
+
+            db = sqlite3.connect(":memory:")
+
+            with open(schema_path) as f:
+                db.executescript(f.read())
+
+        try:
+            return cls.from_sqlite(db)
+        finally:
+            db.close()
+
+    def _put_booking(self, booking: dict):
+        previous = self._schedule.get(booking["date"])
+
+        if previous is not None and previous["status"] == "booked":
+            dates = self._booked[previous["user_id"]]
+            del dates[bisect.bisect_left(dates, previous["date"])]
+
+        self._schedule[booking["date"]] = booking
+
+        if booking["status"] == "booked":
+            bisect.insort(self._booked.setdefault(booking["user_id"], []),
+                          booking["date"])
+
+    def _write_booking(self, date: str, user_id: str, status: str):
+        booking = dict(self._schedule[date])
+        booking.update(user_id=user_id, status=status, updated_on=now())
+
+        self._put_booking(booking)
+        self._version += 1
+
+    def get_user(self, user_id: str):
+        with self._lock:
+            user = self._users.get(user_id)
+            return dict(user) if user else None
+
+    def get_display_name(self, user_id: str) -> str:
+        with self._lock:
+            user = self._users.get(user_id)
+            return user["display_name"] if user else None
+
+    def get_user_status(self, user_id: str) -> str:
+        with self._lock:
+            return self._users[user_id]["status"]
+
+    def _check_new_user(self, user_id: str, name: str):
+        if user_id in self._users:
+            raise sqlite3.IntegrityError(
+                "UNIQUE constraint failed: user.user_id")
+
+        self._check_display_name(user_id, name)
+
+    def _check_display_name(self, user_id: str, name: str):
+        if name is not None and any(
+                user["display_name"] == name and other_id != user_id
+                for other_id, user in self._users.items()):
+            raise sqlite3.IntegrityError(
+                "UNIQUE constraint failed: user.display_name")
+
+    def add_user(self, user_id: str, name: str, password: str, status: str):
+        with self._lock:
+            self._check_new_user(user_id, name)
+
+            self._users[user_id] = {
+                "user_id": user_id,
+                "display_name": name,
+                "password": password,
+                "status": status,
+                "created_on": now(),
+                "updated_on": now()
+            }
+
+    def add_users(self, users: list):
+        with self._lock:
+            user_ids = set()
+            names = set()
+
+            # Every user is checked before any is added
+            for user_id, name, _, _ in users:
+                self._check_new_user(user_id, name)
+
+                if user_id in user_ids or (name is not None and name in names):
+                    raise sqlite3.IntegrityError(
+                        "UNIQUE constraint failed: user")
+
+                user_ids.add(user_id)
+                names.add(name)
+
+            for user in users:
+                self.add_user(*user)
+
+    def update_name(self, user_id: str, name: str):
+        with self._lock:
+            self._check_display_name(user_id, name)
+
+            if user_id in self._users:
+                self._users[user_id].update(display_name=name, updated_on=now())
+                self._version += 1
+
+    def update_password(self, user_id: str, password: str):
+        with self._lock:
+            if user_id in self._users:
+                self._users[user_id].update(password=password, updated_on=now())
+
+    def get_role_id(self, name: str) -> int:
+        with self._lock:
+            return next((role_id for role_id, role in self._roles.items()
+                         if role == name), None)
+
+    def get_permission_id(self, name: str) -> int:
+        with self._lock:
+            return next((perm_id for perm_id, perm in self._permissions.items()
+                         if perm == name), None)
+
+    def add_user_role(self, user_id: str, role_id: int):
+        with self._lock:
+            roles = self._user_roles.setdefault(user_id, [])
+
+            if role_id in roles:
+                raise sqlite3.IntegrityError(
+                    "UNIQUE constraint failed: user_role.user_id, "
+                    "user_role.role_id")
+
+            roles.append(role_id)
+
+    def add_user_roles(self, user_roles: list):
+        with self._lock:
+            pairs = set()
+
+            for user_id, role_id in user_roles:
+                if (role_id in self._user_roles.get(user_id, ())
+                        or (user_id, role_id) in pairs):
+                    raise sqlite3.IntegrityError(
+                        "UNIQUE constraint failed: user_role.user_id, "
+                        "user_role.role_id")
+
+                pairs.add((user_id, role_id))
+
+            for user_id, role_id in user_roles:
+                self.add_user_role(user_id, role_id)
+
+    def get_user_role_ids(self, user_id: str) -> list:
+        with self._lock:
+            return list(self._user_roles.get(user_id, ()))
+
+    def get_role_permission_ids(self, role_id: int) -> list:
+        with self._lock:
+            return list(self._role_permissions.get(role_id, ()))
+
+    def get_role_permission_matrix(self) -> dict:
+        with self._lock:
+            return {role_id: frozenset(self._permissions[perm_id]
+                                       for perm_id in perm_ids)
+                    for role_id, perm_ids in self._role_permissions.items()}
+
+    def get_booking(self, date: str):
+        with self._lock:
+            booking = self._schedule.get(date)
+
+            if booking is None:
+                return None
+
+            return {"user_id": booking["user_id"], "status": booking["status"]}
+
+    def get_bookings(self, dates: list) -> list:
+        with self._lock:
+            res = []
+
+            # Each date is returned once, as with the IN list of SqliteStorage
+            for date in dict.fromkeys(dates):
+                booking = self._schedule.get(date)
+
+                if booking is None or booking["status"] != "booked":
+                    continue
+
+                user = self._users.get(booking["user_id"])
+                res.append({
+                    "date": date,
+                    "user_id": booking["user_id"],
+                    "booker_id": user["user_id"] if user else None,
+                    "display_name": user["display_name"] if user else None
+                })
+
+            return res
+
+    def get_schedule_version(self) -> int:
+        return self._version
+
+    def get_booked_dates(self, user_id: str, start: str, end: str) -> list:
+        with self._lock:
+            dates = self._booked.get(user_id, [])
+            return dates[bisect.bisect_left(dates, start):
+                         bisect.bisect_right(dates, end)]
+
+    def insert_booking(self, date: str, user_id: str):
+        with self._lock:
+            if date in self._schedule:
+                raise sqlite3.IntegrityError(
+                    "UNIQUE constraint failed: schedule.date")
+
+            self._put_booking({
+                "date": date,
+                "created_on": now(),
+                "updated_on": now(),
+                "user_id": user_id,
+                "status": "booked"
+            })
+            self._version += 1
+
+    def set_booking(self, date: str, user_id: str):
+        with self._lock:
+            if date in self._schedule:
+                self._write_booking(date, user_id, "booked")
+
+    def cancel_booking(self, date: str):
+        with self._lock:
+            booking = self._schedule.get(date)
+
+            if booking is not None:
+                self._write_booking(date, booking["user_id"], "cancelled")
+
+    def upsert_booking(self, date: str, user_id: str) -> bool:
+        with self._lock:
+            booking = self._schedule.get(date)
+
+            if booking is None:
+                self.insert_booking(date, user_id)
+                return True
+
+            if booking["status"] == "booked":
+                return False
+
+            self._write_booking(date, user_id, "booked")
+            return True
+
+    def upsert_bookings(self, dates: list, user_id: str):
+        with self._lock:
+            for date in dates:
+                self.upsert_booking(date, user_id)
+
+    def cancel_bookings_in_range(self, start: str, end: str) -> list:
+        with self._lock:
+            dates = sorted(date for date, booking in self._schedule.items()
+                           if start <= date <= end
+                           and booking["status"] == "booked")
+
+            for date in dates:
+                self.cancel_booking(date)
+
+            return dates
+
+    def transaction(self, write):
+        with self._lock:
+            return write()
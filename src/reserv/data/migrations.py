@@ -0,0 +1,375 @@
+from importlib.util import spec_from_file_location, module_from_spec
+
+import sqlite3
+import time
+import os
+
+from .db import get_db, get_db_version
+
+# The folder holding the upgrade_vN.sql and upgrade_vN.py steps
+UPGRADES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            "upgrades")
+
+# The last key copied by each table copy, so an interrupted copy resumes
+# where it stopped. The table only exists while a copy is unfinished
+PROGRESS_TABLE = """
+    CREATE TABLE IF NOT EXISTS migration_progress (
+        "name"  TEXT NOT NULL,
+        "last_key",
+        PRIMARY KEY("name")
+    )
+"""
+
+
+def split_statements(script: str) -> list:
+    """
+    Returns the complete SQL statements of the script, without comments only
+    lines
+
+    Params
+    ------
+    script      The SQL script
+    """
+    statements = []
+    current = ""
+
+    for line in script.splitlines(keepends=True):
+        current += line
+
+        if sqlite3.complete_statement(current):
+            statement = "\n".join(
+                l for l in current.strip().splitlines()
+                if not l.strip().startswith("--")).strip()
+
+            if statement:
+                statements.append(statement)
+
+            current = ""
+
+    return statements
+
+
+def run_in_transaction(db, script: str, version: int = None):
+    """
+    Runs the script in one immediate transaction, along with the bump of the
+    schema version if one is supplied, rolling everything back on failure
+
+    Params
+    ------
+    db          The connection to run the script on
+    script      The SQL script
+    version     The version to stamp the database with, None to leave it
+    """
+    if version is not None:
+        script += f"\n;PRAGMA user_version = {version:d};"
+
+    # executescript commits anything pending first, then runs the script as
+    # written, so the BEGIN holds every statement in a single transaction
+    try:
+        db.executescript(f"BEGIN IMMEDIATE;\n{script}\n;COMMIT;")
+
+    except Exception:
+        if db.in_transaction:
+            db.rollback()
+
+        raise
+
+
+class Migration:
+    """
+    Passed to the upgrade function of a Python step. Setup scripts run and
+    commit straight away, tables are copied in batches that each commit on
+    their own so the app can write in between, and the finishing script runs
+    in the same transaction as the version bump. Every part can be run again
+    after an interruption, so setup scripts must be idempotent
+    """
+    def __init__(self, db, version: int, dry_run: bool, batch_size: int,
+                 pause: float, report):
+        """
+        Params
+        ------
+        db              The connection to the database being upgraded
+        version         The version the step upgrades to
+        dry_run         Whether to report the plan without changing anything
+        batch_size      The number of rows copied per transaction
+        pause           The number of seconds to wait between batches
+        report          The function called with each progress message
+        """
+        self.db = db
+        self.version = version
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.pause = pause
+        self.report = report
+        self._finish = []
+        self._copies = []
+
+    def execute(self, script: str):
+        """
+        Runs a setup script in its own transaction
+
+        Params
+        ------
+        script      The SQL script, it must be safe to run more than once
+        """
+        if self.dry_run:
+            for statement in split_statements(script):
+                self.report(f"  setup: {statement.splitlines()[0]}")
+
+            return
+
+        run_in_transaction(self.db, script)
+
+    def copy_table(self, source: str, target: str, columns: list, key: str):
+        """
+        Copies the rows of source into target in batches ordered by key,
+        resuming after the last batch committed by an earlier run. Changes
+        the app makes to rows that were already copied are mirrored to the
+        target by triggers until the step finishes
+
+        Params
+        ------
+        source      The table to copy from
+        target      The table to copy to, created by a setup script
+        columns     The columns to copy, they must exist in both tables
+        key         A unique column of source to order the batches by
+        """
+        name = f"v{self.version}_{source}_{target}"
+        total = self.db.execute(f"SELECT COUNT(*) FROM {source}").fetchone()[0]
+
+        if self.dry_run:
+            batches = -(-total // self.batch_size)
+            self.report(f"  copy: {total} rows from {source} to {target} in "
+                        f"{batches} batches of {self.batch_size}")
+            return
+
+        self._copies.append(name)
+        self._install_sync(name, source, target, columns, key)
+
+        cols = ", ".join(columns)
+        batch = f"""
+            SELECT {{select}} FROM {source}
+            WHERE ?1 IS NULL OR {key} > ?1
+            ORDER BY {key}
+            LIMIT ?2
+        """
+        copy = f"INSERT OR REPLACE INTO {target} ({cols}) " + \
+            batch.format(select=cols)
+        batch_end = f"SELECT max({key}) FROM ({batch.format(select=key)})"
+        progress = "SELECT last_key FROM migration_progress WHERE name = ?"
+
+        copied = self.db.execute(
+            f"SELECT COUNT(*) FROM {source} WHERE {key} <= ?",
+            self.db.execute(progress, (name,)).fetchone()).fetchone()[0]
+
+        start = time.perf_counter()
+        reported = start
+
+        while True:
+            self.db.execute("BEGIN IMMEDIATE")
+
+            try:
+                last_key = self.db.execute(progress, (name,)).fetchone()[0]
+                params = (last_key, self.batch_size)
+                end_key = self.db.execute(batch_end, params).fetchone()[0]
+                moved = self.db.execute(copy, params).rowcount
+
+                if end_key is not None:
+                    self.db.execute("UPDATE migration_progress SET last_key = ? "
+                                    "WHERE name = ?", (end_key, name))
+
+                self.db.commit()
+
+            except Exception:
+                self.db.rollback()
+                raise
+
+            copied += moved
+            now = time.perf_counter()
+
+            if moved < self.batch_size or now - reported >= 1:
+                reported = now
+                percent = copied / total if total else 1
+                self.report(f"  copied {copied} of {total} rows from {source} "
+                            f"({percent:.0%}) in {now - start:.1f} s")
+
+            if moved < self.batch_size:
+                break
+
+            time.sleep(self.pause)
+
+    def _install_sync(self, name: str, source: str, target: str,
+                      columns: list, key: str):
+        cols = ", ".join(columns)
+        new = ", ".join(f"NEW.{col}" for col in columns)
+        copied = (f"(SELECT last_key FROM migration_progress "
+                  f"WHERE name = '{name}')")
+
+        run_in_transaction(self.db, f"""
+            {PROGRESS_TABLE};
+
+            INSERT OR IGNORE INTO migration_progress (name, last_key)
+            VALUES ('{name}', NULL);
+
+            CREATE TRIGGER IF NOT EXISTS {name}_insert
+                AFTER INSERT ON {source}
+                WHEN NEW.{key} <= {copied}
+            BEGIN
+                INSERT OR REPLACE INTO {target} ({cols}) VALUES ({new});
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS {name}_update
+                AFTER UPDATE ON {source}
+                WHEN NEW.{key} <= {copied} OR OLD.{key} <= {copied}
+            BEGIN
+                DELETE FROM {target} WHERE {key} = OLD.{key};
+                INSERT OR REPLACE INTO {target} ({cols})
+                SELECT {new} WHERE NEW.{key} <= {copied};
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS {name}_delete
+                AFTER DELETE ON {source}
+                WHEN OLD.{key} <= {copied}
+            BEGIN
+                DELETE FROM {target} WHERE {key} = OLD.{key};
+            END;
+        """)
+
+    def finish(self, script: str):
+        """
+        Queues a script, such as swapping the copied table in, to run in the
+        same transaction as the version bump once every copy is done
+
+        Params
+        ------
+        script      The SQL script
+        """
+        self._finish.append(script)
+
+    def commit(self):
+        """
+        Drops the copy triggers, runs the finishing scripts and bumps the
+        version in a single transaction
+        """
+        if self.dry_run:
+            for script in self._finish:
+                for statement in split_statements(script):
+                    self.report(f"  finish: {statement.splitlines()[0]}")
+
+            return
+
+        cleanup = "".join(
+            f"""
+            DROP TRIGGER IF EXISTS {name}_insert;
+            DROP TRIGGER IF EXISTS {name}_update;
+            DROP TRIGGER IF EXISTS {name}_delete;
+            """ for name in self._copies)
+
+        # Copies only ever run one step at a time, so none are left unfinished
+        if self._copies:
+            cleanup += "DROP TABLE IF EXISTS migration_progress;\n"
+
+        run_in_transaction(self.db, cleanup + "\n;".join(self._finish),
+                           version=self.version)
+
+
+def find_step(version: int) -> str:
+    """
+    Returns the path of the step upgrading to the version, preferring a
+    Python step if there are both
+
+    Params
+    ------
+    version     The version the step upgrades to
+    """
+    for ext in (".py", ".sql"):
+        path = os.path.join(UPGRADES_DIR, f"upgrade_v{version}{ext}")
+
+        if os.path.exists(path):
+            return path
+
+    raise FileNotFoundError(f"There is no upgrade step for version {version}")
+
+
+def run_step(version: int, dry_run: bool, batch_size: int, pause: float,
+             report):
+    """
+    Upgrades the database by one version, SQL steps run in a single
+    transaction along with the version bump and Python steps run through
+    a Migration
+
+    Params
+    ------
+    version         The version to upgrade to
+    dry_run         Whether to report the plan without changing anything
+    batch_size      The number of rows copied per transaction
+    pause           The number of seconds to wait between batches
+    report          The function called with each progress message
+    """
+    path = find_step(version)
+    db = get_db()
+
+    if path.endswith(".sql"):
+        with open(path) as f:
+            script = f.read()
+
+        if dry_run:
+            statements = split_statements(script)
+            report(f"  {len(statements)} statements in one transaction")
+
+            for statement in statements:
+                report(f"  sql: {statement.splitlines()[0]}")
+
+            return
+
+        run_in_transaction(db, script, version=version)
+        return
+
+    spec = spec_from_file_location(f"upgrade_v{version}", path)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    if dry_run and module.__doc__:
+        report(f"  {module.__doc__.strip().splitlines()[0]}")
+
+    migration = Migration(db, version=version, dry_run=dry_run,
+                          batch_size=batch_size, pause=pause, report=report)
+    module.upgrade(migration)
+    migration.commit()
+
+
+def upgrade_database(target: int, dry_run: bool, batch_size: int,
+                     pause: float, report) -> int:
+    """
+    Runs every step from the current version of the database to the target
+    version, stopping at the first step that fails. Returns the version the
+    database ends up at
+
+    Params
+    ------
+    target          The version to upgrade to
+    dry_run         Whether to report the plan without changing anything
+    batch_size      The number of rows copied per transaction
+    pause           The number of seconds to wait between batches
+    report          The function called with each progress message
+    """
+    version = get_db_version()
+
+    while version < target:
+        step_start = time.perf_counter()
+        next_version = version + 1
+        step = os.path.basename(find_step(next_version))
+
+        report(f"{'Plan for' if dry_run else 'Running'} {step}, version "
+               f"{version} to {next_version}")
+
+        run_step(next_version, dry_run=dry_run, batch_size=batch_size,
+                 pause=pause, report=report)
+
+        if not dry_run:
+            report(f"Upgraded from version {version} to {next_version} in "
+                   f"{time.perf_counter() - step_start:.2f} s")
+
+        version = next_version if dry_run else get_db_version()
+
+    return version
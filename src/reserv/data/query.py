@@ -1,127 +1,309 @@
-from .db import get_db
+from flask import current_app
+from datetime import datetime, timedelta
+
+from .cache import permission_cache
+from .events import publish_schedule_change
+from .storage import get_storage
 
 def get_user_by_id(id: str) -> list:
-    query = "SELECT * FROM user WHERE user_id = ?"
-    db = get_db()
-    res = db.execute(query, (id,)).fetchone()
+    return get_storage().get_user(id)
 
-    return res
 
 def get_name_by_id(id: str) -> str:
-    query = "SELECT display_name FROM user WHERE user_id = ?"
-    db = get_db()
-    res = db.execute(query, (id,)).fetchone()
-
-    return res
+    return get_storage().get_display_name(id)
 
 
 def get_booking_by_date(date: str) -> str:
-    query = "SELECT user_id, status FROM schedule WHERE date = ?"
-    db = get_db()
-    res = db.execute(query, (date,)).fetchone()
+    return get_storage().get_booking(date)
+
+
+def get_bookings_by_dates(dates: list) -> list:
+    """
+    Returns the active booking and booker display name for each of the
+    supplied dates in a single query, dates with no booking are omitted
+
+    Params
+    ------
+    dates       A list of dates as strings in the format YYYY-MM-DD
+    """
+    return get_storage().get_bookings(dates)
 
-    return res
+
+def get_schedule_version() -> int:
+    """
+    Returns the schedule change version, which changes every time a booking
+    is written or a booker changes their display name
+    """
+    return get_storage().get_schedule_version()
 
 
 def update_name(id: str, name: str):
-    query = "UPDATE user SET display_name = ? WHERE user_id = ? "
-    db = get_db()
-    db.execute(query, (name, id))
-    db.commit()
+    storage = get_storage()
+    storage.transaction(lambda: storage.update_name(id, name))
+    publish_schedule_change()
 
 
 def update_password(id: str, password: str):
-    query = "UPDATE user SET password = ? WHERE user_id = ? "
-    db = get_db()
-    db.execute(query, (password, id))
-    db.commit()
+    storage = get_storage()
+    storage.transaction(lambda: storage.update_password(id, password))
 
 
 def create_booking(date: str, id: str):
-    query = "INSERT INTO schedule (date, user_id) VALUES (?,?)"
-    db = get_db()
-    db.execute(query, (date, id))
-    db.commit()
+    storage = get_storage()
+    storage.transaction(lambda: storage.insert_booking(date, id))
+    publish_schedule_change()
 
 
 def update_booking(date: str, id: str):
-    query = """
-        UPDATE schedule SET
-        status = 'booked',
-        user_id = ?1
-        WHERE date = ?2
-    """
-    db = get_db()
-    db.execute(query, (id, date,))
-    db.commit()
+    storage = get_storage()
+    storage.transaction(lambda: storage.set_booking(date, id))
+    publish_schedule_change()
 
 
 def remove_booking(date: str):
-    query = "UPDATE schedule SET status = 'cancelled' WHERE date = ?"
-    db = get_db()
-    db.execute(query, (date,))
-    db.commit()
+    storage = get_storage()
+    storage.transaction(lambda: storage.cancel_booking(date))
+    publish_schedule_change()
 
 
-def get_bookings_by_params(date: str, period: str, id: str) -> int:
-    query = """
-        SELECT COUNT(*)
-        FROM schedule
-        WHERE strftime('%s', date)
-        BETWEEN strftime('%s', ?1)
-        AND strftime('%s', DATE(?1, ?2))
-        AND user_id = ?3
-        AND status = 'booked'
+def get_booked_dates_in_range(id: str, start: str, end: str) -> list:
     """
+    Returns the dates booked by the user between the start and end dates
+    inclusive
 
-    db = get_db()
-    res = db.execute(query, (date, period, id)).fetchone()[0]
+    Params
+    ------
+    id          The id of the user
+    start       The first date of the range as YYYY-MM-DD
+    end         The last date of the range as YYYY-MM-DD
+    """
+    return get_storage().get_booked_dates(id, start, end)
 
-    return res
 
+def get_booked_dates_around(id: str, first, last, window: int) -> list:
+    """
+    Returns the dates booked by the user in any period of the supplied number
+    of days that could contain a date between first and last, as date objects
 
-def get_user_status(id: str) -> str:
-    query = "SELECT status FROM user WHERE user_id = ?"
+    Params
+    ------
+    id          The id of the user
+    first       The earliest date the periods must contain
+    last        The latest date the periods must contain
+    window      The number of days in each period
+    """
+    # The last day of a window starting on a given date
+    period = window - 1
 
-    db = get_db()
-    res = db.execute(query, (id,)).fetchone()[0]
+    start = datetime.strftime(first - timedelta(days=period), "%Y-%m-%d")
+    end = datetime.strftime(last + timedelta(days=period), "%Y-%m-%d")
 
-    return res
+    return [datetime.strptime(d, "%Y-%m-%d").date()
+            for d in get_booked_dates_in_range(id=id, start=start, end=end)]
 
 
-def get_user_roles(id: str) -> list:
-    query = "SELECT role_id FROM user_role WHERE user_id = ?"
+def count_max_window(booked: list, target, window: int) -> int:
+    """
+    Returns the highest number of the booked dates in any period of the
+    supplied number of days that contains the target date
 
-    db = get_db()
-    res = db.execute(query, (id,)).fetchall()
+    Params
+    ------
+    booked      The booked dates as date objects
+    target      The date the periods must contain as a date object
+    window      The number of days in each period
+    """
+    period = window - 1
+    counts = [0]
 
-    return res
+    # Counts the bookings in every possible window containing the date
+    for i in range(window):
+        start_date = target - timedelta(days=i)
+        end_date = start_date + timedelta(days=period)
+        counts.append(sum(start_date <= d <= end_date for d in booked))
 
+    return max(counts)
 
-def get_user_permissions(id: str) -> set:
-    roles = get_user_roles(id)
 
-    perms = set()
+def book_date(date: str, id: str, window: int, limit: int) -> str:
+    """
+    Books the date for the user if it isn't already booked and the user stays
+    within the booking limit, checking and writing in a single storage
+    transaction so concurrent requests can't both pass the checks. Returns
+    "booked", "taken" if someone holds the date or "quota" if over the limit
 
-    for role_id in roles:
-        query = "SELECT permission_id FROM role_permission WHERE role_id = ?"
+    Params
+    ------
+    date        The date to book as YYYY-MM-DD
+    id          The id of the user
+    window      The number of days in each quota period
+    limit       The maximum number of bookings in any quota period
+    """
+    target = datetime.strptime(date, "%Y-%m-%d").date()
+    storage = get_storage()
+
+    def write():
+        booked = get_booked_dates_around(id=id, first=target, last=target,
+                                         window=window)
+
+        if target in booked:
+            return "taken"
+
+        # The new booking is counted so the limit itself is allowed
+        if count_max_window(booked + [target], target, window) > limit:
+            return "quota"
+
+        if not storage.upsert_booking(date, id):
+            return "taken"
+
+        return "booked"
+
+    result = storage.transaction(write)
+
+    if result == "booked":
+        publish_schedule_change()
+
+    return result
+
+
+def book_dates(dates: list, id: str, window: int, limit: int) -> dict:
+    """
+    Books every date the user can take in a single storage transaction,
+    checking the booking limit across the whole set at once. Returns the
+    result of each date keyed by date, "booked", "taken" if someone holds the
+    date or "quota" if booking it would go over the limit
+
+    Params
+    ------
+    dates       The dates to book as YYYY-MM-DD
+    id          The id of the user
+    window      The number of days in each quota period
+    limit       The maximum number of bookings in any quota period
+    """
+    targets = sorted(set(dates))
+
+    if not targets:
+        return {}
+
+    storage = get_storage()
+
+    def write():
+        results = {}
+        accepted = []
+
+        taken = {row["date"] for row in get_bookings_by_dates(targets)}
+        booked = get_booked_dates_around(
+            id=id,
+            first=datetime.strptime(targets[0], "%Y-%m-%d").date(),
+            last=datetime.strptime(targets[-1], "%Y-%m-%d").date(),
+            window=window
+        )
+
+        # Earlier dates in the set take priority when the limit is reached
+        for date in targets:
+            target = datetime.strptime(date, "%Y-%m-%d").date()
+
+            if date in taken:
+                results[date] = "taken"
+
+            elif count_max_window(booked + [target], target, window) > limit:
+                results[date] = "quota"
+
+            else:
+                booked.append(target)
+                accepted.append(date)
+                results[date] = "booked"
+
+        storage.upsert_bookings(accepted, id)
+        return results
+
+    results = storage.transaction(write)
+
+    if "booked" in results.values():
+        publish_schedule_change()
 
-        db = get_db()
-        res = db.execute(query, (role_id[0],)).fetchall()
+    return results
+
+
+def cancel_bookings_in_range(start: str, end: str) -> list:
+    """
+    Cancels every booking between the start and end dates inclusive in a
+    single storage transaction and returns the dates cancelled
+
+    Params
+    ------
+    start       The first date of the range as YYYY-MM-DD
+    end         The last date of the range as YYYY-MM-DD
+    """
+    storage = get_storage()
+    dates = storage.transaction(
+        lambda: storage.cancel_bookings_in_range(start, end))
+
+    if dates:
+        publish_schedule_change()
+
+    return dates
+
+
+def get_user_status(id: str) -> str:
+    return get_storage().get_user_status(id)
 
-        role_perms = [perm[0] for perm in res]
-        perms.update(role_perms)
+
+def get_user_roles(id: str) -> list:
+    return get_storage().get_user_role_ids(id)
+
+
+def get_user_permissions(id: str) -> set:
+    storage = get_storage()
+    perms = set()
+
+    for role_id in get_user_roles(id):
+        perms.update(storage.get_role_permission_ids(role_id))
 
     return perms
 
 
 def get_perm_by_name(name: str) -> int:
-    query = "SELECT id FROM permission WHERE name = ?"
+    return get_storage().get_permission_id(name)
+
 
-    db = get_db()
-    res = db.execute(query, (name,)).fetchone()[0]
+def get_role_permission_matrix() -> dict:
+    """
+    Returns the names of the permissions granted by each role, keyed by role id
+    """
+    return get_storage().get_role_permission_matrix()
 
-    return res
+
+def get_user_perm_names(id: str) -> set:
+    """
+    Returns the names of every permission the user holds through their roles,
+    using the cached role permission matrix and user roles
+
+    Params
+    ------
+    id          The id of the user
+    """
+    database = current_app.config["DATABASE"]
+
+    matrix = permission_cache.get_matrix(
+        database,
+        get_role_permission_matrix,
+        ttl=current_app.config["PERM_CACHE_TTL"]
+    )
+    roles = permission_cache.get_user_roles(
+        database,
+        id,
+        lambda: get_user_roles(id),
+        ttl=current_app.config["PERM_CACHE_TTL"],
+        max_users=current_app.config["PERM_CACHE_MAX_USERS"]
+    )
+
+    perms = set()
+
+    for role_id in roles:
+        perms.update(matrix.get(role_id, ()))
+
+    return perms
 
 
 def check_perm(id: str, perm: str) -> bool:
@@ -134,6 +316,4 @@ def check_perm(id: str, perm: str) -> bool:
     user_id     The id of the user to check the permissions
     perm        The name (not id) of the permission to check
     """
-    perms = get_user_permissions(id)
-
-    return get_perm_by_name(perm) in perms
\ No newline at end of file
+    return perm in get_user_perm_names(id)
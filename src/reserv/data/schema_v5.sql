@@ -1,4 +1,4 @@
-PRAGMA user_version = 2;
+PRAGMA user_version = 5;
 
 CREATE TABLE user (
 	"user_id" TEXT NOT NULL UNIQUE,
@@ -87,4 +87,63 @@ CREATE TRIGGER user_created_on_immutable
     BEFORE UPDATE OF created_on ON user
 BEGIN
     SELECT RAISE(FAIL, "Created on is read only");
-END;
\ No newline at end of file
+END;
+CREATE TABLE schedule_version (
+    "id"    INTEGER NOT NULL CHECK(id = 1),
+    "version"   INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY("id")
+);
+
+INSERT INTO schedule_version (id, version) VALUES (1, 0);
+
+CREATE TRIGGER schedule_version_on_insert
+    AFTER INSERT ON schedule
+BEGIN
+    UPDATE schedule_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER schedule_version_on_update
+    AFTER UPDATE ON schedule
+BEGIN
+    UPDATE schedule_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER schedule_version_on_delete
+    AFTER DELETE ON schedule
+BEGIN
+    UPDATE schedule_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER schedule_version_on_name_update
+    AFTER UPDATE OF display_name ON user
+BEGIN
+    UPDATE schedule_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE INDEX schedule_user_status_date
+    ON schedule (user_id, status, date);
+
+CREATE TABLE schedule_archive (
+    "date"	TEXT NOT NULL,
+    "created_on" TEXT NOT NULL,
+    "updated_on" TEXT NOT NULL,
+	"user_id" TEXT NOT NULL,
+	"status" TEXT NOT NULL,
+    "archived_on" TEXT NOT NULL DEFAULT (
+        strftime('%Y-%m-%d %H:%M:%S', 'now')
+    )
+);
+
+CREATE INDEX schedule_archive_date_status
+    ON schedule_archive (date, status);
+
+CREATE INDEX schedule_archive_user_status_date
+    ON schedule_archive (user_id, status, date);
+
+CREATE TABLE schedule_archive_state (
+    "id"    INTEGER NOT NULL CHECK(id = 1),
+    "archived_before"   TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY("id")
+);
+
+INSERT INTO schedule_archive_state (id, archived_before) VALUES (1, '');
@@ -0,0 +1,211 @@
+from .db import get_db, run_write
+from .storage import Storage
+
+# Archived bookings are read through the single row archive state, which is
+# joined first so the archive is never searched when the guard is false
+ARCHIVE_SOURCE = """
+    schedule_archive_state AS st
+    CROSS JOIN schedule_archive AS a
+"""
+
+# Only consults the archive when the earliest date requested, ?1, is before
+# the date the bookings were archived up to
+ARCHIVE_GUARD = "st.id = 1 AND ?1 < st.archived_before"
+
+# Books a date unless it's already booked, reactivating cancelled bookings
+UPSERT_BOOKING = """
+    INSERT INTO schedule (date, user_id) VALUES (?1, ?2)
+    ON CONFLICT(date) DO UPDATE SET
+    status = 'booked',
+    user_id = ?2
+    WHERE status != 'booked'
+"""
+
+INSERT_USER = """
+    INSERT INTO user (user_id, display_name, password, status)
+    VALUES (?,?,?,?)
+"""
+
+INSERT_USER_ROLE = """
+    INSERT INTO user_role (user_id, role_id)
+    VALUES (?,?)
+"""
+
+
+class SqliteStorage(Storage):
+    """
+    Stores the data in the SQLite database of the app through get_db
+    """
+    def get_user(self, user_id: str):
+        query = "SELECT * FROM user WHERE user_id = ?"
+        return get_db().execute(query, (user_id,)).fetchone()
+
+    def get_display_name(self, user_id: str) -> str:
+        query = "SELECT display_name FROM user WHERE user_id = ?"
+        res = get_db().execute(query, (user_id,)).fetchone()
+
+        return res[0] if res else None
+
+    def get_user_status(self, user_id: str) -> str:
+        query = "SELECT status FROM user WHERE user_id = ?"
+        return get_db().execute(query, (user_id,)).fetchone()[0]
+
+    def add_user(self, user_id: str, name: str, password: str, status: str):
+        get_db().execute(INSERT_USER, (user_id, name, password, status,))
+
+    def add_users(self, users: list):
+        # A failed executemany leaves the rows before the failure in place,
+        # so it has to run in a transaction that gets rolled back
+        get_db().executemany(INSERT_USER, users)
+
+    def update_name(self, user_id: str, name: str):
+        query = "UPDATE user SET display_name = ? WHERE user_id = ? "
+        get_db().execute(query, (name, user_id))
+
+    def update_password(self, user_id: str, password: str):
+        query = "UPDATE user SET password = ? WHERE user_id = ? "
+        get_db().execute(query, (password, user_id))
+
+    def get_role_id(self, name: str) -> int:
+        query = "SELECT id FROM role WHERE name = ?"
+        res = get_db().execute(query, (name,)).fetchone()
+
+        return res[0] if res else None
+
+    def get_permission_id(self, name: str) -> int:
+        query = "SELECT id FROM permission WHERE name = ?"
+        res = get_db().execute(query, (name,)).fetchone()
+
+        return res[0] if res else None
+
+    def add_user_role(self, user_id: str, role_id: int):
+        get_db().execute(INSERT_USER_ROLE, (user_id, role_id,))
+
+    def add_user_roles(self, user_roles: list):
+        get_db().executemany(INSERT_USER_ROLE, user_roles)
+
+    def get_user_role_ids(self, user_id: str) -> list:
+        query = "SELECT role_id FROM user_role WHERE user_id = ?"
+        res = get_db().execute(query, (user_id,)).fetchall()
+
+        return [row[0] for row in res]
+
+    def get_role_permission_ids(self, role_id: int) -> list:
+        query = "SELECT permission_id FROM role_permission WHERE role_id = ?"
+        res = get_db().execute(query, (role_id,)).fetchall()
+
+        return [row[0] for row in res]
+
+    def get_role_permission_matrix(self) -> dict:
+        query = """
+            SELECT rp.role_id, p.name
+            FROM role_permission AS rp
+            JOIN permission AS p ON p.id = rp.permission_id
+        """
+        matrix = {}
+
+        for row in get_db().execute(query).fetchall():
+            matrix.setdefault(row["role_id"], set()).add(row["name"])
+
+        return {role_id: frozenset(perms) for role_id, perms in matrix.items()}
+
+    def get_booking(self, date: str):
+        query = f"""
+            SELECT user_id, status FROM schedule WHERE date = ?1
+            UNION ALL
+            SELECT a.user_id, a.status
+            FROM {ARCHIVE_SOURCE}
+            WHERE {ARCHIVE_GUARD}
+            AND a.date = ?1
+            AND a.status = 'booked'
+        """
+        return get_db().execute(query, (date,)).fetchone()
+
+    def get_bookings(self, dates: list) -> list:
+        if not dates:
+            return []
+
+        # ?1 is the earliest date, the dates follow from ?2
+        placeholders = ",".join(f"?{i + 2}" for i in range(len(dates)))
+        query = f"""
+            SELECT s.date, s.user_id, u.user_id AS booker_id, u.display_name
+            FROM schedule AS s
+            LEFT JOIN user AS u ON u.user_id = s.user_id
+            WHERE s.date IN ({placeholders})
+            AND s.status = 'booked'
+            UNION ALL
+            SELECT a.date, a.user_id, u.user_id AS booker_id, u.display_name
+            FROM {ARCHIVE_SOURCE}
+            LEFT JOIN user AS u ON u.user_id = a.user_id
+            WHERE {ARCHIVE_GUARD}
+            AND a.date IN ({placeholders})
+            AND a.status = 'booked'
+        """
+        return get_db().execute(query, (min(dates),) + tuple(dates)).fetchall()
+
+    def get_schedule_version(self) -> int:
+        query = "SELECT version FROM schedule_version WHERE id = 1"
+        return get_db().execute(query).fetchone()[0]
+
+    def get_booked_dates(self, user_id: str, start: str, end: str) -> list:
+        # Compares the ISO date strings directly so the date index is used
+        query = f"""
+            SELECT date
+            FROM schedule
+            WHERE date BETWEEN ?1 AND ?2
+            AND user_id = ?3
+            AND status = 'booked'
+            UNION ALL
+            SELECT a.date
+            FROM {ARCHIVE_SOURCE}
+            WHERE {ARCHIVE_GUARD}
+            AND a.date BETWEEN ?1 AND ?2
+            AND a.user_id = ?3
+            AND a.status = 'booked'
+        """
+        res = get_db().execute(query, (start, end, user_id)).fetchall()
+
+        return [row[0] for row in res]
+
+    def insert_booking(self, date: str, user_id: str):
+        query = "INSERT INTO schedule (date, user_id) VALUES (?,?)"
+        get_db().execute(query, (date, user_id))
+
+    def set_booking(self, date: str, user_id: str):
+        query = """
+            UPDATE schedule SET
+            status = 'booked',
+            user_id = ?1
+            WHERE date = ?2
+        """
+        get_db().execute(query, (user_id, date,))
+
+    def cancel_booking(self, date: str):
+        query = "UPDATE schedule SET status = 'cancelled' WHERE date = ?"
+        get_db().execute(query, (date,))
+
+    def upsert_booking(self, date: str, user_id: str) -> bool:
+        return get_db().execute(UPSERT_BOOKING, (date, user_id)).rowcount > 0
+
+    def upsert_bookings(self, dates: list, user_id: str):
+        get_db().executemany(UPSERT_BOOKING, [(date, user_id) for date in dates])
+
+    def cancel_bookings_in_range(self, start: str, end: str) -> list:
+        select = """
+            SELECT date FROM schedule
+            WHERE date BETWEEN ?1 AND ?2
+            AND status = 'booked'
+        """
+        update = """
+            UPDATE schedule SET status = 'cancelled'
+            WHERE date BETWEEN ?1 AND ?2
+            AND status = 'booked'
+        """
+        db = get_db()
+        dates = [row[0] for row in db.execute(select, (start, end)).fetchall()]
+        db.execute(update, (start, end))
+
+        return dates
+
+    def transaction(self, write):
+        return run_write(write)
@@ -0,0 +1,199 @@
+from flask import current_app
+from abc import ABC, abstractmethod
+
+
+class Storage(ABC):
+    """
+    The data operations used by the app. Rows are returned as mappings that
+    can be indexed by column name, dates are strings in the format YYYY-MM-DD.
+    Lookups by name return None when nothing has the name
+    """
+    # Users
+
+    @abstractmethod
+    def get_user(self, user_id: str):
+        """
+        Returns the user with the id, or None if there is no such user
+        """
+
+    @abstractmethod
+    def get_display_name(self, user_id: str) -> str:
+        ...
+
+    @abstractmethod
+    def get_user_status(self, user_id: str) -> str:
+        ...
+
+    @abstractmethod
+    def add_user(self, user_id: str, name: str, password: str, status: str):
+        ...
+
+    @abstractmethod
+    def add_users(self, users: list):
+        """
+        Adds every user in one go, either all of them are added or none
+
+        Params
+        ------
+        users       (user_id, name, password, status) tuples
+        """
+
+    @abstractmethod
+    def update_name(self, user_id: str, name: str):
+        ...
+
+    @abstractmethod
+    def update_password(self, user_id: str, password: str):
+        ...
+
+    # Roles and permissions
+
+    @abstractmethod
+    def get_role_id(self, name: str) -> int:
+        """
+        Returns the id of the role with the name, or None if there is none
+        """
+
+    @abstractmethod
+    def get_permission_id(self, name: str) -> int:
+        """
+        Returns the id of the permission with the name, or None if there is
+        none
+        """
+
+    @abstractmethod
+    def add_user_role(self, user_id: str, role_id: int):
+        ...
+
+    @abstractmethod
+    def add_user_roles(self, user_roles: list):
+        """
+        Assigns every role in one go, either all of them are assigned or none
+
+        Params
+        ------
+        user_roles  (user_id, role_id) tuples
+        """
+
+    @abstractmethod
+    def get_user_role_ids(self, user_id: str) -> list:
+        ...
+
+    @abstractmethod
+    def get_role_permission_ids(self, role_id: int) -> list:
+        ...
+
+    @abstractmethod
+    def get_role_permission_matrix(self) -> dict:
+        """
+        Returns the names of the permissions granted by each role as frozen
+        sets keyed by role id
+        """
+
+    # Bookings
+
+    @abstractmethod
+    def get_booking(self, date: str):
+        """
+        Returns the user_id and status of the booking on the date, or None
+        """
+
+    @abstractmethod
+    def get_bookings(self, dates: list) -> list:
+        """
+        Returns the date, user_id, booker_id and display_name of the active
+        booking on each of the dates, dates with no booking are omitted
+        """
+
+    @abstractmethod
+    def get_schedule_version(self) -> int:
+        """
+        Returns a number that changes every time a booking is written or a
+        booker changes their display name
+        """
+
+    @abstractmethod
+    def get_booked_dates(self, user_id: str, start: str, end: str) -> list:
+        """
+        Returns the dates booked by the user between start and end inclusive
+        """
+
+    @abstractmethod
+    def insert_booking(self, date: str, user_id: str):
+        ...
+
+    @abstractmethod
+    def set_booking(self, date: str, user_id: str):
+        """
+        Makes the existing booking on the date an active booking for the user
+        """
+
+    @abstractmethod
+    def cancel_booking(self, date: str):
+        ...
+
+    @abstractmethod
+    def upsert_booking(self, date: str, user_id: str) -> bool:
+        """
+        Books the date for the user unless it's already booked, reactivating a
+        cancelled booking, returns False if the date was already booked
+        """
+
+    @abstractmethod
+    def upsert_bookings(self, dates: list, user_id: str):
+        """
+        Books each of the dates for the user as upsert_booking does
+        """
+
+    @abstractmethod
+    def cancel_bookings_in_range(self, start: str, end: str) -> list:
+        """
+        Cancels every active booking between start and end inclusive and
+        returns the dates cancelled
+        """
+
+    @abstractmethod
+    def transaction(self, write):
+        """
+        Runs the write atomically with respect to every other write and
+        returns its return value
+
+        Params
+        ------
+        write       A function making reads and writes through this storage
+        """
+
+
+def create_storage(app) -> Storage:
+    """
+    Creates the storage backend selected by the STORAGE_BACKEND config
+
+    Params
+    ------
+    app         The Flask app to create the storage for
+    """
+    backend = app.config.get("STORAGE_BACKEND", "sqlite")
+
+    if backend == "sqlite":
+        from .sqlite_storage import SqliteStorage
+        return SqliteStorage()
+
+    if backend == "memory":
+        from .memory_storage import MemoryStorage
+        return MemoryStorage.from_config(app)
+
+    raise ValueError(f"Unknown storage backend {backend}")
+
+
+def get_storage() -> Storage:
+    """
+    Returns the storage backend of the current app, apps built without
+    create_app use SQLite
+    """
+    storage = current_app.extensions.get("reserv_storage")
+
+    if storage is None:
+        from .sqlite_storage import SqliteStorage
+        storage = current_app.extensions["reserv_storage"] = SqliteStorage()
+
+    return storage
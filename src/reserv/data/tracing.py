@@ -0,0 +1,206 @@
+from flask import g, request, has_app_context
+
+import threading
+import logging
+import sqlite3
+import time
+import re
+
+# Slow statements and requests are written to their own logger so they can be
+# routed to a separate file
+slow_log = logging.getLogger("sql.slow")
+
+# The most statement fingerprints kept by a process
+MAX_FINGERPRINTS = 1000
+
+_lock = threading.Lock()
+_statements = {}
+_settings = {"slow_query_ms": 50.0}
+
+
+class TracedCursor(sqlite3.Cursor):
+    """
+    Cursor that records the time spent executing and fetching each statement
+    """
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        start = time.perf_counter()
+
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_statement(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        start = time.perf_counter()
+
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_statement(sql, time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+
+        try:
+            return super().fetchone()
+        finally:
+            record_fetch(self, time.perf_counter() - start)
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            record_fetch(self, time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+
+        try:
+            return super().fetchall()
+        finally:
+            record_fetch(self, time.perf_counter() - start)
+
+
+class TracedConnection(sqlite3.Connection):
+    """
+    Connection whose statements run through TracedCursor, only used when SQL
+    tracing is enabled so untraced connections pay nothing
+    """
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        start = time.perf_counter()
+
+        try:
+            return super().executescript(sql_script)
+        finally:
+            record_statement(sql_script, time.perf_counter() - start)
+
+
+def fingerprint(sql: str) -> str:
+    """
+    Normalises a statement so statements differing only by literal values or
+    the length of an IN list share one fingerprint
+
+    Params
+    ------
+    sql         The SQL statement
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?...)", sql)
+    return " ".join(sql.split())
+
+
+def record_statement(sql: str, elapsed: float):
+    """
+    Adds an executed statement to the request totals and process aggregates
+    and logs it if it was slow
+
+    Params
+    ------
+    sql         The SQL statement
+    elapsed     The number of seconds taken to execute it
+    """
+    elapsed_ms = elapsed * 1000
+    key = fingerprint(sql)
+
+    if has_app_context():
+        g.sql_count = g.get("sql_count", 0) + 1
+        g.sql_ms = g.get("sql_ms", 0.0) + elapsed_ms
+
+    with _lock:
+        stats = _statements.get(key)
+
+        if stats is None and len(_statements) < MAX_FINGERPRINTS:
+            stats = _statements[key] = {"count": 0, "total_ms": 0.0,
+                                        "max_ms": 0.0}
+
+        if stats is not None:
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    if elapsed_ms >= _settings["slow_query_ms"]:
+        slow_log.warning("Slow query took %.1f ms: %s", elapsed_ms, key)
+
+
+def record_fetch(cursor: TracedCursor, elapsed: float):
+    """
+    Adds the time spent fetching rows to the statement that produced them
+    without counting another statement
+
+    Params
+    ------
+    cursor      The cursor the rows were fetched from
+    elapsed     The number of seconds taken to fetch the rows
+    """
+    elapsed_ms = elapsed * 1000
+
+    if has_app_context():
+        g.sql_ms = g.get("sql_ms", 0.0) + elapsed_ms
+
+    with _lock:
+        stats = _statements.get(fingerprint(getattr(cursor, "_sql", "")))
+
+        if stats is not None:
+            stats["total_ms"] += elapsed_ms
+
+
+def get_top_statements(n: int) -> list:
+    """
+    Returns the n statement fingerprints with the highest total time in this
+    process, most expensive first
+
+    Params
+    ------
+    n           The number of fingerprints to return
+    """
+    with _lock:
+        top = sorted(_statements.items(), key=lambda item: item[1]["total_ms"],
+                     reverse=True)[:n]
+
+        return [dict(statement=key, **stats) for key, stats in top]
+
+
+def init_tracing(app):
+    """
+    Registers the request hooks that report the statement totals of each
+    request, does nothing unless SQL tracing is enabled in the config
+
+    Params
+    ------
+    app         The Flask app to register to
+    """
+    if not app.config.get("SQL_TRACE", False):
+        return
+
+    _settings["slow_query_ms"] = app.config["SQL_SLOW_QUERY_MS"]
+    slow_request_ms = app.config["SQL_SLOW_REQUEST_MS"]
+
+    @app.after_request
+    def add_server_timing(response):
+        count = g.get("sql_count", 0)
+        total_ms = g.get("sql_ms", 0.0)
+
+        response.headers.add(
+            "Server-Timing", f'db;dur={total_ms:.2f};desc="{count} statements"')
+
+        if total_ms >= slow_request_ms:
+            slow_log.warning("Slow request %s spent %.1f ms on %s statements",
+                             request.path, total_ms, count)
+
+        return response
+
+    logging.info("SQL tracing enabled")
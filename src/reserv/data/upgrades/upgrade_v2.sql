@@ -0,0 +1,2 @@
+-- Databases created from the base schema are already stamped at version 2,
+-- this step only brings databases upgraded through upgrade_v1 in line
@@ -0,0 +1,31 @@
+CREATE TABLE IF NOT EXISTS schedule_version (
+    "id"    INTEGER NOT NULL CHECK(id = 1),
+    "version"   INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY("id")
+);
+
+INSERT OR IGNORE INTO schedule_version (id, version) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS schedule_version_on_insert
+    AFTER INSERT ON schedule
+BEGIN
+    UPDATE schedule_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS schedule_version_on_update
+    AFTER UPDATE ON schedule
+BEGIN
+    UPDATE schedule_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS schedule_version_on_delete
+    AFTER DELETE ON schedule
+BEGIN
+    UPDATE schedule_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS schedule_version_on_name_update
+    AFTER UPDATE OF display_name ON user
+BEGIN
+    UPDATE schedule_version SET version = version + 1 WHERE id = 1;
+END;
@@ -0,0 +1,5 @@
+-- Covers the booking quota lookup, which filters by user and status over a
+-- date range. user_role is already covered by its (user_id, role_id) key
+
+CREATE INDEX IF NOT EXISTS schedule_user_status_date
+    ON schedule (user_id, status, date);
@@ -0,0 +1,28 @@
+-- Bookings moved out of schedule by the archive-bookings command. Reads only
+-- consult the archive for dates before archived_before, which is '' until
+-- the first bookings are archived
+
+CREATE TABLE IF NOT EXISTS schedule_archive (
+    "date"	TEXT NOT NULL,
+    "created_on" TEXT NOT NULL,
+    "updated_on" TEXT NOT NULL,
+	"user_id" TEXT NOT NULL,
+	"status" TEXT NOT NULL,
+    "archived_on" TEXT NOT NULL DEFAULT (
+        strftime('%Y-%m-%d %H:%M:%S', 'now')
+    )
+);
+
+CREATE INDEX IF NOT EXISTS schedule_archive_date_status
+    ON schedule_archive (date, status);
+
+CREATE INDEX IF NOT EXISTS schedule_archive_user_status_date
+    ON schedule_archive (user_id, status, date);
+
+CREATE TABLE IF NOT EXISTS schedule_archive_state (
+    "id"    INTEGER NOT NULL CHECK(id = 1),
+    "archived_before"   TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY("id")
+);
+
+INSERT OR IGNORE INTO schedule_archive_state (id, archived_before) VALUES (1, '');
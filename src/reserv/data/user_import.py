@@ -0,0 +1,291 @@
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.security import generate_password_hash
+from itertools import islice, repeat
+
+import logging
+import sqlite3
+import click
+import json
+import csv
+import os
+
+from .cache import permission_cache
+from .db import get_role_by_name
+from .storage import get_storage
+from ..tools.passwords import get_password_hasher
+
+# The statuses a user can be created with, as allowed by the user table
+USER_STATUSES = ("active", "inactive", "terminated")
+
+# The file formats that can be imported, keyed by file extension
+IMPORT_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+
+def read_rows(path: str, fmt: str):
+    """
+    Yields the line number and fields of each row of the file one at a time,
+    or the line number and the error if the line can't be read
+
+    Params
+    ------
+    path        The path of the file to import
+    fmt         Either csv or jsonl
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+
+            for row in reader:
+                yield reader.line_num, row
+
+            return
+
+        for line, text in enumerate(f, start=1):
+            if not text.strip():
+                continue
+
+            try:
+                row = json.loads(text)
+
+                if not isinstance(row, dict):
+                    raise ValueError("each line must be a JSON object")
+
+                yield line, row
+
+            except ValueError as err:
+                yield line, err
+
+
+def check_row(row: dict, seen: set, roles: dict) -> tuple:
+    """
+    Returns the (user id, display name, password, status, role id) of the row
+    or raises ValueError describing what's wrong with it
+
+    Params
+    ------
+    row         The fields of the row
+    seen        The user ids of the earlier rows in the file
+    roles       The role ids looked up so far keyed by name
+    """
+    def field(name: str) -> str:
+        value = row.get(name)
+        return str(value).strip() if value is not None else ""
+
+    user_id = field("user_id")
+    name = field("display_name")
+    password = row.get("password") or ""
+    status = field("status") or "active"
+    role = field("role")
+
+    for column, value in (("user_id", user_id), ("display_name", name),
+                          ("password", password)):
+        if not value:
+            raise ValueError(f"{column} is required")
+
+    if status not in USER_STATUSES:
+        raise ValueError(f"status must be one of {', '.join(USER_STATUSES)}")
+
+    if user_id in seen:
+        raise ValueError("user_id appears earlier in the file")
+
+    seen.add(user_id)
+
+    if get_storage().get_user(user_id) is not None:
+        raise ValueError("a user with this user_id already exists")
+
+    role_id = None
+
+    if role:
+        if role not in roles:
+            roles[role] = get_role_by_name(role)
+
+        role_id = roles[role]
+
+    return user_id, name, str(password), status, role_id
+
+
+def hash_password(password: str, method: str, salt_length: int) -> str:
+    """
+    Hashes a password in a worker process of the import pool
+    """
+    return generate_password_hash(password, method, salt_length)
+
+
+def add_rows(rows: list):
+    """
+    Adds the users of the rows and assigns their roles in one transaction as
+    add_user and grant_role do, either every row is added or none
+
+    Params
+    ------
+    rows        (user id, display name, hash, status, role id) tuples
+    """
+    storage = get_storage()
+
+    def write():
+        storage.add_users([row[:4] for row in rows])
+        storage.add_user_roles([(row[0], row[4]) for row in rows
+                                if row[4] is not None])
+
+    storage.transaction(write)
+
+    for row in rows:
+        if row[4] is not None:
+            permission_cache.invalidate_user(current_app.config["DATABASE"],
+                                             row[0])
+
+
+def write_chunk(rows: list, lines: list, report) -> int:
+    """
+    Adds the chunk of rows in one transaction, or one row at a time if the
+    chunk breaks a constraint so only the offending rows are left out.
+    Returns the number of users added
+
+    Params
+    ------
+    rows        (user id, display name, hash, status, role id) tuples
+    lines       The line number of each row
+    report      The function called with the line, user id and error of each
+                row that couldn't be added
+    """
+    try:
+        add_rows(rows)
+        return len(rows)
+
+    except sqlite3.IntegrityError:
+        added = 0
+
+        for line, row in zip(lines, rows):
+            try:
+                add_rows([row])
+                added += 1
+
+            except sqlite3.IntegrityError as err:
+                report(line, row[0], err)
+
+        return added
+
+
+def import_users(path: str, fmt: str, chunk_size: int, workers: int,
+                 dry_run: bool, report) -> tuple:
+    """
+    Streams the users from the file, hashes their passwords in a process
+    pool and adds them in transactions of chunk_size users. Rows with errors
+    are reported and skipped. Returns the number of users added, or that
+    would be added in a dry run, and the number of rows skipped
+
+    Params
+    ------
+    path        The path of the CSV or JSON lines file
+    fmt         Either csv or jsonl
+    chunk_size  The number of rows hashed and added together
+    workers     The number of hashing processes
+    dry_run     Whether to only check the rows, no passwords are hashed
+    report      The function called with the line, user id and error of each
+                row that is skipped
+    """
+    # Imported here so apps that only register the command don't load
+    # multiprocessing at startup
+    from concurrent.futures import ProcessPoolExecutor
+
+    hasher = get_password_hasher()
+    rows = read_rows(path, fmt)
+    seen = set()
+    roles = {}
+    added = 0
+    skipped = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+
+            if not chunk:
+                break
+
+            valid = []
+            lines = []
+
+            for line, row in chunk:
+                try:
+                    if isinstance(row, Exception):
+                        raise row
+
+                    valid.append(check_row(row, seen, roles))
+                    lines.append(line)
+
+                except ValueError as err:
+                    report(line, row.get("user_id") if isinstance(row, dict)
+                           else None, err)
+                    skipped += 1
+
+            if dry_run or not valid:
+                added += len(valid)
+                continue
+
+            hashes = pool.map(hash_password, [row[2] for row in valid],
+                              repeat(hasher.method), repeat(hasher.salt_length),
+                              chunksize=max(len(valid) // (workers * 4), 1))
+
+            hashed = [row[:2] + (pwhash,) + row[3:]
+                      for row, pwhash in zip(valid, hashes)]
+
+            chunk_added = write_chunk(hashed, lines, report)
+            added += chunk_added
+            skipped += len(hashed) - chunk_added
+
+            logging.info("Imported %s users from %s so far", added, path)
+
+    return added, skipped
+
+
+@click.command("import-users")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]),
+              default=None, help="File format, taken from the extension by "
+                                 "default")
+@click.option("--chunk-size", default=500, help="Users added per transaction")
+@click.option("--workers", default=None, type=int,
+              help="Password hashing processes, one per CPU by default")
+@click.option("--dry-run", is_flag=True,
+              help="Check every row without adding any users")
+@with_appcontext
+def import_users_command(path, fmt, chunk_size, workers, dry_run):
+    """
+    Defines a click command that creates the users in a CSV or JSON lines
+    file with the columns user_id, display_name, password, status and role.
+    Status defaults to active and role can be left empty
+
+    Params
+    ------
+    path            The path of the file to import
+    fmt             The file format, csv or jsonl
+    chunk_size      The number of users added per transaction
+    workers         The number of password hashing processes
+    dry_run         Whether to only check the rows
+    """
+    if fmt is None:
+        fmt = IMPORT_FORMATS.get(os.path.splitext(path)[1].lower())
+
+        if fmt is None:
+            click.echo("Unknown file extension, use --format csv or jsonl")
+            return
+
+    def report(line: int, user_id: str, err):
+        click.echo(f"Line {line} ({user_id or 'no user_id'}): {err}", err=True)
+        logging.warning("Skipped line %s of %s, %s", line, path, err)
+
+    try:
+        added, skipped = import_users(path=path, fmt=fmt,
+                                      chunk_size=chunk_size,
+                                      workers=workers or os.cpu_count(),
+                                      dry_run=dry_run, report=report)
+
+        verb = "Would import" if dry_run else "Imported"
+        click.echo(f"{verb} {added} users, skipped {skipped} rows")
+        logging.info("%s %s users from %s, skipped %s rows", verb, added,
+                     path, skipped)
+
+    except Exception as err:
+        click.echo(f"An error occurred when importing users, {err}")
+        logging.error("Error importing users, %s", err)
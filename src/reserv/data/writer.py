@@ -0,0 +1,158 @@
+from concurrent.futures import Future
+from flask import g
+
+import threading
+import logging
+import queue
+import time
+
+# The cross-process lock is only available on platforms with flock, elsewhere
+# writers fall back to waiting on SQLite's busy timeout
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class WriteQueue:
+    """
+    Serialises the writes of this process through one writer thread that owns
+    its own connection. Writes that arrive close together are committed in a
+    single transaction, each in its own savepoint so a failed write only
+    rolls back itself, and the writer holds a file lock while committing so
+    the writers of other processes take turns instead of hitting SQLITE_BUSY
+    """
+    def __init__(self, app, connect, lock_path: str, batch_size: int,
+                 batch_wait: float):
+        """
+        Params
+        ------
+        app             The Flask app whose context the writes run in
+        connect         A function opening the writer's connection
+        lock_path       The path of the file locked while committing
+        batch_size      The maximum number of writes committed together
+        batch_wait      The number of seconds to wait for more writes
+        """
+        self._app = app
+        self._connect = connect
+        self._lock_path = lock_path
+        self._batch_size = batch_size
+        self._batch_wait = batch_wait
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, write) -> Future:
+        """
+        Queues a write and returns a future resolved with its return value
+        once the transaction containing it has been committed
+
+        Params
+        ------
+        write       A function making the write through get_db, it must not
+                    commit or roll back itself
+        """
+        future = Future()
+        self._jobs.put((write, future))
+        return future
+
+    def _next_batch(self) -> list:
+        batch = [self._jobs.get()]
+        deadline = time.monotonic() + self._batch_wait
+
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+
+            try:
+                if remaining > 0:
+                    batch.append(self._jobs.get(timeout=remaining))
+                else:
+                    batch.append(self._jobs.get_nowait())
+
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        with self._app.app_context():
+            db = self._connect()
+
+        lock_file = open(self._lock_path, "a") if fcntl else None
+
+        while True:
+            batch = self._next_batch()
+
+            # An unexpected error fails the batch but must not end the thread,
+            # or every later write would wait out its timeout
+            try:
+                with self._app.app_context():
+                    # Writes reach the writer's connection through get_db, it
+                    # is removed again so the teardown never closes it
+                    g.db = db
+
+                    try:
+                        self._commit(db, batch, lock_file)
+                    finally:
+                        g.pop("db", None)
+
+            except Exception as err:
+                logging.error("The database writer failed a batch of %s "
+                              "writes, %s", len(batch), err)
+
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(err)
+
+    def _commit(self, db, batch: list, lock_file):
+        results = {}
+
+        if lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        # Writes cancelled while queued are skipped, the rest can no longer be
+        # cancelled and all hear back if the transaction fails to start
+        started = [future for _, future in batch
+                   if future.set_running_or_notify_cancel()]
+
+        try:
+            db.execute("BEGIN IMMEDIATE")
+
+            for write, future in batch:
+                if future not in started:
+                    continue
+
+                db.execute("SAVEPOINT queued_write")
+
+                try:
+                    results[future] = (write(), None)
+                    db.execute("RELEASE queued_write")
+
+                except Exception as err:
+                    db.execute("ROLLBACK TO queued_write")
+                    db.execute("RELEASE queued_write")
+                    results[future] = (None, err)
+
+            db.commit()
+
+        except Exception as err:
+            if db.in_transaction:
+                db.rollback()
+
+            logging.error("Failed to commit %s queued writes, %s",
+                          len(started), err)
+            results = {future: (None, err) for future in started}
+
+        finally:
+            if lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        # Callers only hear back once their write is durable
+        for future in started:
+            result, err = results[future]
+
+            if err is None:
+                future.set_result(result)
+            else:
+                future.set_exception(err)
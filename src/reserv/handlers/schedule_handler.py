@@ -1,11 +1,22 @@
-from flask import Blueprint, request, jsonify, session, g
-from datetime import date, datetime, timedelta
+from flask import Blueprint, request, jsonify, session, g, make_response
+from flask import Response, current_app, stream_with_context
+from datetime import date, datetime
+import hashlib
+import json
 import logging
+import sqlite3
 
-from ..data.query import get_booking_by_date, get_name_by_id, check_perm
-from ..data.query import create_booking, update_booking, get_bookings_by_params
-from ..data.query import remove_booking
-from ..views.auth import login_required_ajax
+from ..data.query import get_booking_by_date
+from ..data.query import book_date, book_dates
+from ..data.query import cancel_bookings_in_range
+from ..data.query import remove_booking, get_bookings_by_dates
+from ..data.query import get_schedule_version
+from ..data.db import read_only_db
+from ..data.events import schedule_events
+from ..views.auth import login_required_ajax, has_perm
+
+# The most dates a single bulk request can book
+MAX_BULK_DATES = 100
 
 schedule_handler_bp = Blueprint(
     "schedule_handler",
@@ -15,6 +26,7 @@ schedule_handler_bp = Blueprint(
 
 @schedule_handler_bp.route("/get_current_user", methods=["GET"])
 @login_required_ajax
+@read_only_db
 def get_current_user():
     """
     Handler for returning the display name of the currently logged in user
@@ -22,20 +34,19 @@ def get_current_user():
     logging.info("Getting currently logged in user...")
 
     user_id = g.user["user_id"]
-    res = get_name_by_id(user_id)
+    name = g.user["display_name"]
 
-    if not res or res["display_name"] == "":
-        logging.warning(f"No display name found for user, {user_id}")
+    if not name:
+        logging.warning("No display name found for user, %s", user_id)
         return jsonify(message="Logged in user has no display name"), 403
 
-    name = res["display_name"]
-
-    logging.debug(f"Found name, {name} for id, {user_id}")
+    logging.debug("Found name, %s for id, %s", name, user_id)
     return jsonify(user=name), 200
 
 
 @schedule_handler_bp.route("/check_perm", methods=["GET"])
 @login_required_ajax
+@read_only_db
 def check_user_perm():
     """
     Handler for returning True if the currently logged in user has the manage
@@ -44,67 +55,106 @@ def check_user_perm():
     user_id = g.user["user_id"]
     perm = request.args.get('perm')
 
-    try:
-        res = check_perm(user_id, perm)
-        logging.info(f"User {user_id} has {perm} permissions: {res}")
+    res = has_perm(perm)
+    logging.info("User %s has %s permissions: %s", user_id, perm, res)
 
-        return jsonify(res=res), 200
-
-    except Exception as err:
-        logging.error(f"Error when checking permissions for user, {user_id}")
-        return jsonify(message="Logged in user has no display name"), 500
+    return jsonify(res=res), 200
 
 
 @schedule_handler_bp.route("/get_bookers", methods=["GET"])
 @login_required_ajax
+@read_only_db
 def get_bookers():
     """
     Handler for returning the display name of the booker assigned to each date
-    in the list supplied by the request
+    in the list supplied by the request, returns 304 if the schedule hasn't
+    changed since the version the client already has
     """
     current_user = session.get('user_id')
     dates_arg = request.args.getlist("date_list[]")
-    bookings = {}
 
-    logging.debug(f"Getting bookers for {dates_arg}")
+    etag = get_schedule_etag(user_id=current_user, dates=dates_arg)
+
+    if etag is not None and request.if_none_match.contains(etag):
+        logging.debug("Schedule unchanged for %s, returning 304", current_user)
+        response = make_response("", 304)
+        response.set_etag(etag)
+        return response
+
+    bookings = get_bookings(user_id=current_user, dates=dates_arg)
+
+    logging.debug("Sending: %s", bookings)
+    response = jsonify(res=bookings)
+
+    # Makes the browser revalidate with the ETag on every poll
+    response.cache_control.no_cache = True
+
+    if etag is not None:
+        response.set_etag(etag)
+
+    return response
+
+
+@schedule_handler_bp.route("/schedule_stream", methods=["GET"])
+@login_required_ajax
+@read_only_db
+def schedule_stream():
+    """
+    Handler for streaming the bookers of the dates supplied by the request as
+    server-sent events, a new event is pushed whenever the schedule changes.
+    Pages that already show a schedule version can pass it so the stream
+    only pushes once the schedule moves on from it
+    """
+    current_user = session.get('user_id')
+    dates_arg = request.args.getlist("date_list[]")
+    known_version = request.args.get("version", type=int)
+    max_clients = current_app.config["STREAM_MAX_CLIENTS"]
+    interval = current_app.config["STREAM_CHECK_INTERVAL"]
+
+    if not schedule_events.connect(max_clients):
+        logging.warning("Refused schedule stream for %s, %s streams already "
+                        "open", current_user, max_clients)
+        return jsonify(message="Too many open schedule streams"), 503
+
+    logging.info("Opened schedule stream for %s", current_user)
+
+    @stream_with_context
+    def generate():
+        sent_version = known_version
+        local_version = schedule_events.version
+
+        yield f"retry: {interval * 1000}\n\n"
+
+        while True:
+            try:
+                version = get_schedule_version()
+
+            except Exception as err:
+                logging.error("Error retrieving schedule version, %s", err)
+                version = None
+
+            # Bookings written by other workers are picked up via the database
+            # version, writes in this process wake the stream immediately
+            if version is None or version != sent_version:
+                bookings = get_bookings(user_id=current_user, dates=dates_arg)
+                yield f"event: schedule\ndata: {json.dumps(bookings)}\n\n"
+                sent_version = version
 
-    for date in dates_arg:
-        try:
-            booking = get_booking_by_date(date)
-
-            if booking and booking["status"] == "booked":
-                booker = booking["user_id"]
-                res = get_name_by_id(booker)
-
-                if not res or res["display_name"] == "":
-                    logging.warning(f"No display name found for user, {booker}")
-
-                name = res["display_name"]
-                logging.debug(f"Found booker with name, {name} for {date}")
-                bookings[date] = {
-                    "isBooked": True,
-                    "booker": name,
-                    "bookPerm": name == current_user
-                }
-            
             else:
-                logging.debug(f"No booker found for {date}")
-                bookings[date] = {
-                    "isBooked": False,
-                    "booker": "",
-                    "bookPerm": False
-                }
+                yield ": keep-alive\n\n"
 
-        except Exception as err:
-            logging.error(f"Error retrieving booker for {date}, {err}")
-            bookings[date] = {
-                "isBooked": False,
-                "booker": "",
-                "bookPerm": False
-            }
-    
-    logging.debug(f"Sending: {bookings}")
-    return jsonify(res=bookings)
+            local_version = schedule_events.wait(local_version, interval)
+
+    def close():
+        schedule_events.disconnect()
+        logging.info("Closed schedule stream for %s", current_user)
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.call_on_close(close)
+
+    return response
     
 
 @schedule_handler_bp.route("/set_booker", methods=["GET"])
@@ -118,47 +168,50 @@ def set_booker():
     current_user = session.get('user_id')
 
     # Checks if they have valid permissions to book
-    if not check_perm(current_user, "book"):
-        logging.debug(f"{current_user} could not book {date_arg} as they don't "
-                      "have book permissions")
+    if not g.book_perm:
+        logging.debug("%s could not book %s as they don't have book "
+                      "permissions", current_user, date_arg)
         return jsonify(message="You do not have permission to book, please log "
                        "in as a user"), 403
     # Checks if the booking is valid
     elif datetime.strptime(date_arg, "%Y-%m-%d").date() < date.today():
-        logging.debug(f"Date {date_arg} was not booked for {current_user} as "
-                      "booking date is in the past")
+        logging.debug("Date %s was not booked for %s as booking date is in the "
+                      "past", date_arg, current_user)
         return jsonify(message="Booking date cannot be in the past"), 403
 
-    elif not validate_booking(date_arg):
-        logging.debug(f"Date {date_arg} was not booked for {current_user} as "
-                      "user has booked at least twice in a seven day period")
-        return jsonify(message=f"Cannot book more than twice within a seven "
-                       "day period"), 403
-
     else:
-        try:
-            booking = get_booking_by_date(date_arg)
+        window = current_app.config["QUOTA_WINDOW_DAYS"]
+        limit = current_app.config["QUOTA_MAX_BOOKINGS"]
 
-            if booking:
-                if booking["status"] != 'booked':
-                    update_booking(date=date_arg, id=current_user)
+        try:
+            res = book_date(date=date_arg, id=current_user, window=window,
+                            limit=limit)
 
-                else:
-                    logging.info(f"Could not book date {date_arg} for "
-                                 f"{current_user} as it is already booked")
-                    return jsonify(message="Date is already booked"), 403
-                
-            else:
-                create_booking(date=date_arg, id=current_user)
+        except sqlite3.OperationalError as err:
+            logging.warning("Database busy booking date %s for %s, %s",
+                            date_arg, current_user, err)
+            return jsonify(message="The schedule is busy, please try again"), 503
 
-            logging.info(f"Booked date {date_arg} for {current_user}")
-            return jsonify(message="Booked"), 200
-            
         except Exception as err:
-            logging.error(f"Error booking date {date_arg} for {current_user} "
-                          f"with error, {err}")
+            logging.error("Error booking date %s for %s with error, %s",
+                          date_arg, current_user, err)
             return jsonify(message="Something went wrong with the request"), 500
 
+        if res == "taken":
+            logging.info("Could not book date %s for %s as it is already "
+                         "booked", date_arg, current_user)
+            return jsonify(message="Date is already booked"), 409
+
+        elif res == "quota":
+            logging.debug("Date %s was not booked for %s as user has booked at "
+                          "least %s times in a %s day period",
+                          date_arg, current_user, limit, window)
+            return jsonify(message=f"Cannot book more than {limit} times "
+                           f"within a {window} day period"), 403
+
+        logging.info("Booked date %s for %s", date_arg, current_user)
+        return jsonify(message="Booked"), 200
+
 
 @schedule_handler_bp.route("/cancel_booking", methods=["GET"])
 @login_required_ajax
@@ -172,8 +225,8 @@ def cancel_booking():
 
     # Checks if the date can be cancelled first
     if datetime.strptime(date_arg, "%Y-%m-%d").date() < date.today():
-        logging.debug(f"Date {date_arg} was not cancelled for {curr_user} " 
-                      "as cancel date is in the past")
+        logging.debug("Date %s was not cancelled for %s as cancel date is in "
+                      "the past", date_arg, curr_user)
         return jsonify(message="Cancel date cannot be in the past"), 403
     
     else:
@@ -184,80 +237,208 @@ def cancel_booking():
             if booking:
                 booking_user = booking["user_id"]
                 # Checks if the user on the booking matches the user logged in
-                if curr_user == booking_user or check_perm(curr_user, "manage"):
+                if curr_user == booking_user or g.manage_perm:
                     remove_booking(date=date_arg)
 
-                    logging.info(f"Cancelled booking by {booking_user} on "
-                                 f"{date_arg}")
+                    logging.info("Cancelled booking by %s on %s",
+                                 booking_user, date_arg)
                     return jsonify(message="Cancelled booking")
                 
                 else:
-                    logging.debug(f"Booking on {date_arg} was not cancelled as "
-                                  f"logged in user {curr_user} did not match"
-                                  f" booked user {booking_user}")
+                    logging.debug("Booking on %s was not cancelled as logged "
+                                  "in user %s did not match booked user %s",
+                                  date_arg, curr_user, booking_user)
                     return jsonify(
                         message="Something went wrong with the request"), 500
             
             else:
-                logging.warning("Could not cancel booking, no booker found " 
-                                f"on {date_arg}")
+                logging.warning("Could not cancel booking, no booker found on "
+                                "%s", date_arg)
                 return jsonify(
                     message="Something went wrong with this request"), 500
 
         except Exception as err:
-            logging.error(f"Error cancelling booking for {date_arg} with " 
-                          f"error, {err}"), 500
+            logging.error("Error cancelling booking for %s with error, %s",
+                          date_arg, err), 500
             return jsonify(message="Something went wrong with the request"), 500
             
 
-def validate_booking(date_str: str) -> bool:
+@schedule_handler_bp.route("/set_bookers", methods=["GET"])
+@login_required_ajax
+def set_bookers():
+    """
+    Handler for booking every date in the list supplied by the request for
+    the currently logged in user in one transaction, returns the result for
+    each date
     """
-    Checks if there would be any 7 day periods where there are more than 3
-    bookings made by the logged in user if they book the supplied date
+    dates_arg = request.args.getlist("date_list[]")
+    current_user = session.get('user_id')
+
+    if not g.book_perm:
+        logging.debug("%s could not book %s as they don't have book "
+                      "permissions", current_user, dates_arg)
+        return jsonify(message="You do not have permission to book, please log "
+                       "in as a user"), 403
+
+    elif len(dates_arg) > MAX_BULK_DATES:
+        return jsonify(message=f"Cannot book more than {MAX_BULK_DATES} dates "
+                       "at once"), 400
+
+    results = {}
+    valid_dates = []
+
+    # Rejects invalid and past dates before opening the transaction
+    for date_arg in dates_arg:
+        try:
+            booking_date = datetime.strptime(date_arg, "%Y-%m-%d").date()
+
+        except ValueError:
+            results[date_arg] = "invalid"
+            continue
+
+        if booking_date < date.today():
+            results[date_arg] = "past"
+        else:
+            valid_dates.append(date_arg)
+
+    try:
+        results.update(book_dates(
+            dates=valid_dates,
+            id=current_user,
+            window=current_app.config["QUOTA_WINDOW_DAYS"],
+            limit=current_app.config["QUOTA_MAX_BOOKINGS"]
+        ))
+
+    except sqlite3.OperationalError as err:
+        logging.warning("Database busy booking dates %s for %s, %s",
+                        valid_dates, current_user, err)
+        return jsonify(message="The schedule is busy, please try again"), 503
+
+    except Exception as err:
+        logging.error("Error booking dates %s for %s with error, %s",
+                      valid_dates, current_user, err)
+        return jsonify(message="Something went wrong with the request"), 500
+
+    logging.info("Bulk booking for %s: %s", current_user, results)
+    return jsonify(res=results), 200
+
+
+@schedule_handler_bp.route("/cancel_bookings", methods=["GET"])
+@login_required_ajax
+def cancel_bookings():
+    """
+    Handler for cancelling every booking between the start and end dates
+    supplied by the request, only available to users with manage permissions
+    """
+    start_arg = request.args.get('start')
+    end_arg = request.args.get('end')
+    curr_user = session.get('user_id')
+
+    if not g.manage_perm:
+        logging.debug("%s could not cancel bookings from %s to %s as they "
+                      "don't have manage permissions",
+                      curr_user, start_arg, end_arg)
+        return jsonify(message="You do not have permission to cancel these "
+                       "bookings"), 403
+
+    try:
+        start_date = datetime.strptime(start_arg, "%Y-%m-%d").date()
+        end_date = datetime.strptime(end_arg, "%Y-%m-%d").date()
+
+    except (TypeError, ValueError):
+        return jsonify(message="Start and end must be dates"), 400
+
+    if start_date < date.today():
+        logging.debug("Bookings from %s were not cancelled for %s as the start "
+                      "date is in the past", start_arg, curr_user)
+        return jsonify(message="Cancel date cannot be in the past"), 403
+
+    elif end_date < start_date:
+        return jsonify(message="End date cannot be before start date"), 400
+
+    try:
+        dates = cancel_bookings_in_range(start=start_arg, end=end_arg)
+
+    except Exception as err:
+        logging.error("Error cancelling bookings from %s to %s with error, %s",
+                      start_arg, end_arg, err)
+        return jsonify(message="Something went wrong with the request"), 500
+
+    logging.info("Cancelled bookings on %s by %s", dates, curr_user)
+    return jsonify(res={d: "cancelled" for d in dates}), 200
+
+
+def get_bookings(user_id: str, dates: list) -> dict:
+    """
+    Returns the booking status and booker display name for each of the supplied
+    dates, keyed by date
 
     Params
     ------
-    date_str        The date the user wants to book
+    user_id         The id of the user making the request
+    dates           The list of dates to look up
     """
-    date = datetime.strptime(date_str, "%Y-%m-%d").date()
-    # The query excludes the booking date itself so it validates a 7 day period
-    period = 6
+    bookings = {}
+
+    logging.debug("Getting bookers for %s", dates)
 
-    logging.debug(f"Validating bookings from {date_str} for {period}...")
+    try:
+        found = {row["date"]: row for row in get_bookings_by_dates(dates)}
 
-    # Loops through every possible 7 day period
-    for i in range(period + 1):
-        start_date = date - timedelta(days = i)
-        start_date_str = datetime.strftime(start_date, "%Y-%m-%d")
+    except Exception as err:
+        logging.error("Error retrieving bookers for %s, %s", dates, err)
+        found = {}
 
-        num_bookings = get_num_bookings(start_date=start_date_str, 
-                                        period=f"{period} days")
-        
-        if num_bookings >= 2:
-            return False
+    for date in dates:
+        booking = found.get(date)
 
-    return True
+        if booking and booking["booker_id"] is not None:
+            name = booking["display_name"]
 
+            if not name:
+                logging.warning("No display name found for user, %s",
+                                booking['user_id'])
+
+            logging.debug("Found booker with name, %s for %s", name, date)
+            bookings[date] = {
+                "isBooked": True,
+                "booker": name,
+                "bookPerm": name == user_id
+            }
 
-def get_num_bookings(start_date: str, period: str) -> int:
+        else:
+            if booking:
+                logging.error("Error retrieving booker for %s, user %s not "
+                              "found", date, booking['user_id'])
+            else:
+                logging.debug("No booker found for %s", date)
+
+            bookings[date] = {
+                "isBooked": False,
+                "booker": "",
+                "bookPerm": False
+            }
+
+    return bookings
+
+
+def get_schedule_etag(user_id: str, dates: list) -> str:
     """
-    Checks the number of bookings made by the logged in user from a given date
-    for a given number of days from that date
+    Builds the ETag for a get_bookers response from the schedule change version
+    and the user and dates requested, returns None if the version can't be read
 
     Params
     ------
-    start_date          The date at which to begin the query
-    period              The number of days from the start date
+    user_id         The id of the user making the request
+    dates           The list of dates requested
     """
-    user_id = session.get("user_id")
-
     try:
-        res = get_bookings_by_params(date=start_date, period=period, id=user_id)
+        version = get_schedule_version()
 
     except Exception as err:
-        logging.error(f"Error retrieving booking count for {user_id} from "
-                      f"{start_date} for {period} with error: {err}")
+        logging.error("Error retrieving schedule version, %s", err)
+        return None
+
+    key = "|".join([user_id or ""] + dates).encode("utf8")
 
-    logging.debug(f"Num bookings: {res} by {user_id} for start date: " 
-                  f"{start_date}, period: {period}")
-    return res
\ No newline at end of file
+    return f"{version}-{hashlib.sha1(key).hexdigest()}"
@@ -2,12 +2,11 @@ $(document).ready(function() {
     if (window.location.pathname == '/') {
         const UNBOOKED_TEXT = "Available";
 
-        var manage = false;
-        var curr_user = "";
-        
-        // Fetches the schedule and repeats every 7 seconds
-        updateSchedule();
-        setInterval(updateSchedule, 7000);
+        // The bookings and logged in user embedded in the page by the server
+        const state = JSON.parse($("#schedule-state").text());
+
+        var manage = state.user.manage;
+        var curr_user = state.user.name;
 
         // Initialises cards to be blank
         var selected_id = null;
@@ -18,6 +17,11 @@ $(document).ready(function() {
         $("#upcoming-blank").show();
         $("#upcoming-body").hide();
 
+        // Shows the embedded schedule then listens for changes pushed by the
+        // server since the version the page was rendered at
+        renderSchedule(state.bookings);
+        openScheduleStream(state.version);
+
         /*
         * Defines the action for clicking the book button
         */
@@ -97,48 +101,72 @@ $(document).ready(function() {
         });
 
         /*
-        * Updates the booking status of each cell in the schedule
+        * Opens a server-sent event stream for the schedule, falls back to
+        * polling every 7 seconds if the stream can't be used
         */
-        function updateSchedule() {
+        function openScheduleStream(version) {
+            if (!window.EventSource) {
+                setInterval(updateSchedule, 7000);
+                return;
+            }
+
+            var params = { "date_list": getDateList() };
+
+            // Without a version the stream sends the schedule straight away
+            if (version != null) {
+                params.version = version;
+            }
+
+            var url = "/handlers/schedule_stream?" + $.param(params);
+            var stream = new EventSource(url);
+
+            stream.addEventListener("schedule", function(event) {
+                renderSchedule(JSON.parse(event.data));
+            });
+
+            stream.onerror = function() {
+                // The browser reconnects by itself unless the server refused
+                if (stream.readyState == EventSource.CLOSED) {
+                    console.warn("Schedule stream closed, polling instead");
+                    setInterval(updateSchedule, 7000);
+                }
+            };
+        }
+
+        /*
+        * Returns the date of every cell in the schedule
+        */
+        function getDateList() {
             var date_list = [];
 
             $('.schedule-cell').each(function() {
                 date_list.push($(this).attr('id'));
             });
 
+            return date_list;
+        }
+
+        /*
+        * Updates the booking status of each cell in the schedule
+        */
+        function updateSchedule() {
+            var date_list = getDateList();
+
             console.debug(`Updating dates: ${date_list}`)
 
-            // Performs an ajax call to get the booking status
+            // Sends If-None-Match so unchanged schedules return a 304
             $.getJSON({
                 url: "/handlers/get_bookers",
                 data: { "date_list": date_list },
                 contentType: "application/json; charset=utf-8",
-                success: function(data) {
-                    bookings = data.res;
-
-                    for (const date in bookings) {
-                        var cell_id = "#" + date;
-                        
-                        // Sets custom html data attribute for booker
-                        $(cell_id).data("booker", bookings[date].booker);
-
-                        if (bookings[date].isBooked) {
-                            // Makes the cell red
-                            $(cell_id).addClass("table-danger");
-                            $(cell_id).removeClass("table-success");
-                        }
-                        else {
-                            // Makes the cell green
-                            $(cell_id).addClass("table-success");
-                            $(cell_id).removeClass("table-danger");
-                        }
+                ifModified: true,
+                success: function(data, status) {
+                    if (status == "notmodified") {
+                        console.debug("Schedule unchanged");
+                        return;
                     }
-                    displaySelected();          // Refreshes the info card
-                    findNextBooking();          // Refreshes the upcoming card
 
-                    var now = new Date();
-                    datetime = `${now.toDateString()} ${now.toTimeString()}`
-                    console.info(`Schedule updated at: ${datetime}`);
+                    renderSchedule(data.res);
                 },
                 error: function(xhr) {
                     var msg = JSON.parse(xhr.responseText).message;
@@ -147,6 +175,35 @@ $(document).ready(function() {
             });
         }
 
+        /*
+        * Displays the supplied booking status of each date in the schedule
+        */
+        function renderSchedule(bookings) {
+            for (const date in bookings) {
+                var cell_id = "#" + date;
+                
+                // Sets custom html data attribute for booker
+                $(cell_id).data("booker", bookings[date].booker);
+
+                if (bookings[date].isBooked) {
+                    // Makes the cell red
+                    $(cell_id).addClass("table-danger");
+                    $(cell_id).removeClass("table-success");
+                }
+                else {
+                    // Makes the cell green
+                    $(cell_id).addClass("table-success");
+                    $(cell_id).removeClass("table-danger");
+                }
+            }
+            displaySelected();          // Refreshes the info card
+            findNextBooking();          // Refreshes the upcoming card
+
+            var now = new Date();
+            datetime = `${now.toDateString()} ${now.toTimeString()}`
+            console.info(`Schedule updated at: ${datetime}`);
+        }
+
         /*
         * Finds the next booked date from today
         */
@@ -208,12 +265,6 @@ $(document).ready(function() {
             var booker = $("#" + cell_date).data("booker");
             // console.debug("Displaying: " + cell_date + ", " + booker);
 
-            hasPerm("manage");
-
-            if (!manage) {
-                getCurrentUser();
-            }
-
             var date = new Date(cell_date);
 
             // Displays the appropriate info whether the date is booked or not
@@ -252,43 +303,5 @@ $(document).ready(function() {
 
             return today <= date;
         }
-
-        /*
-        * Performs an ajax call (non-async) to get the currently logged in user
-        */
-        function getCurrentUser() {
-            $.getJSON({
-                url: "/handlers/get_current_user",
-                async: false,
-                success: function(data) {
-                    // Returns the response
-                    curr_user = data.user;
-                },
-                error: function(xhr) {
-                    var msg = JSON.parse(xhr.responseText).message;
-                    console.error(`Error retrieving current user: ${msg}`)
-                }
-            });
-        }
-
-        /*
-        * Performs an ajax call (non-async) to check if the logged in user has
-        * the supplied permission permissions
-        */
-        function hasPerm(perm) {
-            $.getJSON({
-                url: "/handlers/check_perm",
-                data: { "perm": perm },
-                async: false,
-                success: function(data) {
-                    // Sets the global variable, manage to the response
-                    manage = data.res;
-                },
-                error: function(xhr) {
-                    var msg = JSON.parse(xhr.responseText).message;
-                    console.error(`Error checking ${perm} permissions: ${msg}`);
-                }
-            });
-        }
     }
 });
\ No newline at end of file
@@ -0,0 +1,122 @@
+from flask import current_app, request, url_for, send_from_directory
+
+import mimetypes
+import logging
+import json
+import os
+
+# The file written by deployment/build.py listing the fingerprinted name of
+# each static asset
+MANIFEST_NAME = "manifest.json"
+
+# The precompressed versions the build writes, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# Fingerprinted assets never change, so browsers can keep them for a year
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class AssetManifest:
+    """
+    The fingerprinted name of each static asset of a build and the
+    precompressed versions found next to each one. A checkout that hasn't been
+    built has no manifest and its assets are served as they are
+    """
+    def __init__(self, static_folder: str):
+        """
+        Params
+        ------
+        static_folder   The path of the app's static folder
+        """
+        self.static_folder = static_folder
+        self.names = {}
+        self.encodings = {}
+
+        path = os.path.join(static_folder, MANIFEST_NAME)
+
+        if not os.path.isfile(path):
+            return
+
+        try:
+            with open(path, "r") as f:
+                self.names = json.load(f)
+
+        except Exception as err:
+            logging.error("Could not read the asset manifest, %s", err)
+            return
+
+        for hashed in self.names.values():
+            self.encodings[hashed] = [
+                (encoding, ext) for encoding, ext in ENCODINGS
+                if os.path.isfile(os.path.join(static_folder, hashed + ext))
+            ]
+
+        logging.info("Loaded the manifest of %s assets", len(self.names))
+
+    def url(self, filename: str) -> str:
+        """
+        Returns the URL of the fingerprinted version of a static asset, or
+        of the asset itself if it isn't in the manifest
+
+        Params
+        ------
+        filename        The path of the asset in the static folder
+        """
+        return url_for("static", filename=self.names.get(filename, filename))
+
+
+def asset_url(filename: str) -> str:
+    """
+    Template helper returning the URL of a static asset
+
+    Params
+    ------
+    filename        The path of the asset in the static folder
+    """
+    return current_app.extensions["reserv_assets"].url(filename)
+
+
+def serve_static(filename: str):
+    """
+    Serves a static file. Fingerprinted assets are served precompressed when
+    the client accepts it and are marked immutable, anything else is served
+    as Flask would
+    """
+    manifest = current_app.extensions["reserv_assets"]
+    encodings = manifest.encodings.get(filename)
+
+    if encodings is None:
+        return current_app.send_static_file(filename)
+
+    encoding, ext = next(
+        ((encoding, ext) for encoding, ext in encodings
+         if request.accept_encodings[encoding]), (None, ""))
+
+    response = send_from_directory(
+        manifest.static_folder, filename + ext,
+        mimetype=mimetypes.guess_type(filename)[0],
+        max_age=ASSET_MAX_AGE
+    )
+
+    if encoding is not None:
+        response.content_encoding = encoding
+
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+
+    return response
+
+
+def init_assets(app):
+    """
+    Loads the asset manifest of the build, adds the asset_url helper to the
+    templates and serves the static files through serve_static
+
+    Params
+    ------
+    app         The Flask app
+    """
+    app.extensions["reserv_assets"] = AssetManifest(app.static_folder)
+    app.add_template_global(asset_url)
+    app.view_functions["static"] = serve_static
@@ -0,0 +1,66 @@
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import logging
+import os
+import queue
+
+# The listeners writing queued records, one per configured handler
+_listeners = []
+
+
+def start_log_queue():
+    """
+    Moves every handler attached to the root logger and the configured loggers
+    onto a background listener thread and leaves a QueueHandler in its place,
+    so request threads never block on file writes or log rotation
+    """
+    stop_log_queue()
+
+    loggers = [logging.getLogger()] + [
+        logger for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    ]
+    queued = {}
+
+    for logger in loggers:
+        for handler in list(logger.handlers):
+            if isinstance(handler, QueueHandler):
+                continue
+
+            if handler not in queued:
+                records = queue.SimpleQueue()
+                listener = QueueListener(records, handler,
+                                         respect_handler_level=True)
+                listener.start()
+
+                _listeners.append(listener)
+                queued[handler] = QueueHandler(records)
+
+            logger.removeHandler(handler)
+            logger.addHandler(queued[handler])
+
+
+def stop_log_queue():
+    """
+    Writes out any queued records and stops the listener threads
+    """
+    while _listeners:
+        _listeners.pop().stop()
+
+
+def _restart_listeners():
+    """
+    Starts new listener threads in a forked child, the threads started by the
+    parent don't exist in the child
+    """
+    for i, listener in enumerate(_listeners):
+        _listeners[i] = QueueListener(
+            listener.queue,
+            *listener.handlers,
+            respect_handler_level=listener.respect_handler_level
+        )
+        _listeners[i].start()
+
+
+atexit.register(stop_log_queue)
+os.register_at_fork(after_in_child=_restart_listeners)
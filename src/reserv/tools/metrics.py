@@ -0,0 +1,368 @@
+from flask import g, request
+
+import threading
+import logging
+import atexit
+import json
+import time
+import os
+
+from ..data.cache import permission_cache, fragment_cache
+from ..data.events import schedule_events
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# The help text and type of each exported metric
+METRICS = {
+    "reserv_http_requests_total":
+        ("counter", "Requests handled by endpoint, method and status"),
+    "reserv_http_request_errors_total":
+        ("counter", "Requests that ended with a 5xx status by endpoint"),
+    "reserv_http_request_duration_seconds":
+        ("histogram", "Time taken to build the response by endpoint"),
+    "reserv_db_connections_opened_total":
+        ("counter", "Connections opened to the schedule database"),
+    "reserv_db_connections_closed_total":
+        ("counter", "Connections closed to the schedule database"),
+    "reserv_cache_hits_total":
+        ("counter", "Lookups answered from the permission or fragment cache"),
+    "reserv_cache_misses_total":
+        ("counter", "Lookups that had to query the database"),
+    "reserv_cache_hit_ratio":
+        ("gauge", "Share of cache lookups that were hits"),
+    "reserv_password_rehashes_total":
+        ("counter", "Stored password hashes upgraded on login"),
+    "reserv_login_busy_total":
+        ("counter", "Logins turned away while password checks were busy"),
+    "reserv_schedule_stream_clients":
+        ("gauge", "Schedule streams currently open"),
+    "reserv_metrics_processes":
+        ("gauge", "Worker processes whose metrics are included")
+}
+
+
+class Metrics:
+    """
+    Counters and latency histograms of this process. A request takes the lock
+    once to record everything about it, the snapshot is only built on scrape
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Drops every value, used when a forked worker starts counting its own
+        """
+        with self._lock:
+            self._pid = os.getpid()
+            self._counters = {}
+            self._histograms = {}
+
+    @property
+    def pid(self) -> int:
+        return self._pid
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        """
+        Adds the value to a counter
+
+        Params
+        ------
+        name        The name of the counter
+        labels      The (name, value) pairs of the counter's labels
+        value       The amount to add
+        """
+        key = (name, labels)
+
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe_request(self, endpoint: str, method: str, status: int,
+                        elapsed: float):
+        """
+        Records a finished request
+
+        Params
+        ------
+        endpoint    The endpoint that handled the request
+        method      The HTTP method of the request
+        status      The status code of the response
+        elapsed     The number of seconds taken to build the response
+        """
+        requests_key = ("reserv_http_requests_total",
+                        (("endpoint", endpoint), ("method", method),
+                         ("status", str(status))))
+        labels = (("endpoint", endpoint),)
+
+        with self._lock:
+            self._counters[requests_key] = (
+                self._counters.get(requests_key, 0) + 1)
+
+            if status >= 500:
+                key = ("reserv_http_request_errors_total", labels)
+                self._counters[key] = self._counters.get(key, 0) + 1
+
+            if elapsed is not None:
+                hist = self._histograms.get(labels)
+
+                if hist is None:
+                    hist = self._histograms[labels] = (
+                        [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+
+                for i, bound in enumerate(LATENCY_BUCKETS):
+                    if elapsed <= bound:
+                        hist[i] += 1
+
+                hist[-2] += elapsed
+                hist[-1] += 1
+
+    def snapshot(self) -> dict:
+        """
+        Returns the values of this process in a form that can be written to
+        JSON and merged with the snapshots of other processes
+        """
+        with self._lock:
+            counters = [[name, list(labels), value]
+                        for (name, labels), value in self._counters.items()]
+            histograms = [[list(labels), list(hist)]
+                          for labels, hist in self._histograms.items()]
+
+        caches = dict(permission_cache.stats(), **fragment_cache.stats())
+
+        for cache, (hits, misses) in caches.items():
+            counters.append(["reserv_cache_hits_total", [["cache", cache]], hits])
+            counters.append(
+                ["reserv_cache_misses_total", [["cache", cache]], misses])
+
+        gauges = [["reserv_schedule_stream_clients", [],
+                   schedule_events.clients]]
+
+        return {"counters": counters, "histograms": histograms,
+                "gauges": gauges}
+
+
+metrics = Metrics()
+
+# The process whose flusher has been started, guarded by _flusher_lock
+_flusher_lock = threading.Lock()
+_flusher_pid = None
+
+
+def snapshot_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"metrics-{pid}.json")
+
+
+def write_snapshot(directory: str):
+    """
+    Writes the snapshot of this process to the shared metrics directory,
+    replacing the file in one step so readers never see a partial snapshot
+
+    Params
+    ------
+    directory   The directory shared by every worker process
+    """
+    path = snapshot_path(directory, os.getpid())
+    temp_path = f"{path}.tmp"
+
+    with open(temp_path, "w") as f:
+        json.dump(metrics.snapshot(), f)
+
+    os.replace(temp_path, path)
+
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def collect(directory: str = None) -> list:
+    """
+    Returns the snapshots to export, those of every worker process writing to
+    the directory if one is supplied. Gauges of workers that have exited are
+    dropped while their counters are kept so totals never go backwards
+
+    Params
+    ------
+    directory   The directory shared by every worker process
+    """
+    snapshots = [metrics.snapshot()]
+
+    if directory is None:
+        return snapshots
+
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        names = []
+
+    for name in names:
+        if not (name.startswith("metrics-") and name.endswith(".json")):
+            continue
+
+        pid = int(name[len("metrics-"):-len(".json")])
+
+        if pid == os.getpid():
+            continue
+
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshot = json.load(f)
+
+        except (OSError, ValueError) as err:
+            logging.warning("Could not read metrics snapshot %s, %s", name, err)
+            continue
+
+        if not is_alive(pid):
+            snapshot["gauges"] = []
+
+        snapshots.append(snapshot)
+
+    return snapshots
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ""
+
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"')
+               .replace("\n", "\\n") for _, value in labels)
+
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value
+                          in zip(labels, escaped)) + "}"
+
+
+def render(snapshots: list) -> str:
+    """
+    Merges the snapshots and returns them in the Prometheus text format
+
+    Params
+    ------
+    snapshots   The snapshots returned by collect
+    """
+    values = {}
+    histograms = {}
+
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"] + snapshot["gauges"]:
+            key = (name, tuple(tuple(label) for label in labels))
+            values[key] = values.get(key, 0) + value
+
+        for labels, hist in snapshot["histograms"]:
+            key = tuple(tuple(label) for label in labels)
+            merged = histograms.setdefault(key, [0] * len(hist))
+            histograms[key] = [a + b for a, b in zip(merged, hist)]
+
+    # Every cache with lookups, whichever of the counters it has
+    caches = {labels for name, labels in values
+              if name in ("reserv_cache_hits_total",
+                          "reserv_cache_misses_total")}
+
+    for labels in sorted(caches):
+        hits = values.get(("reserv_cache_hits_total", labels), 0)
+        misses = values.get(("reserv_cache_misses_total", labels), 0)
+
+        if hits + misses:
+            values[("reserv_cache_hit_ratio", labels)] = hits / (hits + misses)
+
+    values[("reserv_metrics_processes", ())] = len(snapshots)
+
+    lines = []
+
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+        if kind == "histogram":
+            for labels, hist in sorted(histograms.items()):
+                for bound, count in zip(LATENCY_BUCKETS, hist):
+                    bucket = labels + (("le", str(bound)),)
+                    lines.append(f"{name}_bucket{format_labels(bucket)} {count}")
+
+                bucket = labels + (("le", "+Inf"),)
+                lines.append(f"{name}_bucket{format_labels(bucket)} {hist[-1]}")
+                lines.append(f"{name}_sum{format_labels(labels)} {hist[-2]}")
+                lines.append(f"{name}_count{format_labels(labels)} {hist[-1]}")
+
+            continue
+
+        for (key_name, labels), value in sorted(values.items()):
+            if key_name == name:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def start_flusher(directory: str, interval: float):
+    """
+    Starts a daemon thread that writes the snapshot of this process to the
+    shared directory every interval seconds and once more on exit
+
+    Params
+    ------
+    directory   The directory shared by every worker process
+    interval    The number of seconds between writes
+    """
+    def flush():
+        try:
+            write_snapshot(directory)
+        except OSError as err:
+            logging.warning("Could not write metrics snapshot, %s", err)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            flush()
+
+    threading.Thread(target=run, name="metrics-flusher", daemon=True).start()
+    atexit.register(flush)
+
+
+def init_metrics(app):
+    """
+    Registers the request hooks that collect metrics, these should be
+    registered before any other hook so the timer covers them
+
+    Params
+    ------
+    app         The Flask app to register to
+    """
+    directory = app.config.get("METRICS_DIR")
+    interval = app.config.get("METRICS_FLUSH_INTERVAL", 5)
+
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    @app.before_request
+    def start_timer():
+        global _flusher_pid
+
+        # Forked workers start from the state copied from the parent
+        if _flusher_pid != os.getpid():
+            with _flusher_lock:
+                if _flusher_pid != os.getpid():
+                    if metrics.pid != os.getpid():
+                        metrics.reset()
+
+                    if directory:
+                        start_flusher(directory, interval)
+
+                    _flusher_pid = os.getpid()
+
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.get("metrics_start")
+        elapsed = None if start is None else time.perf_counter() - start
+
+        metrics.observe_request(request.endpoint or "unmatched",
+                                request.method, response.status_code, elapsed)
+        return response
@@ -0,0 +1,188 @@
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import threading
+import os
+
+# The block size and parallelism used for scrypt, only N is configurable
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+
+class PasswordCheckBusy(Exception):
+    """
+    Raised when too many password hashes are already waiting to be computed
+    """
+
+
+def build_method(method: str, cost: int) -> str:
+    """
+    Returns the werkzeug hash method string for the method and cost, such as
+    scrypt:32768:8:1 or pbkdf2:sha256:600000
+
+    Params
+    ------
+    method      Either scrypt or pbkdf2 optionally followed by the hash
+                function, as in pbkdf2:sha512
+    cost        The scrypt N or the pbkdf2 iterations, None for the werkzeug
+                default of the method
+    """
+    name, _, hash_name = method.partition(":")
+
+    if name == "scrypt" and not hash_name:
+        params = [] if cost is None else [cost, SCRYPT_R, SCRYPT_P]
+
+    elif name == "pbkdf2":
+        params = [hash_name or "sha256"] + ([] if cost is None else [cost])
+
+    else:
+        raise ValueError(f"Unknown password hash method {method}")
+
+    if cost is None:
+        # Only the werkzeug defaults are taken from a throwaway hash
+        return generate_password_hash("", ":".join([name] + params)).split("$")[0]
+
+    return ":".join([name] + [str(param) for param in params])
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords with the configured method and cost. Hashes
+    are computed on a small pool of threads so a burst of logins can only
+    keep that many threads busy, and logins beyond what the pool has queued
+    are turned away instead of holding on to a worker
+    """
+    def __init__(self, method: str, cost: int, salt_length: int, workers: int,
+                 max_pending: int, timeout: float):
+        """
+        Params
+        ------
+        method          The hash method, scrypt or pbkdf2[:hash]
+        cost            The scrypt N or the pbkdf2 iterations
+        salt_length     The number of characters in each salt
+        workers         The number of hashes computed at once in each process
+        max_pending     The number of hashes that can wait for a free thread
+        timeout         The number of seconds to wait for a hash
+        """
+        self._method = method
+        self._cost = cost
+        self._resolved = None
+        self.salt_length = salt_length
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pool = None
+        self._slots = None
+
+    @property
+    def method(self) -> str:
+        """
+        The full werkzeug method string new hashes are created with
+        """
+        if self._resolved is None:
+            self._resolved = build_method(self._method, self._cost)
+
+        return self._resolved
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            # Forked workers start their own pool, the threads of the parent
+            # don't exist in the child
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix="password")
+                self._slots = threading.BoundedSemaphore(
+                    self.workers + self.max_pending)
+
+            pool, slots = self._pool, self._slots
+
+        if not slots.acquire(blocking=False):
+            raise PasswordCheckBusy()
+
+        try:
+            future = pool.submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+
+        # The slot is held until the hash finishes, even if the caller gave up
+        future.add_done_callback(lambda _: slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise PasswordCheckBusy()
+
+    def hash(self, password: str) -> str:
+        """
+        Returns a new hash of the password
+
+        Params
+        ------
+        password    The plain text password
+        """
+        return self._submit(generate_password_hash, password, self.method,
+                            self.salt_length)
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        """
+        Checks the password against the stored hash, raises PasswordCheckBusy
+        if the pool is full or the check took longer than the timeout
+
+        Params
+        ------
+        pwhash      The stored hash
+        password    The plain text password to check
+        """
+        if not pwhash:
+            return False
+
+        return self._submit(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        """
+        Checks if the stored hash was made with a different method or cost
+        than new hashes are
+
+        Params
+        ------
+        pwhash      The stored hash
+        """
+        return pwhash.split("$", 1)[0] != self.method
+
+
+def create_password_hasher(app) -> PasswordHasher:
+    """
+    Creates the password hasher set up by the PASSWORD_* config
+
+    Params
+    ------
+    app         The Flask app to create the hasher for
+    """
+    return PasswordHasher(
+        method=app.config.get("PASSWORD_METHOD", "scrypt"),
+        cost=app.config.get("PASSWORD_COST"),
+        salt_length=app.config.get("PASSWORD_SALT_LENGTH", 16),
+        workers=app.config.get("PASSWORD_WORKERS", 2),
+        max_pending=app.config.get("PASSWORD_MAX_PENDING", 32),
+        timeout=app.config.get("PASSWORD_TIMEOUT", 10)
+    )
+
+
+def get_password_hasher() -> PasswordHasher:
+    """
+    Returns the password hasher of the current app, apps built without
+    create_app use the werkzeug defaults
+    """
+    hasher = current_app.extensions.get("reserv_passwords")
+
+    if hasher is None:
+        hasher = current_app.extensions["reserv_passwords"] = \
+            create_password_hasher(current_app)
+
+    return hasher
@@ -0,0 +1,398 @@
+from collections import namedtuple
+from contextlib import contextmanager
+from flask.cli import with_appcontext
+
+import logging.config
+import subprocess
+import statistics
+import logging
+import click
+import json
+import time
+import yaml
+import sys
+import os
+
+# The C loader is several times faster, PyYAML only has it when built with
+# libyaml
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# The top level keys every config must have
+REQUIRED_KEYS = ("db_path", "key_path", "logging")
+
+# The sections that have to be mappings when they're present
+MAPPING_SECTIONS = ("logging", "database", "booking_quota", "schedule_stream",
+                    "permission_cache", "sql_trace", "metrics", "storage",
+                    "password_hash", "fragment_cache")
+
+# A parsed and validated config file, along with the app settings built from
+# it, as of the modification time it was read at
+ConfigSnapshot = namedtuple("ConfigSnapshot",
+                            ["path", "mtime", "config", "settings"])
+
+# Snapshots and app keys keyed by path, reused until the file changes
+_snapshots = {}
+_keys = {}
+
+# The folders this process has already made sure exist
+_made_dirs = set()
+
+# The (path, mtime) of the config whose logging setup is in effect
+_logging_applied = None
+
+
+class StartupProfile:
+    """
+    Records how long each phase of building the app takes
+    """
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Times the block as the named phase
+
+        Params
+        ------
+        name        The name of the phase
+        """
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+
+def make_dirs(path: str):
+    """
+    Creates the folder if it doesn't exist, once per process
+
+    Params
+    ------
+    path        The path of the folder
+    """
+    if path and path not in _made_dirs:
+        os.makedirs(path, exist_ok=True)
+        _made_dirs.add(path)
+
+
+def find_config(instance_path: str) -> str:
+    """
+    Returns the path of the config in the instance folder, or of the default
+    config if there is none
+
+    Params
+    ------
+    instance_path   The instance folder of the app
+    """
+    config_path = os.path.join(instance_path, "config.yaml")
+
+    if os.path.isfile(config_path):
+        return config_path
+
+    current_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    return os.path.join(current_dir, "config-default.yaml")
+
+
+def validate_config(config) -> dict:
+    """
+    Checks the config has every required key and that its sections are
+    mappings, raises ValueError listing every problem found
+
+    Params
+    ------
+    config      The parsed config file
+    """
+    if not isinstance(config, dict):
+        raise ValueError("The config must be a mapping of sections")
+
+    problems = [f"{key} is missing" for key in REQUIRED_KEYS
+                if key not in config]
+
+    problems += [f"{key} must be a mapping" for key in MAPPING_SECTIONS
+                 if key in config and not isinstance(config[key], dict)]
+
+    if problems:
+        raise ValueError(f"Invalid config, {', '.join(problems)}")
+
+    return config
+
+
+def build_settings(config: dict, instance_path: str) -> dict:
+    """
+    Returns the Flask config of the app built from the config file, sections
+    fall back to defaults for instance configs without them
+
+    Params
+    ------
+    config          The parsed config file
+    instance_path   The instance folder of the app
+    """
+    stream_config = config.get("schedule_stream", {})
+    perm_cache_config = config.get("permission_cache", {})
+    db_config = config.get("database", {})
+    write_config = db_config.get("write_queue", {})
+    quota_config = config.get("booking_quota", {})
+    trace_config = config.get("sql_trace", {})
+    metrics_config = config.get("metrics", {})
+    metrics_dir = metrics_config.get("multiprocess_dir")
+    storage_config = config.get("storage", {})
+    storage_seed = storage_config.get("seed")
+    password_config = config.get("password_hash", {})
+    fragment_config = config.get("fragment_cache", {})
+
+    return dict(
+        DATABASE = os.path.join(instance_path, config["db_path"]),
+        STREAM_MAX_CLIENTS = stream_config.get("max_clients", 100),
+        STREAM_CHECK_INTERVAL = stream_config.get("check_interval", 5),
+        PERM_CACHE_TTL = perm_cache_config.get("ttl", 60),
+        PERM_CACHE_MAX_USERS = perm_cache_config.get("max_users", 1024),
+        FRAGMENT_CACHE = fragment_config.get("enabled", True),
+        FRAGMENT_CACHE_MAX_ENTRIES = fragment_config.get("max_entries", 64),
+        QUOTA_WINDOW_DAYS = quota_config.get("window_days", 7),
+        QUOTA_MAX_BOOKINGS = quota_config.get("max_bookings", 2),
+        DB_PERSISTENT = db_config.get("persistent", True),
+        DB_READ_ONLY_ROUTES = db_config.get("read_only_routes", True),
+        DB_PRAGMAS = db_config.get("pragmas", {
+            "journal_mode": "wal",
+            "synchronous": "normal",
+            "busy_timeout": 5000
+        }),
+        DB_WRITE_QUEUE = write_config.get("enabled", False),
+        DB_WRITE_BATCH_SIZE = write_config.get("batch_size", 64),
+        DB_WRITE_BATCH_WAIT_MS = write_config.get("batch_wait_ms", 2),
+        DB_WRITE_TIMEOUT = write_config.get("timeout", 30),
+        SQL_TRACE = trace_config.get("enabled", False),
+        SQL_SLOW_QUERY_MS = trace_config.get("slow_query_ms", 50),
+        SQL_SLOW_REQUEST_MS = trace_config.get("slow_request_ms", 250),
+        SQL_TOP_N = trace_config.get("top_n", 20),
+        METRICS_ENABLED = metrics_config.get("enabled", True),
+        METRICS_TOKEN = metrics_config.get("token"),
+        METRICS_DIR = (os.path.join(instance_path, metrics_dir)
+                       if metrics_dir else None),
+        METRICS_FLUSH_INTERVAL = metrics_config.get("flush_interval", 5),
+        STORAGE_BACKEND = storage_config.get("backend", "sqlite"),
+        STORAGE_SEED = (os.path.join(instance_path, storage_seed)
+                        if storage_seed else None),
+        PASSWORD_METHOD = password_config.get("method", "scrypt"),
+        PASSWORD_COST = password_config.get("cost"),
+        PASSWORD_SALT_LENGTH = password_config.get("salt_length", 16),
+        PASSWORD_WORKERS = password_config.get("workers", 2),
+        PASSWORD_MAX_PENDING = password_config.get("max_pending", 32),
+        PASSWORD_TIMEOUT = password_config.get("timeout", 10)
+    )
+
+
+def load_config(instance_path: str) -> ConfigSnapshot:
+    """
+    Returns the snapshot of the app's config file, which is only read and
+    validated again once the file's modification time changes
+
+    Params
+    ------
+    instance_path   The instance folder of the app
+    """
+    path = find_config(instance_path)
+    mtime = os.stat(path).st_mtime_ns
+    snapshot = _snapshots.get((path, instance_path))
+
+    if snapshot is not None and snapshot.mtime == mtime:
+        return snapshot
+
+    with open(path, "r") as f:
+        config = validate_config(yaml.load(f.read(), Loader=YAML_LOADER))
+
+    snapshot = ConfigSnapshot(path=path, mtime=mtime, config=config,
+                              settings=build_settings(config, instance_path))
+    _snapshots[(path, instance_path)] = snapshot
+
+    return snapshot
+
+
+def configure_logging(snapshot: ConfigSnapshot):
+    """
+    Applies the logging section of the config unless this process already
+    uses the same version of it, forked workers inherit the setup
+
+    Params
+    ------
+    snapshot        The config snapshot
+    """
+    global _logging_applied
+
+    if _logging_applied == (snapshot.path, snapshot.mtime):
+        return
+
+    config = snapshot.config
+
+    # Create log folder if doesn't exist and configured to log to a file
+    try:
+        make_dirs(os.path.dirname(
+            config["logging"]["handlers"]["file"]["filename"]))
+    except:
+        pass
+
+    logging.config.dictConfig(config["logging"])
+
+    # Hands log records to background threads that own the handlers
+    if config.get("log_queue", True):
+        from .log_queue import start_log_queue
+        start_log_queue()
+
+    _logging_applied = (snapshot.path, snapshot.mtime)
+
+
+def read_key(key_path: str) -> str:
+    """
+    Returns the app key, generating one if there is no key file, the file is
+    only read again once its modification time changes
+
+    Params
+    ------
+    key_path        The path of the key file
+    """
+    # Generate a new key if there is no key in the instance folder
+    if not os.path.isfile(key_path):
+        from .generate_key import generate_key
+        generate_key(key_path)
+
+    mtime = os.stat(key_path).st_mtime_ns
+    cached = _keys.get(key_path)
+
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(key_path, "r") as f:
+        key = f.read()
+
+    _keys[key_path] = (mtime, key)
+    return key
+
+
+# Run in a fresh interpreter by startup-profile so every import is cold. It
+# prints the phases of a cold and a warm create_app as JSON
+PROFILE_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+from reserv import create_app
+imported = time.perf_counter() - start
+phases = []
+for _ in range(2):
+    start = time.perf_counter()
+    app = create_app()
+    phases.append(app.extensions["reserv_startup"] +
+                  [["total", time.perf_counter() - start]])
+print(json.dumps({{"import": imported, "cold": phases[0], "warm": phases[1]}}))
+"""
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    Returns the cumulative import time in seconds of each module from the
+    output of python -X importtime
+
+    Params
+    ------
+    stderr      The standard error of the profiled interpreter
+    """
+    times = {}
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) / 1e6
+
+    return times
+
+
+def profile_startup(runs: int) -> dict:
+    """
+    Builds the app in fresh interpreters and returns the median import time
+    of the slowest modules and of each create_app phase, cold and warm
+
+    Params
+    ------
+    runs            The number of interpreters to start
+    """
+    src = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.realpath(__file__))))
+    script = PROFILE_SCRIPT.format(src=src)
+    samples = []
+
+    for _ in range(runs):
+        res = subprocess.run([sys.executable, "-X", "importtime", "-c", script],
+                             capture_output=True, text=True, check=True,
+                             cwd=os.getcwd())
+        sample = json.loads(res.stdout.strip().splitlines()[-1])
+        sample["modules"] = parse_importtime(res.stderr)
+        samples.append(sample)
+
+    def median_ms(values: list) -> float:
+        return round(statistics.median(values) * 1000, 2)
+
+    modules = {}
+
+    for sample in samples:
+        for name, seconds in sample["modules"].items():
+            modules.setdefault(name, []).append(seconds)
+
+    phases = {}
+
+    for mode in ("cold", "warm"):
+        for sample in samples:
+            for name, seconds in sample[mode]:
+                phases.setdefault(name, {}).setdefault(mode, []).append(seconds)
+
+    return {
+        "runs": runs,
+        "import_ms": median_ms([sample["import"] for sample in samples]),
+        "modules_ms": dict(sorted(
+            ((name, median_ms(times)) for name, times in modules.items()
+             if name.split(".")[0] in ("reserv", "flask", "werkzeug", "jinja2",
+                                       "yaml", "wtforms", "click")
+             and name.count(".") <= 2),
+            key=lambda item: -item[1])[:15]),
+        "phases_ms": {name: {mode: median_ms(times)
+                             for mode, times in modes.items()}
+                      for name, modes in phases.items()}
+    }
+
+
+@click.command("startup-profile")
+@click.option("--runs", default=5, help="Number of fresh interpreters to time")
+@click.option("--json", "as_json", is_flag=True, help="Print the report as JSON")
+@with_appcontext
+def startup_profile_command(runs, as_json):
+    """
+    Defines a click command that reports how long importing the app and each
+    phase of create_app take in a fresh worker, and how long create_app takes
+    again once the config snapshot and imports are warm
+    """
+    report = profile_startup(runs)
+
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+
+    click.echo(f"Median of {runs} runs, importing reserv took "
+               f"{report['import_ms']} ms")
+    click.echo("\nSlowest imports (cumulative ms)")
+
+    for name, ms in report["modules_ms"].items():
+        click.echo(f"  {name:<40} {ms:>8}")
+
+    click.echo("\ncreate_app phases (ms)      cold      warm")
+
+    for name, modes in report["phases_ms"].items():
+        click.echo(f"  {name:<22} {modes.get('cold', 0):>9} "
+                   f"{modes.get('warm', 0):>9}")
+
+    logging.info("Profiled startup, create_app took %s ms cold",
+                 report["phases_ms"]["total"]["cold"])
@@ -1,11 +1,11 @@
 from flask import Blueprint, request, g
 from flask import render_template, flash
-from werkzeug.security import generate_password_hash
 import logging
 
 from ..data.query import update_name, update_password
 from ..forms.change_name_form import ChangeName
 from ..forms.reset_password_form import ResetPassword
+from ..tools.passwords import get_password_hasher
 from .auth import login_required_view
 
 account_bp = Blueprint("account", __name__, url_prefix="/account")
@@ -55,7 +55,7 @@ def reset_password():
     # Processes the form data if form passes validation and POST request is made
     if request.method == 'POST' and form.validate():
         try:
-            hash_pass = generate_password_hash(form.new_pass.data)
+            hash_pass = get_password_hasher().hash(form.new_pass.data)
             update_password(id=current_user, password=hash_pass)
 
             flash("Password changed successfully")
@@ -1,8 +1,9 @@
-from flask import render_template, Blueprint, g
+from flask import render_template, Blueprint, g, jsonify, current_app
 import logging
 import os
 
-from .auth import login_required_view
+from .auth import login_required_view, login_required_ajax
+from ..data.tracing import get_top_statements
 
 admin_bp = Blueprint("admin", __name__)
 
@@ -28,6 +29,23 @@ def center():
     return render_template('version_info.html')
 
 
+@admin_bp.route('/center/sql_stats')
+@login_required_ajax
+def sql_stats():
+    """
+    Returns the statements with the highest total time in this worker process,
+    only available to users with manage permissions when SQL tracing is enabled
+    """
+    if not g.manage_perm:
+        return jsonify(message="You do not have permission to view SQL "
+                       "statistics"), 403
+
+    if not current_app.config.get("SQL_TRACE", False):
+        return jsonify(message="SQL tracing is not enabled"), 404
+
+    return jsonify(res=get_top_statements(current_app.config["SQL_TOP_N"])), 200
+
+
 def get_version() -> str:
     """
     Get the version of the app to build
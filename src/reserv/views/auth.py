@@ -3,10 +3,10 @@ import logging
 
 from flask import Blueprint, request, session, g, jsonify
 from flask import render_template, flash, redirect, url_for
-from werkzeug.security import check_password_hash
-
-from ..data.query import get_user_by_id, get_user_status, check_perm
+from ..data.query import get_user_by_id, get_user_perm_names, update_password
 from ..forms.login_form import Login
+from ..tools.metrics import metrics
+from ..tools.passwords import get_password_hasher, PasswordCheckBusy
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
@@ -23,34 +23,57 @@ def login():
     # Processes the form data if form passes validation and POST request is made
     if request.method == "POST" and form.validate():
         try:
+            hasher = get_password_hasher()
             user = get_user_by_id(user_id)
             error = None
 
             # Checks if the user id matches a user in the database
             if user is None:
                 error = "Incorrect User ID."
-                logging.debug(f"User ID, {user_id} not found in database")
+                logging.debug("User ID, %s not found in database", user_id)
 
             # Checks if the supplied password matches the encrypted password
-            elif not check_password_hash(user["password"], password):
+            elif not hasher.verify(user["password"], password):
                 error = "Incorrect password."
-                logging.debug(f"Password provided for {user_id} does not " 
-                              "match the value in the database")
+                logging.debug("Password provided for %s does not match the "
+                              "value in the database", user_id)
 
             if error is None:
+                # Hashes made with an old method or cost are replaced while
+                # the plain text password is at hand
+                if hasher.needs_rehash(user["password"]):
+                    try:
+                        update_password(id=user_id,
+                                        password=hasher.hash(password))
+                        metrics.inc("reserv_password_rehashes_total")
+                        logging.info("Rehashed the password of %s with %s",
+                                     user_id, hasher.method)
+
+                    except Exception as err:
+                        logging.warning("Error rehashing the password of %s, "
+                                        "%s", user_id, err)
+
                 # Stores the user id in a new session and return to the index
                 session.clear()
                 session["user_id"] = user["user_id"]
 
-                logging.info(f"Logging in as {user_id}...")
+                logging.info("Logging in as %s...", user_id)
 
                 return redirect(url_for("index"))
 
             flash(error)
 
+        except PasswordCheckBusy:
+            metrics.inc("reserv_login_busy_total")
+            flash("Too many people are logging in, please try again")
+            logging.warning("Turned away login for %s, password checks are "
+                            "busy", user_id)
+
+            return render_template("login.html", form=form), 503
+
         except Exception as err:
             flash(f"Error logging in")
-            logging.error(f"Error logging in: {err}")
+            logging.error("Error logging in: %s", err)
         
     return render_template("login.html", form=form)
 
@@ -63,7 +86,7 @@ def logout():
     user_id = session.get("user_id")
     session.clear()
 
-    logging.info(f"Cleared session for {user_id}")
+    logging.info("Cleared session for %s", user_id)
 
     return redirect(url_for("auth.login"))
 
@@ -80,24 +103,30 @@ def access_denied():
 @auth_bp.before_app_request
 def load_logged_in_user():
     """
-    If a user id is stored in the session, load the user object from the 
-    database into g.user
+    If a user id is stored in the session, load the user object into g.user
+    and the names of their permissions into g.perms, which every decorator
+    and handler reuses for the request. The permissions come from the cached
+    role permission matrix and user roles, so a warm request runs a single
+    query
     """
     user_id = session.get("user_id")
+    g.user = None
+    g.perms = frozenset()
 
-    if user_id is None:
-        g.user = None
-        
-    else:
+    if user_id is not None:
         try:
-            g.user = get_user_by_id(user_id)
-            g.book_perm = check_perm(id=user_id, perm="book")
-            g.manage_perm = check_perm(id=user_id, perm="manage")
+            user = get_user_by_id(user_id)
+
+            if user is not None:
+                g.user = user
+                g.perms = frozenset(get_user_perm_names(user_id))
 
         except Exception as err:
-            logging.error(f"Error retrieving user, {user_id} from database " 
-                          f"with error: {err}")
-            g.user = None
+            logging.error("Error retrieving user, %s from database with error: "
+                          "%s", user_id, err)
+
+    g.book_perm = has_perm("book")
+    g.manage_perm = has_perm("manage")
 
 
 def login_required_view(view):
@@ -113,7 +142,7 @@ def login_required_view(view):
             logging.debug("User is not logged in, redirecting to login page...")
             return redirect(url_for("auth.login"))
         
-        elif not check_user_active(g.user["user_id"]):
+        elif not check_user_active():
             logging.debug("User is inactive, redirecting to login page...")
             return redirect(url_for("auth.access_denied"))
 
@@ -137,7 +166,7 @@ def login_required_ajax(view):
             logging.debug("User is not logged in, returning html code 403...")
             return jsonify(message="No user logged in"), 403
 
-        elif not check_user_active(g.user["user_id"]):
+        elif not check_user_active():
             logging.debug("User is inactive, returning html code 403...")
             return jsonify(message="Error: account is inactive"), 403
         
@@ -148,8 +177,19 @@ def login_required_ajax(view):
     return wrapped_view
 
 
-def check_user_active(user_id: str) -> bool:
+def check_user_active() -> bool:
+    """
+    Checks if the user status of the logged in user is active
+    """
+    return g.user is not None and g.user["status"] == "active"
+
+
+def has_perm(perm: str) -> bool:
     """
-    Checks if user status of the supplied user is active
+    Checks if the logged in user has the supplied permission (name)
+
+    Params
+    ------
+    perm        The name (not id) of the permission to check
     """
-    return get_user_status(user_id) == "active"
\ No newline at end of file
+    return perm in g.get("perms", ())
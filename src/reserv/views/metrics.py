@@ -0,0 +1,30 @@
+from flask import Blueprint, Response, current_app, request, g, jsonify
+import logging
+import hmac
+
+from .auth import check_user_active
+from ..tools.metrics import collect, render
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics")
+def export_metrics():
+    """
+    Returns the metrics of every worker in the Prometheus text format, only
+    available to logged in users with manage permissions or to scrapers
+    presenting the configured token
+    """
+    token = current_app.config.get("METRICS_TOKEN")
+    auth = request.headers.get("Authorization", "").encode("utf8")
+    scraper = bool(token) and hmac.compare_digest(
+        auth, f"Bearer {token}".encode("utf8"))
+
+    if not scraper and (not check_user_active() or not g.manage_perm):
+        logging.debug("Refused metrics request without manage permissions")
+        return jsonify(message="You do not have permission to view metrics"), 403
+
+    snapshots = collect(current_app.config.get("METRICS_DIR"))
+
+    return Response(render(snapshots),
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,21 +1,25 @@
-from flask import render_template, Blueprint, g
+from flask import render_template, Blueprint, current_app, g
+from markupsafe import Markup
 from datetime import date, timedelta
 import logging
 
-from .auth import login_required_view
-from ..data.query import check_perm
+from .auth import login_required_view, has_perm
+from ..data.cache import fragment_cache
+from ..data.db import read_only_db
+from ..data.query import get_schedule_version
+from ..handlers.schedule_handler import get_bookings
 
 schedule_bp = Blueprint("schedule", __name__)
 
 @schedule_bp.route('/')
 @login_required_view
+@read_only_db
 def index():
     """
-    Defines g.schedule to be used in the schedule template (index.html)
+    Defines g.schedule, the rendered schedule grid and the state the page
+    starts with to be used in the schedule template (index.html)
     """
-    user_id = g.user["user_id"]
-
-    if check_perm(user_id, "view"):
+    if has_perm("view"):
         g.today = date.today()
 
         # Calculates the date of the monday of the current week
@@ -24,9 +28,63 @@ def index():
         # Generates a list of dates from the week start for the next 14 days
         g.schedule = [week_start + timedelta(days=i) for i in range(14)]
 
-        logging.debug(f"Setting schedule for w/c {week_start}")
+        logging.debug("Setting schedule for w/c %s", week_start)
+
+        version, grid, bookings = get_schedule_grid(week_start, g.today,
+                                                    g.schedule)
+        user_id = g.user["user_id"]
+
+        g.schedule_grid = grid
+        g.schedule_state = {
+            "version": version,
+            "bookings": {day: dict(booking,
+                                   bookPerm=booking["booker"] == user_id)
+                         for day, booking in bookings.items()},
+            "user": {
+                "id": user_id,
+                "name": g.user["display_name"],
+                "book": g.book_perm,
+                "manage": g.manage_perm
+            }
+        }
 
         return render_template('index.html')
-    
+
     else:
         return render_template('access_denied.html')
+
+
+def get_schedule_grid(week_start: date, today: date, dates: list) -> tuple:
+    """
+    Returns the schedule version, the rendered rows of the schedule table and
+    the bookings they show. The rows are cached by week, day and schedule
+    version, so only the first page load after a booking queries the bookings
+
+    Params
+    ------
+    week_start      The monday the schedule starts on
+    today           The date highlighted in the schedule
+    dates           The dates of the schedule
+    """
+    def render() -> tuple:
+        bookings = get_bookings(user_id=None, dates=[str(d) for d in dates])
+        grid = render_template("schedule_grid.html", dates=dates, today=today,
+                               bookings=bookings)
+
+        return Markup(grid), bookings
+
+    try:
+        version = get_schedule_version()
+
+    except Exception as err:
+        logging.error("Error retrieving schedule version, %s", err)
+        version = None
+
+    if version is None or not current_app.config["FRAGMENT_CACHE"]:
+        return (version,) + render()
+
+    # The version is read before the bookings, so a booking made in between
+    # only means the cached rows are newer than their key
+    return (version,) + fragment_cache.get(
+        current_app.config["DATABASE"], (week_start, today, version), render,
+        current_app.config["FRAGMENT_CACHE_MAX_ENTRIES"])
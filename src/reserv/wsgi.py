@@ -0,0 +1,11 @@
+"""
+The app for WSGI servers. With gunicorn, run
+
+    gunicorn --preload reserv.wsgi:app
+
+so the master imports the app and builds it once, and each worker forked
+from it starts with the config, logging and blueprints already loaded
+"""
+from reserv import create_app
+
+app = create_app()
@@ -0,0 +1,55 @@
+import logging
+import os
+import sys
+
+import pytest
+
+# Allows the tests to be run from a checkout without installing the app
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src"))
+
+from reserv import create_app
+from reserv.bench.dataset import build_dataset
+
+
+@pytest.fixture
+def dataset(tmp_path) -> dict:
+    """
+    A synthetic schedule database of 20 users and a year of bookings, the
+    summary returned by build_dataset along with its path as db_path
+    """
+    db_path = str(tmp_path / "schedule.db")
+    summary = build_dataset(db_path, users=20, years=1, seed=0)
+    summary["db_path"] = db_path
+
+    return summary
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, dataset):
+    """
+    The app serving the synthetic database, with its instance folder, key and
+    log kept out of the source tree
+    """
+    monkeypatch.chdir(tmp_path)
+    logging.disable(logging.INFO)
+
+    app = create_app(instance_path=str(tmp_path / "instance"))
+    app.config.update(TESTING=True, DATABASE=dataset["db_path"])
+
+    yield app
+
+    logging.disable(logging.NOTSET)
+
+
+def login(client, user_id: str):
+    """
+    Logs the test client in as the user without going through the login form
+
+    Params
+    ------
+    client          The Flask test client
+    user_id         The id of the user to log in as
+    """
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
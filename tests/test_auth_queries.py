@@ -0,0 +1,51 @@
+import re
+
+import pytest
+
+from reserv.data.tracing import init_tracing
+
+from conftest import login
+
+
+@pytest.fixture
+def traced_app(app):
+    """
+    The app with SQL tracing enabled, so every response reports the number of
+    statements it ran in its Server-Timing header
+    """
+    app.config["SQL_TRACE"] = True
+    init_tracing(app)
+
+    return app
+
+
+def count_statements(response) -> int:
+    match = re.search(r'desc="(\d+) statements"',
+                      response.headers["Server-Timing"])
+    return int(match.group(1))
+
+
+@pytest.mark.parametrize("path", ["/handlers/check_perm?perm=book",
+                                  "/handlers/get_current_user"])
+def test_authenticated_request_runs_one_statement(traced_app, dataset, path):
+    client = traced_app.test_client()
+    login(client, dataset["bookers"][0])
+
+    # The first request opens the connection and fills the permission cache
+    client.get(path)
+    response = client.get(path)
+
+    assert response.status_code == 200
+    assert count_statements(response) == 1
+
+
+def test_permissions_come_from_the_cache(traced_app, dataset):
+    client = traced_app.test_client()
+    login(client, dataset["bookers"][0])
+    client.get("/handlers/check_perm?perm=book")
+
+    responses = [client.get("/handlers/check_perm", query_string={"perm": perm})
+                 for perm in ("book", "manage", "view")]
+
+    assert [r.json["res"] for r in responses] == [True, False, True]
+    assert [count_statements(r) for r in responses] == [1, 1, 1]
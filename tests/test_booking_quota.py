@@ -0,0 +1,115 @@
+from datetime import date, datetime, timedelta
+import random
+import sqlite3
+
+from flask import session
+
+from reserv.data.db import get_db
+from reserv.data.query import book_date
+
+
+def count_period_bookings(db: sqlite3.Connection, date: str, period: str,
+                          id: str) -> int:
+    """
+    Returns the number of dates the user booked in the period from the date,
+    the query the booking handler used to run for each period
+    """
+    query = """
+        SELECT COUNT(*)
+        FROM schedule
+        WHERE strftime('%s', date)
+        BETWEEN strftime('%s', ?1)
+        AND strftime('%s', DATE(?1, ?2))
+        AND user_id = ?3
+        AND status = 'booked'
+    """
+
+    return db.execute(query, (date, period, id)).fetchone()[0]
+
+
+def legacy_validate_booking(date_str: str) -> bool:
+    """
+    Validates the booking with one query per 7 day period as the booking
+    handler used to
+    """
+    target = datetime.strptime(date_str, "%Y-%m-%d").date()
+    period = 6
+
+    for i in range(period + 1):
+        start_date = datetime.strftime(target - timedelta(days=i), "%Y-%m-%d")
+        res = count_period_bookings(get_db(), date=start_date,
+                                    period=f"{period} days",
+                                    id=session.get("user_id"))
+
+        if res >= 2:
+            return False
+
+    return True
+
+
+def randomise_user(db: sqlite3.Connection, rng: random.Random, user_id: str,
+                   other_id: str, start: date, days: int):
+    """
+    Replaces the bookings in the range with a random set of booked and cancelled
+    dates, mostly made by the supplied user
+    """
+    db.execute("DELETE FROM schedule WHERE date >= ?", (str(start),))
+    density = rng.random()
+
+    for i in range(days):
+        if rng.random() < density:
+            booker = user_id if rng.random() < 0.7 else other_id
+            status = "booked" if rng.random() < 0.8 else "cancelled"
+            db.execute("INSERT INTO schedule (date, user_id, status) VALUES (?,?,?)",
+                       (str(start + timedelta(days=i)), booker, status))
+
+    db.commit()
+
+
+def get_booker(db: sqlite3.Connection, date_str: str) -> str:
+    query = "SELECT user_id FROM schedule WHERE date = ? AND status = 'booked'"
+    res = db.execute(query, (date_str,)).fetchone()
+
+    return res[0] if res else None
+
+
+def test_matches_the_per_period_queries(app, dataset):
+    """
+    book_date gives the same answer as the query per 7 day period it replaced
+    on random schedules
+    """
+    user_id, other_id = dataset["bookers"][:2]
+    start = date.today() + timedelta(days=30)
+    rng = random.Random(0)
+    mismatches = []
+    results = set()
+
+    with app.test_request_context():
+        session["user_id"] = user_id
+        db = get_db()
+
+        for _ in range(200):
+            randomise_user(db, rng, user_id, other_id, start, 28)
+            target = str(start + timedelta(days=rng.randrange(28)))
+
+            # A date the user holds is taken before the quota is checked, a
+            # date someone else holds only once the user is within the quota
+            booker = get_booker(db, target)
+
+            if booker == user_id:
+                expected = "taken"
+            elif not legacy_validate_booking(target):
+                expected = "quota"
+            elif booker is not None:
+                expected = "taken"
+            else:
+                expected = "booked"
+
+            result = book_date(target, user_id, window=7, limit=2)
+            results.add(result)
+
+            if result != expected:
+                mismatches.append((target, expected, result))
+
+    assert mismatches == []
+    assert results == {"booked", "taken", "quota"}
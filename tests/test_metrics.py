@@ -0,0 +1,20 @@
+import re
+
+from conftest import login
+
+
+def test_hit_ratio_of_every_cache(app, dataset):
+    app.config["METRICS_TOKEN"] = "token"
+    client = app.test_client()
+    login(client, dataset["bookers"][0])
+
+    for _ in range(4):
+        assert client.get("/").status_code == 200
+
+    text = client.get("/metrics", headers={"Authorization": "Bearer token"}) \
+        .get_data(as_text=True)
+    ratios = dict(re.findall(r'^reserv_cache_hit_ratio\{cache="(\w+)"\} (\S+)$',
+                             text, re.M))
+
+    assert set(ratios) == {"fragment", "matrix", "user_roles"}
+    assert 0 < float(ratios["fragment"]) < 1
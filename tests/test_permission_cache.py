@@ -0,0 +1,38 @@
+import sqlite3
+import time
+
+from conftest import login
+
+# Role id of users seeded by the schema
+USER_ROLE = 2
+
+
+def check_perm(client, perm: str) -> bool:
+    res = client.get("/handlers/check_perm", query_string={"perm": perm})
+    return res.json["res"]
+
+
+def test_role_permission_changes_reach_running_workers(app, dataset):
+    """
+    A permission granted to a role from another process is picked up once
+    the cached matrix expires, without restarting the app
+    """
+    app.config["PERM_CACHE_TTL"] = 0.2
+    client = app.test_client()
+    login(client, dataset["bookers"][0])
+
+    assert check_perm(client, "manage") is False
+
+    db = sqlite3.connect(dataset["db_path"])
+    db.execute("""
+        INSERT INTO role_permission (role_id, permission_id)
+        SELECT ?, id FROM permission WHERE name = 'manage'
+    """, (USER_ROLE,))
+    db.commit()
+    db.close()
+
+    assert check_perm(client, "manage") is False
+
+    time.sleep(0.3)
+
+    assert check_perm(client, "manage") is True
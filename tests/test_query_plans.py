@@ -0,0 +1,82 @@
+from datetime import date, timedelta
+import re
+
+from reserv.data import query
+from reserv.data.db import get_db
+
+# Small static tables that are fine to scan in full
+SCAN_ALLOWED = {"role", "permission", "role_permission", "schedule_version"}
+
+# Statements that have no query plan worth checking
+SKIP_PREFIXES = ("BEGIN", "COMMIT", "ROLLBACK", "PRAGMA", "SELECT 1", "--")
+
+
+def run_hot_queries(user_id: str, other_id: str):
+    """
+    Calls every query used on the request paths in data/query.py
+    """
+    today = date.today()
+    dates = [str(today + timedelta(days=i)) for i in range(14)]
+
+    query.get_user_by_id(user_id)
+    query.get_name_by_id(user_id)
+    query.get_user_status(user_id)
+    query.get_user_roles(user_id)
+    query.check_perm(user_id, "book")
+    query.get_booking_by_date(dates[0])
+    query.get_bookings_by_dates(dates)
+    query.get_schedule_version()
+    query.get_booked_dates_in_range(user_id, dates[0], dates[-1])
+    query.book_date(str(today + timedelta(days=400)), user_id, 7, 2)
+    query.book_dates([str(today + timedelta(days=420 + i)) for i in range(3)],
+                     user_id, 7, 2)
+    query.update_booking(str(today + timedelta(days=400)), other_id)
+    query.remove_booking(str(today + timedelta(days=400)))
+    query.cancel_bookings_in_range(str(today + timedelta(days=420)),
+                                   str(today + timedelta(days=430)))
+
+
+def find_scans(statements: list) -> list:
+    """
+    Returns every (statement, plan line) where a statement scans a table that
+    isn't in the allowed list
+
+    Params
+    ------
+    statements      The SQL statements to explain
+    """
+    db = get_db()
+    scans = []
+
+    for statement in statements:
+        if statement.lstrip().upper().startswith(SKIP_PREFIXES):
+            continue
+
+        plan = db.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+
+        # Plans name tables by their alias where the statement gives one
+        aliases = dict((alias, table) for table, alias in re.findall(
+            r"(?:FROM|JOIN)\s+(\w+)\s+AS\s+(\w+)", statement, re.IGNORECASE))
+
+        for row in plan:
+            match = re.match(r"SCAN (\w+)", row["detail"])
+
+            if match and aliases.get(match.group(1), match.group(1)) \
+                    not in SCAN_ALLOWED:
+                scans.append((" ".join(statement.split()), row["detail"]))
+
+    return scans
+
+
+def test_hot_queries_use_indexes(app, dataset):
+    statements = []
+
+    with app.app_context():
+        get_db().set_trace_callback(statements.append)
+        run_hot_queries(*dataset["bookers"][:2])
+        get_db().set_trace_callback(None)
+
+        scans = find_scans(statements)
+
+    assert len(statements) > 30
+    assert scans == []
@@ -0,0 +1,118 @@
+from datetime import date, timedelta
+import random
+import shutil
+import sqlite3
+
+import pytest
+
+from reserv.data.memory_storage import MemoryStorage
+from reserv.data.sqlite_storage import SqliteStorage
+
+
+def normalise(value):
+    """
+    Returns the value with rows turned into dicts and the lists whose order
+    the backends don't promise sorted, so results can be compared
+    """
+    if isinstance(value, (sqlite3.Row, dict)):
+        return {key: value[key] for key in value.keys()}
+
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [normalise(item) for item in value]
+        return sorted(items, key=repr)
+
+    if isinstance(value, dict):
+        return {key: normalise(item) for key, item in value.items()}
+
+    return value
+
+
+def make_operations(rng: random.Random, dataset: dict, count: int) -> list:
+    """
+    Returns (name, args, is write) operations covering every storage method,
+    on dates around today and users both known and unknown
+    """
+    today = date.today()
+    users = dataset["bookers"] + [dataset["admin"], "nobody"]
+
+    def day() -> str:
+        return str(today + timedelta(days=rng.randrange(-20, 40)))
+
+    def period() -> tuple:
+        start = today + timedelta(days=rng.randrange(-20, 40))
+        return str(start), str(start + timedelta(days=rng.randrange(14)))
+
+    makers = [
+        lambda: ("get_user", (rng.choice(users),), False),
+        lambda: ("get_display_name", (rng.choice(users),), False),
+        # Status is only looked up for users that exist
+        lambda: ("get_user_status", (rng.choice(users[:-1]),), False),
+        lambda: ("get_role_id", (rng.choice(["admin", "user", "guest", "x"]),),
+                 False),
+        lambda: ("get_permission_id",
+                 (rng.choice(["view", "book", "manage", "x"]),), False),
+        lambda: ("get_user_role_ids", (rng.choice(users),), False),
+        lambda: ("get_role_permission_ids", (rng.randrange(1, 5),), False),
+        lambda: ("get_role_permission_matrix", (), False),
+        lambda: ("get_booking", (day(),), False),
+        lambda: ("get_bookings", ([day() for _ in range(7)],), False),
+        lambda: ("get_booked_dates", (rng.choice(users),) + period(), False),
+        lambda: ("upsert_booking", (day(), rng.choice(users[:-1])), True),
+        lambda: ("upsert_bookings", ([day() for _ in range(3)],
+                                     rng.choice(users[:-1])), True),
+        lambda: ("cancel_booking", (day(),), True),
+        lambda: ("cancel_bookings_in_range", period(), True),
+        lambda: ("update_name", (rng.choice(users[:-1]),
+                                 f"Name {rng.randrange(1000)}"), True),
+        lambda: ("add_user", (f"new{rng.randrange(20)}",
+                              f"New {rng.randrange(20)}", "hash", "active"),
+                 True),
+        lambda: ("add_user_role", (f"new{rng.randrange(20)}",
+                                   rng.randrange(1, 4)), True),
+    ]
+
+    return [rng.choice(makers)() for _ in range(count)]
+
+
+def run_operation(storage, name: str, args: tuple, write: bool):
+    """
+    Runs the operation and returns its normalised result, or the type of the
+    error it raised, along with whether it changed the schedule version
+    """
+    version = storage.get_schedule_version()
+
+    try:
+        if write:
+            result = storage.transaction(
+                lambda: getattr(storage, name)(*args))
+        else:
+            result = getattr(storage, name)(*args)
+
+        result = normalise(result)
+
+    except sqlite3.Error as err:
+        result = type(err).__name__
+
+    return result, storage.get_schedule_version() != version
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_memory_storage_matches_sqlite(app, dataset, tmp_path, seed):
+    """
+    The memory backend gives the same results as the SQLite backend for the
+    same operations on the same data
+    """
+    seed_path = str(tmp_path / "seed.db")
+    shutil.copyfile(dataset["db_path"], seed_path)
+    app.config["STORAGE_SEED"] = seed_path
+
+    sqlite_storage = SqliteStorage()
+    memory_storage = MemoryStorage.from_config(app)
+    operations = make_operations(random.Random(seed), dataset, 400)
+
+    with app.app_context():
+        for i, (name, args, write) in enumerate(operations):
+            expected = run_operation(sqlite_storage, name, args, write)
+            actual = run_operation(memory_storage, name, args, write)
+
+            assert actual == expected, f"operation {i}: {name}{args}"
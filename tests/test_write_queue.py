@@ -0,0 +1,67 @@
+from datetime import date, timedelta
+import sqlite3
+import time
+
+import pytest
+
+from reserv.data.db import run_write, get_write_queue
+from reserv.data.writer import WriteQueue
+
+from conftest import login
+
+
+@pytest.fixture
+def queued_app(app):
+    """
+    The app with writes made through the write queue, a short busy timeout
+    and a write timeout long enough to tell a wait from a failure
+    """
+    app.config.update(DB_WRITE_QUEUE=True, DB_WRITE_TIMEOUT=3,
+                      DB_PRAGMAS=dict(app.config["DB_PRAGMAS"],
+                                      busy_timeout=200))
+
+    return app
+
+
+def test_busy_database_fails_queued_write_at_once(queued_app, dataset):
+    client = queued_app.test_client()
+    login(client, dataset["bookers"][0])
+    booking_date = str(date.today() + timedelta(days=400))
+
+    # Opens the connections and switches the database to WAL first, which
+    # needs the lock held below
+    client.get("/handlers/set_booker",
+               query_string={"date": str(date.today() + timedelta(days=300))})
+
+    # Another process holds the write lock for longer than the busy timeout
+    other = sqlite3.connect(dataset["db_path"], isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+
+    try:
+        start = time.perf_counter()
+        response = client.get("/handlers/set_booker",
+                              query_string={"date": booking_date})
+        elapsed = time.perf_counter() - start
+
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+
+    assert response.status_code == 503
+    assert elapsed < 1
+
+
+def test_writer_survives_unexpected_error(queued_app, monkeypatch):
+    def fail_once(self, db, batch, lock_file):
+        monkeypatch.undo()
+        raise RuntimeError("unexpected")
+
+    with queued_app.app_context():
+        # Starts the writer before the failure is patched in
+        get_write_queue()
+        monkeypatch.setattr(WriteQueue, "_commit", fail_once)
+
+        with pytest.raises(RuntimeError):
+            run_write(lambda: None)
+
+        assert run_write(lambda: "written") == "written"